@@ -0,0 +1,172 @@
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+from contextlib import ExitStack
+from time import monotonic, perf_counter
+from unittest.mock import patch
+
+from simulator import PaperspaceSimulator, SimulatedMachine
+
+API_KEY = "BENCHMARK_KEY"
+MACHINE_ID = "pskwujgcp"
+MACHINE_NAME = "Arcturus"
+# the GUI counts as blocked when its event loop does not run for this long
+BLOCK_THRESHOLD = 0.05
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+class BlockMonitor:
+    # a fast timer on the GUI thread; a late tick means the event loop was blocked
+
+    def __init__(self, interval_ms=5):
+        from PyQt5.QtCore import QTimer
+        self.interval = interval_ms / 1000
+        self.last = None
+        self.gaps = []
+        self.timer = QTimer()
+        self.timer.timeout.connect(self.tick)
+        self.timer.start(interval_ms)
+
+    def tick(self):
+        now = perf_counter()
+        if self.last is not None:
+            self.gaps.append(max(0.0, now - self.last - self.interval))
+        self.last = now
+
+    def stop(self):
+        self.timer.stop()
+        return {"max_block_ms": round(max(self.gaps, default=0) * 1000, 1),
+                "blocked_ms": round(sum(g for g in self.gaps if g > BLOCK_THRESHOLD) * 1000, 1)}
+
+
+def wait_until(condition, timeout=30):
+    from PyQt5.QtCore import QEventLoop, QTimer
+    deadline = monotonic() + timeout
+    while not condition():
+        if monotonic() > deadline:
+            raise TimeoutError("Condition not met in time")
+        loop = QEventLoop()
+        QTimer.singleShot(10, loop.quit)
+        loop.exec_()
+    return monotonic()
+
+
+def external_processes():
+    # ssh and the USB server are not part of the measurement
+    stack = ExitStack()
+    for target in ("remoteplay.sshtunnel.subprocess.Popen", "remoteplay.usbserver.subprocess.Popen"):
+        stack.enter_context(patch(target)).return_value.poll.return_value = None
+    supervisor = stack.enter_context(patch("remoteplay.__main__.TunnelSupervisor"))
+    supervisor.return_value.stats.return_value = {"reconnects": 0, "downtime": 0.0}
+    link_monitor = stack.enter_context(patch("remoteplay.__main__.LinkMonitor")).return_value
+    link_monitor.summary.return_value = "n/a"
+    link_monitor.label.return_value = "Link"
+    link_monitor.description.return_value = "n/a"
+    # the simulated machines have no sshd, so the tunnel opens on the "ready" state
+    stack.enter_context(patch("remoteplay.boot.ssh_banner_probe", return_value=(lambda: False)))
+    return stack
+
+
+def bench_poll_overhead(simulator, polls):
+    from remoteplay.common import check_state, machine_cache
+    requests = simulator.request_count()
+    times = []
+    for _ in range(polls):
+        machine_cache.invalidate()
+        started = perf_counter()
+        check_state(MACHINE_ID, API_KEY)
+        times.append(perf_counter() - started)
+    return {"polls": polls, "median_ms": round(statistics.median(times) * 1000, 2),
+            "p95_ms": round(percentile(times, 95) * 1000, 2),
+            "requests_per_poll": round((simulator.request_count() - requests) / polls, 2)}
+
+
+def bench_change_machine_status(simulator, action, target):
+    from remoteplay.worker import ChangeMachineStatus
+    requests = simulator.request_count()
+    finished = []
+    thread = ChangeMachineStatus(MACHINE_ID, API_KEY, action)
+    thread.finished.connect(lambda: finished.append(monotonic()))
+    started = monotonic()
+    thread.start()
+    done = wait_until(lambda: finished, timeout=60)
+    thread.wait()
+    return {"action": action, "seconds": round(done - started, 2),
+            "detection_lag_s": round(done - simulator.reached(MACHINE_ID, target), 2),
+            "requests": simulator.request_count() - requests}
+
+
+def bench_main_window(simulator):
+    from remoteplay.__main__ import MainWindow
+    requests = simulator.request_count()
+    monitor = BlockMonitor()
+    started = monotonic()
+    window = MainWindow()
+    window.show()
+    shown = wait_until(lambda: window.button.text() == "Start remote")
+    window.start_stop_machine("start")
+    ready = wait_until(lambda: window.machine_state == "ready", timeout=60)
+    ready_lag = ready - simulator.reached(MACHINE_ID, "ready")
+    window.start_stop_machine("stop")
+    off = wait_until(lambda: window.machine_state == "off", timeout=60)
+    off_lag = off - simulator.reached(MACHINE_ID, "off")
+    window.close()
+    return {"startup_ms": round((shown - started) * 1000, 1), "ready_lag_s": round(ready_lag, 2),
+            "off_lag_s": round(off_lag, 2), "requests": simulator.request_count() - requests, **monitor.stop()}
+
+
+def write_config(home):
+    from remoteplay.common import get_config_dir
+    os.makedirs(get_config_dir(), exist_ok=True)
+    with open(os.path.join(get_config_dir(), "config.ini"), "w") as config_file:
+        config_file.write(f"[REMOTE_PLAY]\nmachine_name = {MACHINE_NAME}\napi_key = {API_KEY}\n")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure polling and start/stop behavior against a simulated "
+                                                 "Paperspace API")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated API latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--polls", type=int, default=50)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    home = tempfile.mkdtemp()
+    os.environ.update(HOME=home, USERPROFILE=home, APPDATA=home)
+
+    from PyQt5.QtWidgets import QApplication
+    from remoteplay.common import configure_client
+    app = QApplication(sys.argv[:1])
+    write_config(home)
+
+    machine = SimulatedMachine(MACHINE_ID, MACHINE_NAME, public_ip="127.0.0.1")
+    with PaperspaceSimulator([machine], latency=args.latency, jitter=args.jitter,
+                             error_rate=args.error_rate) as simulator, external_processes():
+        configure_client(base_url=simulator.url)
+        results = {
+            "poll": bench_poll_overhead(simulator, args.polls),
+            "change_machine_status": [bench_change_machine_status(simulator, "start", "ready"),
+                                      bench_change_machine_status(simulator, "stop", "off")],
+            "main_window": bench_main_window(simulator),
+        }
+    app.quit()
+
+    for name, result in results.items():
+        for entry in result if isinstance(result, list) else [result]:
+            print(f"{name:22} " + "   ".join(f"{key} {value}" for key, value in entry.items()))
+    if args.json:
+        with open(args.json, "w") as result_file:
+            json.dump(results, result_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
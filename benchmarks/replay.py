@@ -0,0 +1,83 @@
+import argparse
+import json
+
+
+class VirtualClock:
+    # runs the transitions in no time; sleeping only advances the clock
+
+    def __init__(self):
+        self.elapsed = 0.0
+
+    def now(self):
+        return self.elapsed
+
+    def time(self):
+        return self.elapsed
+
+    def sleep(self, seconds):
+        self.elapsed += max(seconds, 0)
+
+
+def actions(entries):
+    for entry in entries:
+        machine_id, _, action = entry["path"].partition("/")
+        if entry["method"] == "PATCH" and action in ("start", "stop") and "error" not in entry:
+            yield machine_id, action, entry["t"]
+
+
+def reached(entries, machine_id, target, after):
+    for entry in entries:
+        if entry["method"] != "GET" or entry["path"] != "" or entry["t"] < after or "body" not in entry:
+            continue
+        for machine in entry["body"].get("items", []):
+            if machine["id"] == machine_id and machine["state"] == target:
+                return entry["t"]
+    return None
+
+
+def bench_transition(entries, machine_id, action, sent, durations):
+    from remoteplay import common
+    from remoteplay.apitrace import ReplayClient
+    from remoteplay.transition import MachineTransition, TARGET_STATES
+    target = TARGET_STATES.get(action, "off")
+    recorded = reached(entries, machine_id, target, sent)
+    if recorded is None:
+        return None
+    clock = VirtualClock()
+    client = ReplayClient(entries, clock=clock)
+    # start the replay at the recorded request, so that the machine reaches its target at the recorded time
+    client.start = -sent
+    common.client = client
+    common.machine_cache.api_client = client
+    common.machine_cache.clock = clock.now
+    common.machine_cache.invalidate()
+    MachineTransition(machine_id, "REPLAY_KEY", action, clock=clock, durations=durations).run(lambda state: None)
+    return {"machine": machine_id, "action": action, "recorded_s": round(recorded - sent, 1),
+            "detected_s": round(clock.now(), 1), "detection_lag_s": round(clock.now() - (recorded - sent), 1),
+            "requests": client.requests}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the start/stop transitions of a recorded API trace "
+                                                 "through the polling logic, in virtual time")
+    parser.add_argument("trace", help="Trace recorded with api_record or remoteplay-cli --record-api")
+    parser.add_argument("--durations", type=float, nargs="*",
+                        help="Past transition durations in seconds, for the polling schedule")
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    from remoteplay.apitrace import load_trace
+    entries = load_trace(args.trace)
+    results = []
+    for machine_id, action, sent in actions(entries):
+        result = bench_transition(entries, machine_id, action, sent, args.durations)
+        if result is not None:
+            results.append(result)
+            print("   ".join(f"{key} {value}" for key, value in result.items()))
+    if args.json:
+        with open(args.json, "w") as result_file:
+            json.dump(results, result_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,166 @@
+import argparse
+import hashlib
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep
+
+# intermediate states and their durations in seconds, before the target state is reached
+TIMELINES = {"start": [("provisioning", 1.0), ("starting", 2.0)], "stop": [("stopping", 2.0)]}
+TARGET_STATES = {"start": "ready", "stop": "off"}
+
+
+class SimulatedMachine:
+
+    def __init__(self, machine_id, name, state="off", public_ip=None):
+        self.id = machine_id
+        self.name = name
+        self.public_ip = public_ip
+        self.state = state
+        # (start time, timeline, target state) of the running transition
+        self.transition = None
+        # when each state was first reached
+        self.reached = {state: monotonic()}
+
+    def current_state(self, now):
+        if self.transition is not None:
+            started, timeline, target = self.transition
+            elapsed = now - started
+            for state, duration in timeline:
+                if elapsed < duration:
+                    return state
+                elapsed -= duration
+            self.reached.setdefault(target, started + sum(duration for _, duration in timeline))
+            self.state, self.transition = target, None
+        return self.state
+
+    def to_json(self, now):
+        return {"id": self.id, "name": self.name, "state": self.current_state(now), "publicIp": self.public_ip}
+
+
+# Local stand-in for the machines endpoints of the Paperspace API v1, with latency, jitter, errors and
+# scripted start/stop timelines
+class PaperspaceSimulator:
+
+    def __init__(self, machines=None, latency=0.0, jitter=0.0, error_rate=0.0, timelines=None, seed=0):
+        self.machines = {m.id: m for m in (machines or [SimulatedMachine("pskwujgcp", "Arcturus")])}
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timelines = timelines or TIMELINES
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # (method, path, status) of every request
+        self.requests = []
+        self.server = None
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1"
+
+    def start(self, port=0):
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                simulator.handle(self)
+
+            do_PATCH = do_GET
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="api-simulator", daemon=True).start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def reached(self, machine_id, state):
+        with self.lock:
+            machine = self.machines[machine_id]
+            machine.current_state(monotonic())
+            return machine.reached.get(state)
+
+    def request_count(self, method=None):
+        with self.lock:
+            return sum(1 for r in self.requests if method is None or r[0] == method)
+
+    def route(self, method, path, headers):
+        now = monotonic()
+        parts = [p for p in path.split("?")[0].split("/") if p]
+        if parts[:2] != ["v1", "machines"]:
+            return 404, {"error": "not found"}
+        if method == "GET" and len(parts) == 2:
+            body = {"hasMore": False, "items": [m.to_json(now) for m in self.machines.values()]}
+            etag = '"' + hashlib.sha1(json.dumps(body).encode()).hexdigest() + '"'
+            if headers.get("If-None-Match") == etag:
+                return 304, None, etag
+            return 200, body, etag
+        machine = self.machines.get(parts[2]) if len(parts) > 2 else None
+        if machine is None:
+            return 404, {"error": "no such machine"}
+        if method == "GET" and len(parts) == 3:
+            return 200, machine.to_json(now)
+        if method == "PATCH" and len(parts) == 4 and parts[3] in TARGET_STATES:
+            action = parts[3]
+            if machine.current_state(now) != TARGET_STATES[action]:
+                machine.transition = (now, self.timelines[action], TARGET_STATES[action])
+                machine.reached.pop(TARGET_STATES[action], None)
+            return 200, machine.to_json(now)
+        return 400, {"error": "bad request"}
+
+    def handle(self, handler):
+        delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        sleep(delay)
+        with self.lock:
+            if self.random.random() < self.error_rate:
+                status, body, etag = 503, {"error": "simulated failure"}, None
+            else:
+                status, body, *etag = self.route(handler.command, handler.path, handler.headers)
+                etag = etag[0] if etag else None
+            self.requests.append((handler.command, handler.path, status))
+        data = b"" if body is None else json.dumps(body).encode()
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(data)))
+        if etag:
+            handler.send_header("ETag", etag)
+        handler.end_headers()
+        handler.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a simulated Paperspace machines API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.1, help="Response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.05, help="Random latency variation in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with 503")
+    parser.add_argument("--boot-time", type=float, default=60, help="Seconds from start to ready")
+    args = parser.parse_args()
+
+    timelines = {"start": [("provisioning", args.boot_time / 3), ("starting", args.boot_time * 2 / 3)],
+                 "stop": [("stopping", args.boot_time / 3)]}
+    simulator = PaperspaceSimulator(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                    timelines=timelines).start(args.port)
+    print(f"Serving the simulated API on {simulator.url}, press Ctrl+C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        simulator.stop()
+
+
+if __name__ == '__main__':
+    main()
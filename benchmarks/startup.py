@@ -0,0 +1,50 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+MARKER = "remoteplay: first paint"
+
+
+def time_to_first_paint(command, timeout=60):
+    with tempfile.TemporaryDirectory() as home:
+        # start without a saved configuration, so that no network access happens during the measurement
+        env = dict(os.environ, REMOTEPLAY_BENCHMARK_STARTUP="1", HOME=home, USERPROFILE=home, APPDATA=home)
+        started = perf_counter()
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=env)
+        try:
+            for line in process.stdout:
+                if line.strip() == MARKER:
+                    return perf_counter() - started
+        finally:
+            process.wait(timeout)
+    raise RuntimeError(f"{command} exited without painting its window")
+
+
+def measure(name, command, runs):
+    times = [time_to_first_paint(command) * 1000 for _ in range(runs)]
+    print(f"{name:12} min {min(times):7.1f} ms   median {statistics.median(times):7.1f} ms   "
+          f"max {max(times):7.1f} ms   ({runs} runs)")
+    return statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the time from process start until the RemotePlay "
+                                                 "window is painted")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--executable", help="Also measure this PyInstaller executable")
+    parser.add_argument("--max-ms", type=float, help="Fail if a median time exceeds this many milliseconds")
+    args = parser.parse_args()
+
+    medians = [measure("package", [sys.executable, "-m", "remoteplay"], args.runs)]
+    if args.executable:
+        medians.append(measure("executable", [args.executable], args.runs))
+    if args.max_ms is not None and max(medians) > args.max_ms:
+        sys.exit(f"Startup took longer than {args.max_ms} ms")
+
+
+if __name__ == '__main__':
+    main()
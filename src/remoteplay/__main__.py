@@ -1,26 +1,37 @@
-import subprocess
 import os
 import configparser
 import sys
 import logging
-from pkg_resources import get_distribution
-from re import compile
-from .common import check_state, request_get
+from importlib.metadata import version
+from .apitrace import configure_trace
+from .boot import BootPipeline
+from .common import get_config_dir, load_config, rate_limit_headers
+from .connector import ConnectorSelector
+from .metrics import configure_metrics, events, prewarm_starts
+from .monitor import LinkMonitor, parse_address
+from .prewarm import PrewarmPlanner, boot_time, parse_windows
+from .scheduler import PollScheduler
 from .usbserver import UsbServer
-from .sshtunnel import SshTunnel
-from .worker import ChangeMachineStatus
+from .sshtunnel import TunnelSupervisor, create_tunnel, parse_forwards
+from .statecache import StateCache
+from .viewmodel import StatusPanel, machine_state_field, text_field, tunnel_field, usb_server_field
+from .worker import ChangeMachineStatus, StatusEngine
 
-from PyQt5.QtCore import QTimer, QRect, Qt
+from datetime import datetime
+from PyQt5.QtCore import QTimer, QRect, Qt, QObject, QEvent
 from PyQt5.QtWidgets import QMainWindow, QVBoxLayout, QLabel, QLineEdit, QPushButton, QApplication, QWidget, \
-    QGridLayout, QGroupBox, QComboBox, QMessageBox
+    QGridLayout, QGroupBox, QComboBox, QCompleter, QMessageBox
 
-BACKGROUND_GRAY = "background-color: darkgray;"
-BACKGROUND_GREEN = "background-color: green;"
+# how often the pre-warm planner is asked whether the machine should be started, in milliseconds
+PREWARM_CHECK_INTERVAL = 60 * 1000
+
+# set by benchmarks/startup.py to measure the time until the window is painted for the first time
+BENCHMARK_STARTUP = "REMOTEPLAY_BENCHMARK_STARTUP"
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-VERSION = get_distribution('remoteplay').version
+VERSION = version('remoteplay')
 
 
 class MainWindow(QMainWindow):
@@ -28,7 +39,12 @@ class MainWindow(QMainWindow):
     def __init__(self):
         super().__init__()
         self.machines = None
+        # whether the current machine list has arrived, and whether it is being requested
+        self.machines_listed = False
+        self.listing = False
         self.machine_name = None
+        # the machine name last put into the machine selection, which is also the search field
+        self.shown_machine_name = None
         self.machine_id = None
         self.public_ip = None
         self.connect_by = "machine_name"
@@ -36,13 +52,46 @@ class MainWindow(QMainWindow):
         self.machine_state = None
         self.api_key = None
         self.vhusb_path = None
+        self.forwards = None
+        self.monitor_echo = None
+        self.prewarm = None
+        self.ssh_transport = None
 
+        self.updating = False
+        self.scheduler = PollScheduler()
         self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
         self.timer.timeout.connect(self.handle_timer)
+        # counts down the expected time left while a machine is starting or stopping
+        self.eta_timer = QTimer(self)
+        self.eta_timer.timeout.connect(self.show_eta)
+        # starts the machine ahead of the player's usual sessions
+        self.prewarm_timer = QTimer(self)
+        self.prewarm_timer.timeout.connect(self.check_prewarm)
+
+        self.thread = None
+        self.boot_pipeline = None
+        self.engine = StatusEngine()
+        self.engine.machine_page.connect(self.machine_page_loaded)
+        self.engine.machines.connect(self.machines_loaded)
+        self.engine.status.connect(self.state_polled)
+        self.engine.failed.connect(self.request_failed)
+        self.engine.usb_server.connect(self.usb_server_checked)
+        self.engine.host_name.connect(self.host_name_resolved)
+        self.engine.start()
 
         self.load_config()
+        self.state_cache = StateCache().load()
+        self.prewarm_planner = None
+        if self.prewarm:
+            learn, windows = parse_windows(self.prewarm)
+            self.prewarm_planner = PrewarmPlanner(windows, learn, lambda: self.state_cache.sessions(self.machine_id))
+            self.prewarm_timer.start(PREWARM_CHECK_INTERVAL)
 
         self.usb_server = UsbServer(self.vhusb_path)
+        # the last status found by the worker, and whether it is looking again
+        self.usb_status = "unknown"
+        self.usb_check_pending = False
         self.current_state = {
             "machine_id": (lambda: self.machine_id),
             "machine_name": (lambda: self.machine_name),
@@ -72,7 +121,12 @@ class MainWindow(QMainWindow):
         self.machine_name_label = QLabel(self.top_layout_widget)
         self.top_grid_layout.addWidget(self.machine_name_label, 2, 0, 1, 1)
         self.machine_name_text = QComboBox(self.top_layout_widget)
-        self.machine_name_text.setEditable(False)
+        # editable only to search the machines by any part of their name
+        self.machine_name_text.setEditable(True)
+        self.machine_name_text.setInsertPolicy(QComboBox.NoInsert)
+        self.machine_name_text.completer().setFilterMode(Qt.MatchContains)
+        self.machine_name_text.completer().setCaseSensitivity(Qt.CaseInsensitive)
+        self.machine_name_text.completer().setCompletionMode(QCompleter.PopupCompletion)
         self.machine_name_text.setCurrentText(self.machine_name)
         self.machine_name_text.currentIndexChanged.connect(self.init_paperspace_values)
         self.top_grid_layout.addWidget(self.machine_name_text, 2, 2, 1, 1)
@@ -106,16 +160,14 @@ class MainWindow(QMainWindow):
         self.gridLayoutWidget_2 = QWidget(self.lower)
         self.lower_grid_layout = QGridLayout(self.gridLayoutWidget_2)
         self.lower_grid_layout.setContentsMargins(0, 0, 0, 0)
-        self.gridLayoutWidget_2.setGeometry(QRect(20, 40, 360, 120))
+        self.gridLayoutWidget_2.setGeometry(QRect(20, 40, 360, 150))
 
         self.usb_server_bar = QLineEdit(self.gridLayoutWidget_2)
-        self.usb_server_bar.setStyleSheet(BACKGROUND_GRAY)
         self.usb_server_bar.setAlignment(Qt.AlignCenter)
         self.usb_server_bar.setReadOnly(True)
         self.lower_grid_layout.addWidget(self.usb_server_bar, 0, 1, 1, 1)
 
         self.machine_state_bar = QLineEdit(self.gridLayoutWidget_2)
-        self.machine_state_bar.setStyleSheet(BACKGROUND_GRAY)
         self.machine_state_bar.setAlignment(Qt.AlignCenter)
         self.machine_state_bar.setReadOnly(True)
         self.lower_grid_layout.addWidget(self.machine_state_bar, 2, 1, 1, 1)
@@ -129,10 +181,24 @@ class MainWindow(QMainWindow):
 
         self.ssh_tunnel_bar = QLineEdit(self.gridLayoutWidget_2)
         self.ssh_tunnel_bar.setAlignment(Qt.AlignCenter)
-        self.ssh_tunnel_bar.setStyleSheet(BACKGROUND_GRAY)
         self.ssh_tunnel_bar.setReadOnly(True)
         self.lower_grid_layout.addWidget(self.ssh_tunnel_bar, 3, 1, 1, 1)
+        self.link_label = QLabel(self.gridLayoutWidget_2)
+        self.lower_grid_layout.addWidget(self.link_label, 4, 0, 1, 1)
+        self.link_bar = QLineEdit(self.gridLayoutWidget_2)
+        self.link_bar.setAlignment(Qt.AlignCenter)
+        self.link_bar.setReadOnly(True)
+        self.lower_grid_layout.addWidget(self.link_bar, 4, 1, 1, 1)
         self.lower_grid_layout.setColumnMinimumWidth(0, 120)
+        self.status_panel = StatusPanel({
+            "machine_id": self.machine_id_text,
+            "host_name": self.host_name_text,
+            "public_ip": self.public_ip_text,
+            "usb_server": self.usb_server_bar,
+            "ssh_tunnel": self.ssh_tunnel_bar,
+            "link": self.link_bar,
+            "machine_state": self.machine_state_bar
+        })
 
         self.all_layout.addWidget(self.top)
         self.all_layout.addWidget(self.upper)
@@ -141,9 +207,15 @@ class MainWindow(QMainWindow):
         self.all_layout.addWidget(self.button)
         self.setCentralWidget(self.centralwidget)
         self.retranslate_ui()
-        self.ssh_tunnel = SshTunnel()
+        self.ssh_tunnel = create_tunnel(parse_forwards(self.forwards) if self.forwards else None, self.ssh_transport)
+        self.tunnel_supervisor = TunnelSupervisor(self.ssh_tunnel)
+        self.tunnel_supervisor.start()
+        echo = parse_address(self.monitor_echo) if self.monitor_echo else None
+        self.link_monitor = LinkMonitor(self.ssh_tunnel, echo)
+        self.link_label.setText(self.link_monitor.label())
+        self.link_bar.setToolTip(self.link_monitor.description())
+        self.link_monitor.start()
         self.init_paperspace_values()
-        self.ssh_tunnel.host_provider = self.current_state[self.connect_by]
         self.status_change_complete()
 
     def retranslate_ui(self):
@@ -166,36 +238,86 @@ class MainWindow(QMainWindow):
         logger.info("Initializing ...")
         self.api_key = self.paperspace_key_text.text()
         if self.api_key is not None and len(self.api_key) > 0 and self.machine_name_text.count() == 0:
-            self.machine_name_text.currentIndexChanged.disconnect()
-            self.machine_name_text.addItems([m["name"] for m in self.get_machines()])
-            self.machine_name_text.setCurrentText(self.machine_name)
-            self.machine_name_text.currentIndexChanged.connect(self.init_paperspace_values)
+            # show the last known machines right away, the current list replaces them when it arrives
+            cached = self.state_cache.machines(self.api_key)
+            if cached is not None:
+                self.show_machines(cached)
+                state = self.state_cache.state(self.machine_id)
+                if state is not None:
+                    self.apply_state(state)
+            self.list_machines()
+        else:
+            self.select_machine()
+
+    def list_machines(self):
+        self.machines_listed = False
+        self.listing = True
+        self.engine.list_machines(self.api_key)
+
+    # Adds the machines of one page of the list as it arrives; the configured machine is selected as soon as it
+    # is listed, so that large accounts do not wait for the whole list
+    def machine_page_loaded(self, page):
+        known = {m["id"] for m in self.get_machines()}
+        new = [m for m in page if m["id"] not in known]
+        if not new:
+            return
+        self.machines = self.get_machines() + new
+        names = [m["name"] for m in new]
+        self.machine_name_text.currentIndexChanged.disconnect()
+        self.machine_name_text.addItems(names)
+        self.select_name()
+        self.machine_name_text.currentIndexChanged.connect(self.init_paperspace_values)
+        if not self.machine_id and (not self.machine_name or self.machine_name in names):
+            self.select_machine()
+
+    def machines_loaded(self, machines):
+        self.machines_listed = True
+        self.listing = False
+        self.state_cache.set_machines(self.api_key, machines)
+        self.show_machines(machines)
+
+    def show_machines(self, machines):
+        self.machines = machines
+        names = [m["name"] for m in machines]
+        self.machine_name_text.currentIndexChanged.disconnect()
+        if names != [self.machine_name_text.itemText(i) for i in range(self.machine_name_text.count())]:
+            self.machine_name_text.clear()
+            self.machine_name_text.addItems(names)
+        self.select_name()
+        self.machine_name_text.currentIndexChanged.connect(self.init_paperspace_values)
+        self.select_machine()
+
+    def select_name(self):
+        index = self.machine_name_text.findText(self.machine_name or "")
+        if index >= 0:
+            self.machine_name_text.setCurrentIndex(index)
+
+    def select_machine(self):
         self.machine_name = self.machine_name_text.currentText()
         if self.machine_name is not None and len(self.machine_name) > 0 and self.api_key is not None and len(
                 self.api_key) > 0:
             self.machine_id, self.public_ip = self.get_machine(self.machine_name)
             if self.machine_id:
-                self.connect_by, self.hostname = self.determine_host_name()
-                self.machine_state = check_state(self.machine_id, self.api_key)
-                self.save_config()
-                self.set_up_button()
-
-    def determine_host_name(self):
-        connectors = {"machine_name": self.machine_name, "machine_id": self.machine_id, "public_ip": self.public_ip}
-        # try to find a "Host" entry in ~/.ssh/config to determine the host name
-        for type, id in connectors.items():
-            process = subprocess.Popen(["ssh", "-G", id], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            for line in process.stdout:
-                l = line.strip()
-                if l.lower().startswith('hostname'):
-                    return type, l.split()[1]
-        # if not found, return the first argument that looks like an IPv4 or IPv6 address
-        ip = compile("([0-2][0-9][0-9]\\.?){4}|[0-9:]+")
-        for id in connectors.values():
-            if ip.match(id):
-                return id
-        # if none found, return none
-        return None
+                connection = self.state_cache.connection(self.machine_id, self.public_ip)
+                if connection is None:
+                    self.engine.resolve_host_name(self.machine_name, self.machine_id, self.public_ip)
+                else:
+                    self.use_connection(connection)
+
+    def host_name_resolved(self, machine_id, connection):
+        if machine_id != self.machine_id:
+            return
+        self.state_cache.set_connection(self.machine_id, self.public_ip, *connection)
+        self.use_connection(connection)
+        self.update_data()
+
+    def use_connection(self, connection):
+        connectors = {key: self.current_state[key] for key in ("machine_name", "machine_id", "public_ip")}
+        selector = ConnectorSelector(connectors, *connection, self.machine_id, self.state_cache)
+        self.ssh_tunnel.host_provider = selector
+        self.connect_by, self.hostname = selector.connect_by, selector.hostname
+        self.save_config()
+        self.engine.poll(self.machine_id, self.api_key)
 
     def get_machine(self, machine):
         try:
@@ -205,49 +327,39 @@ class MainWindow(QMainWindow):
             return None, None
 
     def get_machines(self):
-        if self.machines is None:
-            self.machines = request_get("", self.api_key)["items"]
-        return self.machines
+        return self.machines or []
 
+    # Updates only the settings the window owns, so that the ones set by hand in config.ini (API client, metrics,
+    # API traces) are kept
     def save_config(self):
         logger.info("Saving configuration ...")
-        home_dir = os.path.expanduser("~")
-        if os.name == 'posix':  # Linux and macOS
-            config_dir = os.path.join(home_dir, ".remoteplay")
-        elif os.name == 'nt':  # Windows
-            config_dir = os.path.join(os.getenv('APPDATA'), 'remoteplay')
-        else:
-            raise OSError("Unsupported operating system")
+        config_dir = get_config_dir()
         if not os.path.exists(config_dir):
             os.makedirs(config_dir)
+        config_file_path = os.path.join(config_dir, 'config.ini')
         config = configparser.ConfigParser()
-        config['REMOTE_PLAY'] = {
-            'machine_name': self.machine_name,
-            'api_key': self.api_key
-        }
-        if self.vhusb_path:
-            config["REMOTE_PLAY"]['vhusb_path'] = self.vhusb_path
-        with open(os.path.join(config_dir, 'config.ini'), 'w') as configfile:
+        config.read(config_file_path)
+        if not config.has_section('REMOTE_PLAY'):
+            config.add_section('REMOTE_PLAY')
+        config.set('REMOTE_PLAY', 'machine_name', self.machine_name or "")
+        config.set('REMOTE_PLAY', 'api_key', self.api_key or "")
+        for key in ('vhusb_path', 'forwards', 'monitor_echo', 'prewarm', 'ssh_transport'):
+            if getattr(self, key):
+                config.set('REMOTE_PLAY', key, getattr(self, key))
+        with open(config_file_path, 'w') as configfile:
             config.write(configfile)
 
     def load_config(self):
         logger.info("Loading configuration ...")
-        home_dir = os.path.expanduser("~")
-        if os.name == 'posix':  # Linux and macOS
-            config_dir = os.path.join(home_dir, ".remoteplay")
-        elif os.name == 'nt':  # Windows
-            config_dir = os.path.join(os.getenv('APPDATA'), 'remoteplay')
-        else:
-            raise OSError("Unsupported operating system")
-        if os.path.exists(config_dir):
-            config_file_path = os.path.join(config_dir, 'config.ini')
-            if os.path.exists(config_file_path):
-                config = configparser.ConfigParser()
-                config.read(config_file_path)
-                if 'REMOTE_PLAY' in config:
-                    self.machine_name = config['REMOTE_PLAY'].get('machine_name')
-                    self.api_key = config['REMOTE_PLAY'].get('api_key')
-                    self.vhusb_path = config['REMOTE_PLAY'].get('vhusb_path')
+        config = load_config()
+        if config is not None:
+            self.machine_name = config.get('machine_name')
+            self.api_key = config.get('api_key')
+            self.vhusb_path = config.get('vhusb_path')
+            self.forwards = config.get('forwards')
+            self.monitor_echo = config.get('monitor_echo')
+            self.prewarm = config.get('prewarm')
+            self.ssh_transport = config.get('ssh_transport')
 
     def set_up_button(self):
 
@@ -274,40 +386,82 @@ class MainWindow(QMainWindow):
             self.button.setText("Please wait")
             self.button.setEnabled(False)
             self.paperspace_key_text.setReadOnly(True)
-
-    def start_stop_machine(self, action):
+            self.show_eta()
+
+    def show_eta(self):
+        remaining = self.thread.remaining() if self.thread is not None else None
+        if remaining is None or self.machine_state in ("ready", "off", None):
+            return
+        if remaining > 0:
+            self.button.setText(f"Please wait, about {int(remaining) // 60}:{int(remaining) % 60:02} left")
+        else:
+            self.button.setText("Please wait, taking longer than usual")
+
+    # Starts the machine, the USB server and, once ready, the tunnel before a usual session begins
+    def check_prewarm(self):
+        if self.machine_state != "off" or self.thread is not None:
+            return
+        durations = self.state_cache.durations(self.machine_id, "start")
+        session = self.prewarm_planner.due(datetime.now(), boot_time(durations))
+        if session is not None:
+            logger.info(f"Pre-warming {self.machine_name} for the session at {session:%H:%M}")
+            prewarm_starts.inc()
+            events.emit("prewarm", machine_id=self.machine_id, session=session.isoformat(timespec="minutes"))
+            self.start_stop_machine("start", prewarm=True)
+
+    def start_stop_machine(self, action, prewarm=False):
         try:
             logger.info(f"{action} requested")
+            if action == "start" and not prewarm:
+                # only the player's own starts are learned from
+                self.state_cache.add_session(self.machine_id)
             self.stop_updating()
             try:
                 self.paperspace_key_text.editingFinished.disconnect()
             except TypeError:
                 pass
+            self.stop_boot_pipeline(cancel=(action == "stop"))
             if action == "stop":
-                self.ssh_tunnel.close()
+                self.ssh_tunnel.shutdown()
                 self.machine_state = "stopping"
             else:
-                self.usb_server.start()
+                self.boot_pipeline = BootPipeline(self.ssh_tunnel, self.usb_server)
+                self.boot_pipeline.start()
                 self.machine_state = "starting"
             self.set_up_button()
             self.update_data()
-            self.thread = ChangeMachineStatus(self.machine_id, self.api_key, action)
+            self.thread = ChangeMachineStatus(self.machine_id, self.api_key, action,
+                                              durations=self.state_cache.durations(self.machine_id, action))
             self.thread.finished.connect(self.status_change_complete)
             self.thread.finished.connect(self.thread.quit)
             self.thread.finished.connect(self.thread.deleteLater)
             self.thread.status.connect(self.update_state)
             self.thread.start()
+            self.eta_timer.start(1000)
         except Exception as e:
             handle_error(e)
 
+    def stop_boot_pipeline(self, cancel=False):
+        if self.boot_pipeline is not None:
+            self.boot_pipeline.stop(cancel)
+            self.boot_pipeline = None
+
     def status_change_complete(self):
         logger.info(f"Target state {self.machine_state} reached")
+        self.eta_timer.stop()
+        if self.boot_pipeline is not None and self.machine_state == "ready" and self.boot_pipeline.ahead():
+            logger.info(f"SSH tunnel was opened {self.boot_pipeline.ahead():.1f} s before the API reported ready")
+        self.stop_boot_pipeline()
+        if self.thread is not None and self.thread.transition.duration is not None:
+            self.state_cache.add_duration(self.machine_id, self.thread.action, self.thread.transition.duration)
         self.thread = None
         try:
             self.paperspace_key_text.editingFinished.connect(self.init_paperspace_values)
         except TypeError:
             pass
         self.start_updating()
+        if self.machine_id and self.machine_state:
+            self.state_cache.set_state(self.machine_id, self.machine_state)
         if self.machine_state == 'ready':
             self.ssh_tunnel.open()
         self.set_up_button()
@@ -318,57 +472,94 @@ class MainWindow(QMainWindow):
         self.update_data()
 
     def handle_timer(self):
+        if self.machine_id:
+            self.engine.poll(self.machine_id, self.api_key)
+            return
+        if self.api_key and not self.machines_listed and not self.listing:
+            # the list failed to load, e.g. when the window was opened offline
+            self.list_machines()
+        self.schedule_next_poll()
+
+    def state_polled(self, machine_id, state):
+        # ignore answers for a machine that is no longer selected or that overlap with a start/stop
+        if machine_id != self.machine_id or self.thread is not None:
+            return
+        self.apply_state(state)
+
+    def apply_state(self, state):
         old_state = self.machine_state
+        self.machine_state = state
+        self.scheduler.observe(state)
+        self.schedule_next_poll()
         self.update_data()
         if old_state != self.machine_state:
+            self.state_cache.set_state(self.machine_id, state)
             self.set_up_button()
             # if the remote machine has been started up by someone else, open the tunnel
             if self.machine_state == "ready":
                 self.ssh_tunnel.open()
             # if the remote machine has been shutdown by someone else, close the tunnel
             else:
-                self.ssh_tunnel.close()
+                self.ssh_tunnel.shutdown()
 
     def update_data(self):
         logger.info(f"Machine state is {self.machine_state}")
-        self.machine_id_text.setText(self.machine_id)
-        self.machine_name_text.setCurrentText(self.machine_name)
-        self.host_name_text.setText(self.hostname)
-        self.public_ip_text.setText(self.public_ip)
-        lmd = self.usb_server.get_status()
-        self.usb_server_bar.setText(lmd)
-        match lmd:
-            case "inactive":
-                self.usb_server_bar.setStyleSheet(BACKGROUND_GRAY)
-            case "active":
-                self.usb_server_bar.setStyleSheet(BACKGROUND_GREEN)
-        lmd = self.ssh_tunnel.check()
-        self.ssh_tunnel_bar.setText(lmd)
-        match lmd:
-            case "closed":
-                self.ssh_tunnel_bar.setStyleSheet(BACKGROUND_GRAY)
-            case "error":
-                self.ssh_tunnel_bar.setStyleSheet("background-color: red;")
-            case "open":
-                self.ssh_tunnel_bar.setStyleSheet(BACKGROUND_GREEN)
-        self.machine_state = check_state(self.machine_id, self.api_key)
-        self.machine_state_bar.setText(self.machine_state)
-        match self.machine_state:
-            case "off":
-                self.machine_state_bar.setStyleSheet(BACKGROUND_GRAY)
-            case "ready":
-                self.machine_state_bar.setStyleSheet(BACKGROUND_GREEN)
-            case _:
-                self.machine_state_bar.setStyleSheet("background-color: yellow;")
+        if isinstance(self.ssh_tunnel.host_provider, ConnectorSelector):
+            self.connect_by = self.ssh_tunnel.host_provider.connect_by
+            self.hostname = self.ssh_tunnel.host_provider.hostname
+        if self.machine_name != self.shown_machine_name:
+            self.shown_machine_name = self.machine_name
+            self.machine_name_text.setCurrentText(self.machine_name)
+        if not self.usb_check_pending:
+            self.usb_check_pending = True
+            self.engine.check_usb_server(self.usb_server)
+        self.status_panel.update(
+            machine_id=text_field(self.machine_id),
+            host_name=text_field(self.hostname),
+            public_ip=text_field(self.public_ip),
+            usb_server=usb_server_field(self.usb_status),
+            ssh_tunnel=tunnel_field(self.ssh_tunnel.check(), self.ssh_tunnel.forward_states(),
+                                    self.tunnel_supervisor.stats(), self.ssh_tunnel.stats()),
+            link=text_field(self.link_monitor.summary()),
+            machine_state=machine_state_field(self.machine_state))
+
+    def usb_server_checked(self, status):
+        self.usb_check_pending = False
+        self.usb_status = status
+        self.status_panel.update(usb_server=usb_server_field(status))
+
+    # an API outage is polled less and less often, like in the command line watch
+    def request_failed(self, error):
+        self.listing = False
+        self.scheduler.observe_error()
+        self.schedule_next_poll()
+
+    def schedule_next_poll(self, *args):
+        if self.updating:
+            self.scheduler.observe_rate_limit(rate_limit_headers())
+            self.timer.start(int(self.scheduler.next_delay() * 1000))
 
     def start_updating(self):
         logger.info("Starting background updates")
-        self.timer.start(5000)
+        self.updating = True
+        self.scheduler.observe(self.machine_state)
+        self.schedule_next_poll()
 
     def stop_updating(self):
         logger.info("Stopping background updates")
+        self.updating = False
         self.timer.stop()
 
+    def closeEvent(self, event):
+        self.stop_updating()
+        self.engine.stop()
+        self.engine.wait()
+        self.prewarm_timer.stop()
+        self.stop_boot_pipeline()
+        self.tunnel_supervisor.stop()
+        self.link_monitor.stop()
+        super().closeEvent(event)
+
 
 def handle_error(e):
     msg = QMessageBox()
@@ -385,11 +576,35 @@ def handle_error(e):
     raise e
 
 
+class FirstPaintProbe(QObject):
+
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Paint:
+            # windowed executables on Windows have no stdout
+            if sys.stdout is not None:
+                print("remoteplay: first paint", flush=True)
+            QApplication.instance().quit()
+        return False
+
+
 def main():
+    config = load_config()
+    if config is not None:
+        configure_metrics(config.get('metrics_port'), config.get('event_log'))
+        configure_trace(config.get('api_record'), config.get('api_replay'), config.getfloat('api_replay_speed', 1.0))
     app = QApplication(sys.argv)
-    main_window = MainWindow()
+    if "--dashboard" in sys.argv[1:]:
+        from .dashboard import DashboardWindow
+        main_window = DashboardWindow()
+    else:
+        main_window = MainWindow()
+    if os.getenv(BENCHMARK_STARTUP):
+        probe = FirstPaintProbe(main_window)
+        main_window.installEventFilter(probe)
     main_window.show()
-    sys.exit(app.exec_())
+    exit_code = app.exec_()
+    main_window.close()
+    sys.exit(exit_code)
 
 
 if __name__ == '__main__':
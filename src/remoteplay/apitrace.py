@@ -0,0 +1,161 @@
+import json
+import logging
+import re
+import threading
+from time import monotonic
+
+from . import common
+from .common import RATE_LIMIT_HEADERS
+from .scheduler import Clock
+
+# request headers that are written to a trace; everything else, above all the bearer token, is left out
+TRACED_REQUEST_HEADERS = ("if-none-match",)
+TRACED_RESPONSE_HEADERS = ("etag",) + RATE_LIMIT_HEADERS
+SECRET_KEYS = re.compile(r"token|secret|password|api_?key|authorization", re.IGNORECASE)
+REDACTED = "[redacted]"
+
+logger = logging.getLogger(__name__)
+
+
+def redact(value, api_key=None):
+    if isinstance(value, dict):
+        return {k: REDACTED if SECRET_KEYS.search(k) else redact(v, api_key) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(item, api_key) for item in value]
+    if isinstance(value, str) and api_key:
+        return value.replace(api_key, REDACTED)
+    return value
+
+
+# Writes every API request of a session as one JSON line: when it was sent relative to the first request, how long
+# it took, and the response. A body that did not change since the last response to the same request is left out.
+class TraceRecorder:
+
+    def __init__(self, path, clock=monotonic):
+        self.path = path
+        self.clock = clock
+        self.start = None
+        self.bodies = {}
+        self.lock = threading.Lock()
+
+    def record(self, method, path, api_key, headers, seconds, response=None, error=None):
+        with self.lock:
+            sent = self.clock() - seconds
+            if self.start is None:
+                self.start = sent
+            entry = {
+                "t": round(sent - self.start, 3),
+                "method": method,
+                "path": redact(path, api_key),
+                "seconds": round(seconds, 3),
+                "request_headers": {k: v for k, v in (headers or {}).items() if k.lower() in TRACED_REQUEST_HEADERS},
+            }
+            if error is not None:
+                entry["error"] = redact(repr(error), api_key)
+            else:
+                entry["status"] = response.status_code
+                entry["headers"] = {k.lower(): v for k, v in response.headers.items()
+                                    if k.lower() in TRACED_RESPONSE_HEADERS}
+                try:
+                    body = redact(json.loads(response.text), api_key)
+                except ValueError:
+                    body = redact(response.text, api_key)
+                key = (method, entry["path"])
+                if key in self.bodies and self.bodies[key] == body:
+                    entry["unchanged"] = True
+                else:
+                    entry["body"] = body
+                    self.bodies[key] = body
+            try:
+                with open(self.path, "a") as trace_file:
+                    trace_file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not write API trace {self.path}: {e!r}")
+
+
+def load_trace(path):
+    entries = []
+    bodies = {}
+    with open(path) as trace_file:
+        for line in trace_file:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            key = (entry["method"], entry["path"])
+            if entry.pop("unchanged", False):
+                entry["body"] = bodies.get(key)
+            elif "body" in entry:
+                bodies[key] = entry["body"]
+            entries.append(entry)
+    return entries
+
+
+class ReplayResponse:
+
+    def __init__(self, status_code, body, headers):
+        from requests.structures import CaseInsensitiveDict
+        self.status_code = status_code
+        self.text = body if isinstance(body, str) else json.dumps(body)
+        self.headers = CaseInsensitiveDict(headers)
+
+    def json(self):
+        return json.loads(self.text)
+
+
+# Stands in for ApiClient and answers from a recorded trace. Time runs from the first request, multiplied by
+# speed; every request gets the last recorded response to the same request up to that time, after its
+# recorded latency. So the machines go through the recorded states at the recorded times, however often
+# they are polled.
+class ReplayClient:
+
+    def __init__(self, entries, speed=1.0, clock=None):
+        self.speed = speed
+        self.clock = clock or Clock()
+        self.start = None
+        self.rate_limit = {}
+        self.requests = 0
+        self.responses = {}
+        for entry in entries:
+            self.responses.setdefault((entry["method"], entry["path"]), []).append(entry)
+
+    def elapsed(self):
+        if self.start is None:
+            self.start = self.clock.now()
+        return (self.clock.now() - self.start) * self.speed
+
+    def request(self, method, path, api_key, headers=None):
+        recorded = self.responses.get((method, path))
+        if not recorded:
+            raise LookupError(f"No {method} {path} in the API trace")
+        self.requests += 1
+        elapsed = self.elapsed()
+        entry = next((e for e in reversed(recorded) if e["t"] <= elapsed), recorded[0])
+        self.clock.sleep(entry["seconds"] / self.speed)
+        if "error" in entry:
+            raise ConnectionError(entry["error"])
+        response = ReplayResponse(entry["status"], entry.get("body"), entry["headers"])
+        etag = response.headers.get("etag")
+        if etag and (headers or {}).get("If-None-Match") == etag:
+            response = ReplayResponse(304, "", entry["headers"])
+        self.rate_limit = {k: v for k, v in response.headers.items() if k.lower() in RATE_LIMIT_HEADERS}
+        return response
+
+    def get(self, path, api_key, headers=None):
+        return self.request("GET", path, api_key, headers)
+
+    def patch(self, path, api_key):
+        return self.request("PATCH", path, api_key)
+
+    def close(self):
+        pass
+
+
+# Records the API traffic to record_path, or answers all API requests from the trace at replay_path
+def configure_trace(record_path=None, replay_path=None, speed=1.0):
+    if replay_path:
+        logger.info(f"Replaying the API trace {replay_path} at {speed}x speed")
+        common.client.close()
+        common.client = ReplayClient(load_trace(replay_path), speed)
+    elif record_path:
+        logger.info(f"Recording the API traffic to {record_path}")
+        common.client.recorder = TraceRecorder(record_path)
@@ -0,0 +1,68 @@
+import logging
+import threading
+
+from .metrics import events
+from .scheduler import Clock
+from .sshtunnel import ssh_banner_probe
+
+# how often sshd is asked for its banner while the machine boots, in seconds
+BOOT_PROBE_INTERVAL = 1
+
+logger = logging.getLogger(__name__)
+
+
+# Runs the steps of a session start next to the API start request: starts the USB server, then probes the
+# machine for an SSH banner and opens the tunnel as soon as sshd answers. The API reporting "ready" is only
+# the fallback, as it usually comes well after sshd is up.
+class BootPipeline:
+
+    def __init__(self, tunnel, usb_server, probe=None, clock=None, interval=BOOT_PROBE_INTERVAL):
+        self.tunnel = tunnel
+        self.usb_server = usb_server
+        self.probe = probe or ssh_banner_probe(lambda: tunnel.host_provider())
+        self.clock = clock or Clock()
+        self.interval = interval
+        self.started = None
+        # seconds from the start until sshd answered
+        self.reachable_after = None
+        self.stopped = threading.Event()
+        self.cancelled = False
+        self.thread = None
+
+    def start(self):
+        self.started = self.clock.now()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="boot-pipeline", daemon=True)
+        self.thread.start()
+
+    # Returns at once, as a probe or tunnel.open() in progress may take seconds; the thread ends after it. With
+    # cancel, a tunnel that it opens in the meantime is shut down again.
+    def stop(self, cancel=False):
+        self.cancelled = self.cancelled or cancel
+        self.stopped.set()
+        self.thread = None
+
+    def run(self):
+        self.usb_server.start()
+        while not self.step() and not self.stopped.wait(self.interval):
+            pass
+
+    # Returns whether the tunnel is up, by this pipeline or otherwise
+    def step(self):
+        if self.tunnel.check() == "open":
+            return True
+        if not self.probe() or self.stopped.is_set():
+            return False
+        self.reachable_after = self.clock.now() - self.started
+        logger.info(f"sshd answered after {self.reachable_after:.1f} s, opening the SSH tunnel")
+        events.emit("ssh_reachable", after=round(self.reachable_after, 3))
+        self.tunnel.open()
+        if self.cancelled:
+            self.tunnel.shutdown()
+        return True
+
+    # Seconds between sshd answering and now, e.g. the API reporting "ready"
+    def ahead(self):
+        if self.reachable_after is None:
+            return None
+        return self.clock.now() - self.started - self.reachable_after
@@ -0,0 +1,198 @@
+import argparse
+import json
+import logging
+import signal
+import sys
+from datetime import datetime, timezone
+from importlib.metadata import version
+
+from .apitrace import configure_trace
+from .common import check_state, load_config, machine_cache, rate_limit_headers
+from .connector import ConnectorSelector
+from .metrics import configure_metrics, prewarm_starts
+from .prewarm import PrewarmPlanner, boot_time, parse_windows
+from .scheduler import Clock, PollScheduler
+from .statecache import StateCache
+from .sshtunnel import TunnelSupervisor, create_tunnel, determine_host_name, parse_forwards
+from .transition import MachineTransition
+from .usbserver import UsbServer
+
+logger = logging.getLogger(__name__)
+
+
+# Headless counterpart of the main window; reports every status as one JSON line
+class Session:
+
+    def __init__(self, machine, api_key, vhusb_path=None, out=None, clock=None, forwards=None, prewarm=None,
+                 ssh_transport=None):
+        self.api_key = api_key
+        self.out = out or sys.stdout
+        self.clock = clock or Clock()
+        self.state_cache = StateCache().load()
+        m = machine_cache.machine(machine, api_key)
+        if m is None:
+            raise LookupError(f"No Paperspace machine named {machine}")
+        self.machine_id = m["id"]
+        self.machine_name = m["name"]
+        self.public_ip = m.get("publicIp")
+        connect_by, hostname = determine_host_name(self.machine_name, self.machine_id, self.public_ip)
+        connectors = {"machine_name": (lambda: self.machine_name), "machine_id": (lambda: self.machine_id),
+                      "public_ip": (lambda: self.public_ip)}
+        self.usb_server = UsbServer(vhusb_path)
+        self.ssh_tunnel = create_tunnel(parse_forwards(forwards) if forwards else None, ssh_transport)
+        self.ssh_tunnel.host_provider = ConnectorSelector(connectors, connect_by, hostname, self.machine_id)
+        self.prewarm_planner = None
+        if prewarm:
+            learn, windows = parse_windows(prewarm)
+            self.prewarm_planner = PrewarmPlanner(windows, learn, lambda: self.state_cache.sessions(self.machine_id))
+
+    def emit(self, event, **fields):
+        record = {
+            "time": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "event": event,
+            "machine_id": self.machine_id,
+            "machine_name": self.machine_name,
+            **fields
+        }
+        self.out.write(json.dumps(record) + "\n")
+        self.out.flush()
+
+    def status(self, state=None, **fields):
+        self.emit("status", state=state or check_state(self.machine_id, self.api_key),
+                  hostname=self.ssh_tunnel.host_provider.hostname,
+                  usb_server=self.usb_server.get_status(), ssh_tunnel=self.ssh_tunnel.check(),
+                  forwards=self.ssh_tunnel.forward_states(), **self.ssh_tunnel.stats(), **fields)
+
+    def change_state(self, action):
+        transition = MachineTransition(self.machine_id, self.api_key, action, self.clock,
+                                       self.state_cache.durations(self.machine_id, action))
+
+        def report(state):
+            remaining = transition.remaining()
+            self.status(state, **({"remaining": round(remaining)} if remaining is not None else {}))
+
+        transition.run(report)
+        if transition.duration is not None:
+            self.state_cache.add_duration(self.machine_id, action, transition.duration)
+
+    def start(self, prewarm=False):
+        if not prewarm:
+            # only the player's own starts are learned from
+            self.state_cache.add_session(self.machine_id, self.clock.time())
+        self.usb_server.start()
+        self.change_state("start")
+
+    # Starts the machine when a usual session is about to begin
+    def check_prewarm(self, state):
+        if self.prewarm_planner is None or state != "off":
+            return state
+        durations = self.state_cache.durations(self.machine_id, "start")
+        session = self.prewarm_planner.due(datetime.fromtimestamp(self.clock.time()), boot_time(durations))
+        if session is None:
+            return state
+        self.emit("prewarm", session=session.isoformat(timespec="minutes"))
+        prewarm_starts.inc()
+        self.start(prewarm=True)
+        return check_state(self.machine_id, self.api_key)
+
+    def stop(self):
+        self.ssh_tunnel.shutdown()
+        self.change_state("stop")
+
+    def watch(self, stop_on_exit=False):
+        scheduler = PollScheduler(self.clock)
+        supervisor = TunnelSupervisor(self.ssh_tunnel)
+        supervisor.start()
+        last = None
+        try:
+            while True:
+                try:
+                    state = self.check_prewarm(check_state(self.machine_id, self.api_key))
+                except Exception as e:
+                    # an API outage leaves the tunnel as it is; the watch goes on once the API answers again
+                    logger.warning("Could not check the machine state: %r", e)
+                    self.emit("error", error=repr(e))
+                    last = None
+                    scheduler.observe_error()
+                    scheduler.observe_rate_limit(rate_limit_headers())
+                    self.clock.sleep(scheduler.next_delay())
+                    continue
+                if state == "ready":
+                    self.ssh_tunnel.open()
+                else:
+                    self.ssh_tunnel.shutdown()
+                current = (state, self.usb_server.get_status(), self.ssh_tunnel.check())
+                if current != last:
+                    self.status(state, **supervisor.stats())
+                    last = current
+                scheduler.observe(state)
+                scheduler.observe_rate_limit(rate_limit_headers())
+                self.clock.sleep(scheduler.next_delay())
+        except KeyboardInterrupt:
+            logger.info("Watch interrupted")
+        finally:
+            supervisor.stop()
+            self.ssh_tunnel.shutdown()
+            if stop_on_exit:
+                self.stop()
+
+
+def terminate(signum, frame):
+    raise KeyboardInterrupt()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="remoteplay-cli",
+                                     description="Start, stop and watch a Paperspace machine without the GUI")
+    parser.add_argument("--version", action="version", version=version("remoteplay"))
+    parser.add_argument("-m", "--machine", help="Paperspace machine name or ID")
+    parser.add_argument("-a", "--api-key", help="Paperspace API key")
+    parser.add_argument("--vhusb-path", help="Path of the VirtualHere USB server executable")
+    parser.add_argument("--forwards",
+                        help="Comma separated ssh forwards, e.g. \"-R 7575:localhost:7575, -L 8080:localhost:80\"")
+    parser.add_argument("--ssh-transport", choices=["openssh", "paramiko"],
+                        help="Run the ssh binary (default) or keep the SSH connection in this process")
+    parser.add_argument("--metrics-port", type=int, help="Serve Prometheus metrics on this local port")
+    parser.add_argument("--event-log", help="Append structured events as JSON lines to this file")
+    parser.add_argument("--prewarm", help="Start the machine ahead of these sessions while watching, "
+                                          "e.g. \"auto; mon-fri 19:00; sat,sun 10:30\"")
+    parser.add_argument("--record-api", metavar="PATH", help="Append every Paperspace API request and response to "
+                                                              "this trace file, without the API key")
+    parser.add_argument("--replay-api", metavar="PATH", help="Answer all Paperspace API requests from this trace file")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="Replay the trace this many times faster")
+    parser.add_argument("--log-level", default="info", choices=["debug", "info", "warn", "error"])
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("status", help="Print the current status")
+    commands.add_parser("start", help="Start the USB server and the machine and wait until it is ready")
+    commands.add_parser("stop", help="Stop the machine and wait until it is off")
+    watch = commands.add_parser("watch", help="Keep the SSH tunnel open while the machine is ready")
+    watch.add_argument("--stop-on-exit", action="store_true", help="Stop the machine when interrupted")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=args.log_level.upper().replace("WARN", "WARNING"), stream=sys.stderr)
+    config = load_config() or {}
+    machine = args.machine or config.get('machine_name')
+    api_key = args.api_key or config.get('api_key')
+    if not machine or not api_key:
+        parser.error("machine and API key must be given as options or in config.ini")
+
+    configure_trace(args.record_api or config.get('api_record'), args.replay_api or config.get('api_replay'),
+                    args.replay_speed)
+    configure_metrics(args.metrics_port or config.get('metrics_port'), args.event_log or config.get('event_log'))
+    session = Session(machine, api_key, args.vhusb_path or config.get('vhusb_path'),
+                      forwards=args.forwards or config.get('forwards'), prewarm=args.prewarm or config.get('prewarm'),
+                      ssh_transport=args.ssh_transport or config.get('ssh_transport'))
+    match args.command:
+        case "status":
+            session.status()
+        case "start":
+            session.start()
+        case "stop":
+            session.stop()
+        case "watch":
+            signal.signal(signal.SIGTERM, terminate)
+            session.watch(args.stop_on_exit)
+
+
+if __name__ == '__main__':
+    main()
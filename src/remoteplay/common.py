@@ -1,25 +1,245 @@
-import requests
+import configparser
+import os
+import threading
 from json import loads
+from time import monotonic
+from urllib.parse import urlencode
+
+from .metrics import api_latency, api_requests, events, polls
 
 PAPERSPACE_API = "https://api.paperspace.com/v1"
 
+# (connect, read) timeout in seconds
+TIMEOUT = (5, 30)
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+# how long a fetched machine list is considered current
+MACHINE_LIST_TTL = 2
+RATE_LIMIT_HEADERS = ("retry-after", "x-ratelimit-remaining", "x-ratelimit-reset", "ratelimit-remaining",
+                      "ratelimit-reset")
+
+
+class ApiClient:
+
+    def __init__(self, base_url=PAPERSPACE_API, timeout=TIMEOUT, retries=RETRIES, backoff_factor=BACKOFF_FACTOR,
+                 pool_size=4):
+        self.base_url = base_url
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff_factor = backoff_factor
+        self.pool_size = pool_size
+        self.rate_limit = {}
+        # a TraceRecorder that gets every request, see apitrace
+        self.recorder = None
+        self._session = None
+        self._session_lock = threading.Lock()
+
+    # requests takes a noticeable part of the startup time to import, so it is loaded with the first request
+    @property
+    def session(self):
+        with self._session_lock:
+            if self._session is None:
+                import requests
+                from requests.adapters import HTTPAdapter
+                from urllib3.util.retry import Retry
+                # only GET is retried after the request was sent; a start/stop PATCH is retried on connect errors only
+                retry = Retry(total=self.retries, backoff_factor=self.backoff_factor,
+                              status_forcelist=(429, 500, 502, 503, 504), allowed_methods=frozenset(["GET"]),
+                              raise_on_status=False)
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size, max_retries=retry)
+                self._session = requests.Session()
+                self._session.mount("https://", adapter)
+                self._session.mount("http://", adapter)
+                self._session.headers["accept"] = "application/json"
+            return self._session
+
+    def request(self, method, path, api_key, headers=None):
+        start = monotonic()
+        status = "error"
+        response = error = None
+        try:
+            response = self.session.request(method, f"{self.base_url}/machines/{path}", headers={
+                "authorization": f"Bearer {api_key}",
+                **(headers or {})
+            }, timeout=self.timeout)
+            status = response.status_code
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            elapsed = monotonic() - start
+            api_latency.observe(elapsed, method=method)
+            api_requests.inc(method=method, status=status)
+            events.emit("api_request", method=method, status=status, seconds=round(elapsed, 3))
+            if self.recorder is not None:
+                self.recorder.record(method, path, api_key, headers, elapsed, response, error)
+        self.rate_limit = {k: v for k, v in response.headers.items() if k.lower() in RATE_LIMIT_HEADERS}
+        return response
+
+    def get(self, path, api_key, headers=None):
+        return self.request("GET", path, api_key, headers)
+
+    def patch(self, path, api_key):
+        return self.request("PATCH", path, api_key)
+
+    def close(self):
+        if self._session is not None:
+            self._session.close()
+
+
+client = ApiClient()
+
+
+def configure_client(**kwargs):
+    global client
+    if not isinstance(client, ApiClient):
+        # an API trace is being replayed
+        return client
+    recorder = client.recorder
+    client.close()
+    client = ApiClient(**kwargs)
+    client.recorder = recorder
+    return client
+
+
+def get_config_dir():
+    home_dir = os.path.expanduser("~")
+    if os.name == 'posix':  # Linux and macOS
+        return os.path.join(home_dir, ".remoteplay")
+    elif os.name == 'nt':  # Windows
+        return os.path.join(os.getenv('APPDATA'), 'remoteplay')
+    else:
+        raise OSError("Unsupported operating system")
+
+
+# Returns the REMOTE_PLAY section of config.ini, or None if there is none; also applies the API client settings
+def load_config():
+    config_file_path = os.path.join(get_config_dir(), 'config.ini')
+    if not os.path.exists(config_file_path):
+        return None
+    config = configparser.ConfigParser()
+    config.read(config_file_path)
+    if 'REMOTE_PLAY' not in config:
+        return None
+    section = config['REMOTE_PLAY']
+    if 'api_timeout' in section or 'api_retries' in section:
+        configure_client(timeout=(TIMEOUT[0], section.getfloat('api_timeout', TIMEOUT[1])),
+                         retries=section.getint('api_retries', RETRIES))
+    return section
+
+
+# Snapshot of the machine list shared by the machine selection, the host name lookup and the status polls
+class MachineCache:
+
+    def __init__(self, ttl=MACHINE_LIST_TTL, clock=monotonic, api_client=None):
+        self.ttl = ttl
+        self.clock = clock
+        self.api_client = api_client
+        self.lock = threading.Lock()
+        self.api_key = None
+        self.items = None
+        self.etag = None
+        self.fetched_at = None
+        # whether the list of the account is longer than one page
+        self.paginated = False
+
+    # Returns the items of one page of the machine list, the path of the next page if there is one, and the ETag;
+    # the items are None if the list did not change
+    def fetch_page(self, api_key, path, headers=None):
+        response = (self.api_client or client).get(path, api_key, headers)
+        if response.status_code == 304:
+            return None, None, None
+        page = loads(response.text)
+        next_path = "?" + urlencode({"after": page["nextPage"]}) if page.get("hasMore") and page.get("nextPage") else None
+        return page["items"], next_path, response.headers.get("ETag")
+
+    # Yields the machine list page by page as the pages arrive; the whole list is kept once the last one is in.
+    # The lock is only held while a page is fetched, so the consumer can use the cache between the pages. Only a
+    # list that fits in one page is revalidated with its ETag, as the ETag does not cover the other pages.
+    def pages(self, api_key, force=False):
+        with self.lock:
+            if api_key != self.api_key:
+                self.api_key, self.items, self.etag, self.fetched_at = api_key, None, None, None
+                self.paginated = False
+            path = None
+            if not force and self.is_fresh():
+                items = self.items
+            else:
+                headers = {"If-None-Match": self.etag} if self.etag and self.items is not None else None
+                items, path, etag = self.fetch_page(api_key, "", headers)
+                if items is not None:
+                    self.paginated = path is not None
+                if items is None:
+                    items = self.items
+                    self.fetched_at = self.clock()
+                elif path is None:
+                    self.items, self.etag, self.fetched_at = items, etag, self.clock()
+        yield items
+        while path is not None:
+            with self.lock:
+                page, path, _ = self.fetch_page(api_key, path)
+                items = items + page
+                if path is None and api_key == self.api_key:
+                    self.items, self.etag, self.fetched_at = items, None, self.clock()
+            yield page
+
+    def machines(self, api_key, force=False):
+        pages = list(self.pages(api_key, force))
+        return pages[0] if len(pages) == 1 else [machine for page in pages for machine in page]
+
+    # Stops reading pages once the machine is listed
+    def machine(self, machine, api_key):
+        for page in self.pages(api_key):
+            found = next((m for m in page if m["id"] == machine or m["name"] == machine), None)
+            if found is not None:
+                return found
+        return None
+
+    # On an account whose list is longer than one page, a poll asks for the one machine unless the whole list is
+    # still fresh, so that it does not walk all the pages
+    def state(self, machine_id, api_key):
+        if self.paginated and api_key == self.api_key and not self.is_fresh():
+            response = (self.api_client or client).get(machine_id, api_key)
+            m = loads(response.text) if response.status_code == 200 else None
+        else:
+            m = self.machine(machine_id, api_key)
+        return m["state"] if m else "unknown"
+
+    def is_fresh(self):
+        return self.fetched_at is not None and self.clock() - self.fetched_at < self.ttl
+
+    def invalidate(self):
+        with self.lock:
+            self.fetched_at = None
+
+
+machine_cache = MachineCache()
+
+
+def rate_limit_headers():
+    return client.rate_limit
+
+
+def get_machines(api_key):
+    polls.inc(kind="machines")
+    return machine_cache.machines(api_key)
+
+
+def get_machine_pages(api_key):
+    polls.inc(kind="machines")
+    return machine_cache.pages(api_key)
+
 
 def check_state(machine_id, api_key):
-    return request_get(machine_id, api_key)["state"] if machine_id else "unknown"
+    polls.inc(kind="state")
+    return machine_cache.state(machine_id, api_key) if machine_id else "unknown"
 
 
 def request_get(path, api_key):
-    response = requests.get(f"{PAPERSPACE_API}/machines/{path}", headers={
-        "accept": "application/json",
-        "authorization": f"Bearer {api_key}"
-    })
+    response = client.get(path, api_key)
     return loads(response.text)
 
 
 def request_patch(path, api_key):
-    response = requests.patch(f"{PAPERSPACE_API}/machines/{path}", headers={
-        "accept": "application/json",
-        "authorization": f"Bearer {api_key}"
-    })
+    response = client.patch(path, api_key)
     return loads(response.text)
-
@@ -0,0 +1,106 @@
+import concurrent.futures
+import logging
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from .scheduler import Clock
+from .sshconfig import resolve_address
+
+# how long a race waits for the slowest candidate, in seconds
+RACE_TIMEOUT = 1.0
+# after a race without any reachable candidate, the next one waits this long
+RACE_RETRY = 10
+
+logger = logging.getLogger(__name__)
+
+
+def network_id():
+    # connecting a UDP socket sends nothing, it only picks the local address of the default route
+    try:
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as probe:
+            probe.connect(("192.0.2.1", 9))
+            return probe.getsockname()[0]
+    except OSError:
+        return None
+
+
+def connect_time(host, timeout, clock):
+    hostname, port = resolve_address(host)
+    if hostname is None:
+        raise OSError(f"Cannot resolve {host}")
+    start = clock.now()
+    socket.create_connection((hostname, port), timeout).close()
+    return hostname, clock.now() - start
+
+
+# Connects to the ssh port of all candidates at once; the first one to answer is the fastest reachable one.
+# Returns (connect_by, hostname, rtt) or None.
+def race(candidates, timeout=RACE_TIMEOUT, clock=None):
+    clock = clock or Clock()
+    candidates = {connect_by: host for connect_by, host in candidates.items() if host}
+    if not candidates:
+        return None
+    executor = ThreadPoolExecutor(max_workers=len(candidates), thread_name_prefix="connector-race")
+    futures = {executor.submit(connect_time, host, timeout, clock): connect_by
+               for connect_by, host in candidates.items()}
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            try:
+                hostname, rtt = future.result()
+            except OSError as e:
+                logger.debug(f"{futures[future]} is not reachable: {e!r}")
+                continue
+            logger.info(f"Connecting by {futures[future]} ({hostname}), ssh port answered in {rtt * 1000:.0f} ms")
+            return futures[future], hostname, rtt
+    # before Python 3.11 this is not the builtin TimeoutError
+    except concurrent.futures.TimeoutError:
+        pass
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+    return None
+
+
+# Host provider of a tunnel that races the machine name, ID and public IP and remembers the winner per network
+class ConnectorSelector:
+
+    def __init__(self, connectors, connect_by, hostname=None, machine_id=None, state_cache=None, network=network_id,
+                 race=race, clock=None):
+        self.connectors = connectors
+        self.connect_by = connect_by
+        self.hostname = hostname
+        self.machine_id = machine_id
+        self.state_cache = state_cache
+        self.network = network
+        self.race = race
+        self.clock = clock or Clock()
+        self.raced_network = None
+        self.next_race = 0
+        self.lock = threading.Lock()
+        current = self.network()
+        route = state_cache.route(machine_id, current) if state_cache is not None else None
+        if route is not None:
+            self.connect_by, self.hostname = route
+            self.raced_network = current
+
+    def __call__(self):
+        return self.connectors.get(self.connect_by, lambda: None)()
+
+    def needs_race(self):
+        return self.raced_network != self.network() and self.clock.now() >= self.next_race
+
+    # Races the candidates and switches to the winner; returns whether the host changed
+    def reevaluate(self):
+        with self.lock:
+            current = self.network()
+            winner = self.race({connect_by: provider() for connect_by, provider in self.connectors.items()})
+            if winner is None:
+                self.next_race = self.clock.now() + RACE_RETRY
+                return False
+            connect_by, self.hostname, rtt = winner
+            changed = connect_by != self.connect_by
+            self.connect_by = connect_by
+            self.raced_network = current
+            if self.state_cache is not None:
+                self.state_cache.set_route(self.machine_id, current, connect_by, self.hostname)
+            return changed
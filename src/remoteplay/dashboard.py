@@ -0,0 +1,294 @@
+import logging
+
+from PyQt5.QtCore import Qt, QAbstractTableModel, QModelIndex, QTimer
+from PyQt5.QtGui import QColor
+from PyQt5.QtWidgets import QMainWindow, QTableView, QVBoxLayout, QHBoxLayout, QWidget, QPushButton, QLineEdit, \
+    QLabel, QAbstractItemView, QHeaderView
+
+from .common import load_config
+from .connector import ConnectorSelector
+from .scheduler import PollScheduler, STEADY_STATES
+from .sshtunnel import TunnelSupervisor, create_tunnel, parse_forwards
+from .usbserver import UsbServer
+from .transition import machine_actions
+from .worker import ChangeMachineStatus, StatusEngine
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ["Name", "Machine ID", "State", "Public IP", "SSH Tunnel"]
+# columns that are colored by their value
+STATUS_COLUMNS = (2, 4)
+STATE_COLORS = {
+    "off": QColor("darkgray"),
+    "ready": QColor("green"),
+    "open": QColor("green"),
+    "closed": QColor("darkgray"),
+    "error": QColor("red"),
+}
+TRANSITION_COLOR = QColor("yellow")
+
+
+class MachineTableModel(QAbstractTableModel):
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.rows = []
+        self.row_by_id = {}
+
+    @staticmethod
+    def row_values(machine, tunnel_state):
+        return [machine["name"], machine["id"], machine["state"], machine.get("publicIp"), tunnel_state]
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        value = self.rows[index.row()][index.column()]
+        if role == Qt.DisplayRole:
+            return value
+        if role == Qt.BackgroundRole and index.column() in STATUS_COLUMNS:
+            return STATE_COLORS.get(value, TRANSITION_COLOR)
+        return None
+
+    def machine_id(self, row):
+        return self.rows[row][1]
+
+    # Applies a new snapshot and only notifies the views about rows that were added, removed or changed.
+    # Returns the number of changed rows.
+    def update_machines(self, machines, tunnel_states):
+        changed = 0
+        current = {m["id"]: m for m in machines}
+        for row in reversed(range(len(self.rows))):
+            if self.rows[row][1] not in current:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                del self.rows[row]
+                self.endRemoveRows()
+                changed += 1
+        self.row_by_id = {values[1]: row for row, values in enumerate(self.rows)}
+        for machine_id, machine in current.items():
+            values = self.row_values(machine, tunnel_states.get(machine_id, "closed"))
+            row = self.row_by_id.get(machine_id)
+            if row is None:
+                row = len(self.rows)
+                self.beginInsertRows(QModelIndex(), row, row)
+                self.rows.append(values)
+                self.row_by_id[machine_id] = row
+                self.endInsertRows()
+                changed += 1
+            elif self.rows[row] != values:
+                columns = [c for c, (old, new) in enumerate(zip(self.rows[row], values)) if old != new]
+                self.rows[row] = values
+                self.dataChanged.emit(self.index(row, min(columns)), self.index(row, max(columns)))
+                changed += 1
+        return changed
+
+
+# Tracks all machines of the account with one list request per poll; every machine has its own tunnel
+class DashboardWindow(QMainWindow):
+
+    def __init__(self):
+        super().__init__()
+        self.api_key = None
+        self.vhusb_path = None
+        self.forwards = None
+        self.ssh_transport = None
+        self.machines = []
+        self.tunnels = {}
+        self.supervisors = {}
+        self.transitions = {}
+        # machines whose tunnel opens once the worker has resolved their host name
+        self.opening = set()
+        self.usb_check_pending = False
+        self.load_config()
+
+        self.usb_server = UsbServer(self.vhusb_path)
+        self.scheduler = PollScheduler()
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.handle_timer)
+
+        self.engine = StatusEngine()
+        self.engine.machines.connect(self.machines_loaded)
+        self.engine.failed.connect(self.schedule_next_poll)
+        self.engine.usb_server.connect(self.usb_server_checked)
+        self.engine.host_name.connect(self.host_name_resolved)
+        self.engine.start()
+
+        self.resize(720, 600)
+        self.setWindowTitle("RemotePlay machines")
+        self.centralwidget = QWidget()
+        self.all_layout = QVBoxLayout(self.centralwidget)
+        self.top_layout = QHBoxLayout()
+        self.paperspace_key_label = QLabel("Paperspace API key")
+        self.paperspace_key_text = QLineEdit()
+        self.paperspace_key_text.setText(self.api_key)
+        self.paperspace_key_text.editingFinished.connect(self.handle_timer)
+        self.top_layout.addWidget(self.paperspace_key_label)
+        self.top_layout.addWidget(self.paperspace_key_text)
+        self.all_layout.addLayout(self.top_layout)
+
+        self.model = MachineTableModel(self)
+        self.table = QTableView()
+        self.table.setModel(self.model)
+        self.table.setSelectionBehavior(QAbstractItemView.SelectRows)
+        self.table.setSelectionMode(QAbstractItemView.SingleSelection)
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.all_layout.addWidget(self.table)
+
+        self.button_layout = QHBoxLayout()
+        self.start_button = QPushButton("Start")
+        self.start_button.clicked.connect(lambda: self.start_stop_machine("start"))
+        self.stop_button = QPushButton("Stop")
+        self.stop_button.clicked.connect(lambda: self.start_stop_machine("stop"))
+        self.cancel_button = QPushButton("Cancel queued")
+        self.cancel_button.clicked.connect(self.cancel_pending)
+        self.tunnel_button = QPushButton("Open/close tunnel")
+        self.tunnel_button.clicked.connect(self.toggle_tunnel)
+        for button in (self.start_button, self.stop_button, self.cancel_button, self.tunnel_button):
+            self.button_layout.addWidget(button)
+        self.all_layout.addLayout(self.button_layout)
+        self.usb_server_label = QLabel()
+        self.all_layout.addWidget(self.usb_server_label)
+        self.setCentralWidget(self.centralwidget)
+
+        self.handle_timer()
+
+    def load_config(self):
+        config = load_config()
+        if config is not None:
+            self.api_key = config.get('api_key')
+            self.vhusb_path = config.get('vhusb_path')
+            self.forwards = config.get('forwards')
+            self.ssh_transport = config.get('ssh_transport')
+
+    def handle_timer(self):
+        self.api_key = self.paperspace_key_text.text()
+        if self.api_key:
+            self.engine.list_machines(self.api_key)
+        else:
+            self.schedule_next_poll()
+
+    def machines_loaded(self, machines):
+        self.machines = machines
+        states = {m["id"]: m["state"] for m in machines}
+        for machine_id, tunnel in self.tunnels.items():
+            if states.get(machine_id) != "ready":
+                tunnel.shutdown()
+        changed = self.model.update_machines(machines, self.tunnel_states())
+        if not self.usb_check_pending:
+            self.usb_check_pending = True
+            self.engine.check_usb_server(self.usb_server)
+        if changed:
+            self.scheduler.reset()
+        steady = all(state in STEADY_STATES for state in states.values()) and not self.transitions
+        self.scheduler.observe("ready" if steady else "starting")
+        self.schedule_next_poll()
+
+    def usb_server_checked(self, status):
+        self.usb_check_pending = False
+        self.usb_server_label.setText(f"USB Server: {status}")
+
+    def tunnel_states(self):
+        return {machine_id: tunnel.check() for machine_id, tunnel in self.tunnels.items()}
+
+    def schedule_next_poll(self, *args):
+        self.timer.start(int(self.scheduler.next_delay() * 1000))
+
+    def selected_machine(self):
+        rows = self.table.selectionModel().selectedRows()
+        if not rows:
+            return None
+        machine_id = self.model.machine_id(rows[0].row())
+        return next((m for m in self.machines if m["id"] == machine_id), None)
+
+    # A start or stop while the other one runs is queued behind it; the same action twice is ignored
+    def start_stop_machine(self, action):
+        machine = self.selected_machine()
+        if machine is None:
+            return
+        machine_id = machine["id"]
+        queued = self.transitions.setdefault(machine_id, [])
+        if queued and queued[-1][0] == action:
+            return
+        if action == "start":
+            self.usb_server.start()
+        elif machine_id in self.tunnels:
+            self.tunnels[machine_id].shutdown()
+        thread = ChangeMachineStatus(machine_id, self.api_key, action)
+        thread.finished.connect(lambda: self.status_change_complete(machine_id, thread))
+        thread.finished.connect(thread.quit)
+        thread.finished.connect(thread.deleteLater)
+        queued.append((action, thread))
+        thread.start()
+        self.handle_timer()
+
+    def cancel_pending(self):
+        machine = self.selected_machine()
+        if machine is not None and machine_actions.cancel(machine["id"]):
+            logger.info(f"Pending action of {machine['id']} cancelled")
+
+    def status_change_complete(self, machine_id, thread):
+        queued = [entry for entry in self.transitions.get(machine_id, []) if entry[1] is not thread]
+        if queued:
+            self.transitions[machine_id] = queued
+        else:
+            self.transitions.pop(machine_id, None)
+        self.handle_timer()
+
+    def toggle_tunnel(self):
+        machine = self.selected_machine()
+        if machine is None:
+            return
+        tunnel = self.tunnels.get(machine["id"])
+        if machine["id"] in self.opening:
+            self.opening.discard(machine["id"])
+        elif tunnel is not None and tunnel.check() == "open":
+            tunnel.close()
+        elif machine["state"] == "ready":
+            self.opening.add(machine["id"])
+            self.engine.resolve_host_name(machine["name"], machine["id"], machine.get("publicIp"))
+        self.model.update_machines(self.machines, self.tunnel_states())
+
+    def host_name_resolved(self, machine_id, connection):
+        machine = next((m for m in self.machines if m["id"] == machine_id), None)
+        if machine_id not in self.opening or machine is None:
+            return
+        self.opening.discard(machine_id)
+        if machine["state"] != "ready":
+            return
+        tunnel = self.tunnels.get(machine_id)
+        if tunnel is None:
+            forwards = parse_forwards(self.forwards) if self.forwards else None
+            tunnel = self.tunnels[machine_id] = create_tunnel(forwards, self.ssh_transport)
+            supervisor = self.supervisors[machine_id] = TunnelSupervisor(tunnel)
+            supervisor.start()
+        connectors = {"machine_name": (lambda: machine["name"]), "machine_id": (lambda: machine["id"]),
+                      "public_ip": (lambda: machine.get("publicIp"))}
+        tunnel.host_provider = ConnectorSelector(connectors, *connection, machine_id)
+        tunnel.open()
+        self.model.update_machines(self.machines, self.tunnel_states())
+
+    def closeEvent(self, event):
+        self.timer.stop()
+        for supervisor in self.supervisors.values():
+            supervisor.stop()
+        for tunnel in self.tunnels.values():
+            tunnel.shutdown()
+        self.engine.stop()
+        self.engine.wait()
+        for machine_id in self.transitions:
+            machine_actions.cancel(machine_id)
+        for queued in list(self.transitions.values()):
+            for action, thread in queued:
+                thread.wait()
+        super().closeEvent(event)
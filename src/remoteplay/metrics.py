@@ -0,0 +1,184 @@
+import json
+import logging
+import threading
+from datetime import datetime, timezone
+
+# upper bounds in seconds
+API_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+TRANSITION_BUCKETS = (10, 30, 60, 120, 180, 300, 600, 1200)
+
+logger = logging.getLogger(__name__)
+
+
+def label_text(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{value}"' for name, value in labels) + "}"
+
+
+class Counter:
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), 0)
+
+    def samples(self):
+        with self.lock:
+            return [(self.name, labels, value) for labels, value in self.values.items()]
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[tuple(sorted(labels.items()))] = value
+
+
+class Histogram:
+    type = "histogram"
+
+    def __init__(self, name, help, buckets):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        # labels: (bucket counts, sum, count)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total, count = self.values.get(key, ([0] * len(self.buckets), 0, 0))
+            counts = [c + (value <= bound) for c, bound in zip(counts, self.buckets)]
+            self.values[key] = (counts, total + value, count + 1)
+
+    def count(self, **labels):
+        return self.values.get(tuple(sorted(labels.items())), (None, 0, 0))[2]
+
+    def samples(self):
+        samples = []
+        with self.lock:
+            values = list(self.values.items())
+        for labels, (counts, total, count) in values:
+            for bound, bucket_count in zip(self.buckets, counts):
+                samples.append((self.name + "_bucket", labels + (("le", bound),), bucket_count))
+            samples.append((self.name + "_bucket", labels + (("le", "+Inf"),), count))
+            samples.append((self.name + "_sum", labels, total))
+            samples.append((self.name + "_count", labels, count))
+        return samples
+
+
+class Registry:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics = {}
+
+    def register(self, metric):
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, help):
+        return self.register(Counter(name, help))
+
+    def gauge(self, name, help):
+        return self.register(Gauge(name, help))
+
+    def histogram(self, name, help, buckets):
+        return self.register(Histogram(name, help, buckets))
+
+    # Prometheus text exposition format
+    def render(self):
+        lines = []
+        with self.lock:
+            for metric in self.metrics.values():
+                lines.append(f"# HELP {metric.name} {metric.help}")
+                lines.append(f"# TYPE {metric.name} {metric.type}")
+                for name, labels, value in metric.samples():
+                    lines.append(f"{name}{label_text(labels)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+# Structured events as JSON lines; does nothing until a path is set
+class EventLog:
+
+    def __init__(self, path=None):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def emit(self, event, **fields):
+        if self.path is None:
+            return
+        record = {"time": datetime.now(timezone.utc).isoformat(timespec="milliseconds"), "event": event, **fields}
+        with self.lock:
+            try:
+                with open(self.path, "a") as log_file:
+                    log_file.write(json.dumps(record) + "\n")
+            except OSError as e:
+                logger.warning(f"Could not write event log {self.path}: {e!r}")
+
+
+registry = Registry()
+events = EventLog()
+
+api_requests = registry.counter("remoteplay_api_requests_total", "Paperspace API requests by method and status")
+api_latency = registry.histogram("remoteplay_api_request_seconds", "Paperspace API request latency", API_BUCKETS)
+polls = registry.counter("remoteplay_polls_total", "Machine polls by kind")
+transitions = registry.histogram("remoteplay_transition_seconds", "Time from a start or stop request to its target "
+                                 "state", TRANSITION_BUCKETS)
+tunnel_up = registry.gauge("remoteplay_tunnel_up", "Whether the SSH tunnel is healthy")
+tunnel_reconnects = registry.counter("remoteplay_tunnel_reconnects_total", "SSH tunnel reconnect attempts")
+tunnel_downtime = registry.counter("remoteplay_tunnel_downtime_seconds_total", "Time the wanted SSH tunnel was down")
+tunnel_bytes = registry.counter("remoteplay_tunnel_bytes_total", "Bytes relayed by the in-process SSH transport")
+tunnel_channels = registry.gauge("remoteplay_tunnel_channels", "Open forwarded connections of the in-process SSH "
+                                 "transport")
+tunnel_keepalive = registry.gauge("remoteplay_tunnel_keepalive_seconds", "Last SSH keepalive round trip")
+usb_server_starts = registry.counter("remoteplay_usb_server_starts_total", "USB server processes started")
+prewarm_starts = registry.counter("remoteplay_prewarm_starts_total", "Machines started ahead of a usual session")
+
+
+def serve(port, host="127.0.0.1"):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Serving metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
+
+
+def configure_metrics(port=None, event_log=None):
+    events.path = event_log
+    if port:
+        try:
+            return serve(int(port))
+        except OSError as e:
+            logger.warning(f"Could not serve metrics on port {port}: {e!r}")
+    return None
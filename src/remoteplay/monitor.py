@@ -0,0 +1,159 @@
+import logging
+import socket
+import threading
+
+from .scheduler import Clock
+from .sshconfig import resolve_address
+
+MONITOR_INTERVAL = 5
+# samples kept for the percentiles, i.e. the last ten minutes at the default interval
+MONITOR_SAMPLES = 120
+MONITOR_TIMEOUT = 2
+# bulk transfers cost bandwidth, so only every n-th measurement includes one
+THROUGHPUT_EVERY = 6
+THROUGHPUT_BYTES = 256 * 1024
+CHUNK_SIZE = 16 * 1024
+
+logger = logging.getLogger(__name__)
+
+
+class RingBuffer:
+
+    def __init__(self, size):
+        self.items = [None] * size
+        self.next = 0
+        self.count = 0
+
+    def append(self, value):
+        self.items[self.next] = value
+        self.next = (self.next + 1) % len(self.items)
+        self.count = min(self.count + 1, len(self.items))
+
+    def values(self):
+        if self.count < len(self.items):
+            return self.items[:self.count]
+        return self.items[self.next:] + self.items[:self.next]
+
+    def percentile(self, p):
+        values = sorted(self.values())
+        if not values:
+            return None
+        # nearest rank
+        rank = max(1, -(-p * len(values) // 100))
+        return values[int(rank) - 1]
+
+    def __len__(self):
+        return self.count
+
+
+def parse_address(text):
+    host, _, port = text.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Invalid address {text}, use host:port")
+    return host, int(port)
+
+
+# Measures the path to the remote machine while the tunnel is open. Without an echo service the round trip
+# is the TCP handshake with the ssh port; with an echo service (usually reached through a -L forward of the
+# tunnel) it is a one byte round trip through ssh, and bulk echoes give the throughput.
+class LinkMonitor:
+
+    def __init__(self, tunnel, echo=None, clock=None, interval=MONITOR_INTERVAL, samples=MONITOR_SAMPLES):
+        self.tunnel = tunnel
+        self.echo = echo
+        self.clock = clock or Clock()
+        self.interval = interval
+        self.rtt = RingBuffer(samples)
+        self.throughput = RingBuffer(samples)
+        self.measurements = 0
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="link-monitor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.measure()
+            except OSError as e:
+                logger.info(f"Link measurement failed: {e!r}")
+            except Exception:
+                # the monitor only informs, so a bug in a measurement must not end it
+                logger.exception("Link measurement failed")
+
+    # what the samples are, for the label and tooltip of the measurement
+    def label(self):
+        return "Link" if self.echo is not None else "SSH connect"
+
+    def description(self):
+        if self.echo is not None:
+            return "Round trip through the tunnel to the echo service, p50 / p95 / p99, and throughput"
+        return "Time to connect to the SSH port of the machine, p50 / p95 / p99; not through the tunnel, no throughput"
+
+    def target(self):
+        if self.echo is not None:
+            return self.echo
+        host = self.tunnel.host_provider()
+        return resolve_address(host) if host else None
+
+    def measure(self):
+        target = self.target()
+        if self.tunnel.check() != "open" or target is None or target[0] is None:
+            return False
+        bulk = self.echo is not None and self.measurements % THROUGHPUT_EVERY == 0
+        self.measurements += 1
+        start = self.clock.now()
+        with socket.create_connection(target, MONITOR_TIMEOUT) as connection:
+            if self.echo is None:
+                self.rtt.append(self.clock.now() - start)
+                return True
+            connection.settimeout(MONITOR_TIMEOUT)
+            start = self.clock.now()
+            self.round_trip(connection, b"\x00")
+            self.rtt.append(self.clock.now() - start)
+            if bulk:
+                start = self.clock.now()
+                self.round_trip(connection, bytes(THROUGHPUT_BYTES))
+                elapsed = self.clock.now() - start
+                if elapsed > 0:
+                    self.throughput.append(2 * THROUGHPUT_BYTES * 8 / elapsed)
+        return True
+
+    @staticmethod
+    def round_trip(connection, payload):
+        received = 0
+        for offset in range(0, len(payload), CHUNK_SIZE):
+            connection.sendall(payload[offset:offset + CHUNK_SIZE])
+            received += len(connection.recv(CHUNK_SIZE))
+        while received < len(payload):
+            data = connection.recv(CHUNK_SIZE)
+            if not data:
+                raise ConnectionError("Echo service closed the connection")
+            received += len(data)
+
+    def stats(self):
+        return {
+            "measured": "echo" if self.echo is not None else "ssh connect",
+            "samples": len(self.rtt),
+            "rtt": {f"p{p}": self.rtt.percentile(p) for p in (50, 95, 99)},
+            "throughput": self.throughput.percentile(50),
+        }
+
+    def summary(self):
+        stats = self.stats()
+        if not stats["samples"]:
+            return "no samples"
+        rtt = stats["rtt"]
+        text = f"{rtt['p50'] * 1000:.0f} / {rtt['p95'] * 1000:.0f} / {rtt['p99'] * 1000:.0f} ms"
+        if stats["throughput"] is not None:
+            text += f", {stats['throughput'] / 1e6:.1f} Mbit/s"
+        return text
@@ -0,0 +1,353 @@
+import logging
+import socket
+import threading
+
+from .metrics import tunnel_bytes, tunnel_channels, tunnel_keepalive
+from .monitor import RingBuffer
+from .scheduler import Clock
+from .sshconfig import resolve_address, resolver
+from .sshtunnel import DEFAULT_FORWARDS, PROBE_TIMEOUT, SERVER_ALIVE_COUNT_MAX, SERVER_ALIVE_INTERVAL, \
+    forward_reachable, forward_states, parse_forwards, probe_forwards_through
+
+CONNECT_TIMEOUT = 10
+BUFFER_SIZE = 32 * 1024
+# keepalive round trips kept for the percentiles
+KEEPALIVE_SAMPLES = 60
+
+logger = logging.getLogger(__name__)
+
+
+def connect_transport(host, timeout=CONNECT_TIMEOUT):
+    import paramiko
+    hostname, port = resolve_address(host)
+    user, identity_files = resolver.user(host), resolver.identity_files(host)
+    client = paramiko.SSHClient()
+    client.load_system_host_keys()
+    # like StrictHostKeyChecking=no for the ssh binary
+    client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+    client.connect(hostname, port, username=user, key_filename=identity_files or None, timeout=timeout,
+                   banner_timeout=timeout, auth_timeout=timeout)
+    return client.get_transport()
+
+
+# Copies the data of one forwarded connection in both directions, until both sides have finished sending
+class Relay:
+
+    def __init__(self, tunnel, forward, channel, connection):
+        self.tunnel = tunnel
+        self.forward = forward
+        self.channel = channel
+        self.connection = connection
+        self.running = 2
+        self.lock = threading.Lock()
+
+    def start(self):
+        self.tunnel.relay_opened(self)
+        for source, destination, direction in ((self.channel, self.connection, "received"),
+                                               (self.connection, self.channel, "sent")):
+            threading.Thread(target=self.copy, args=(source, destination, direction), name="ssh-relay",
+                             daemon=True).start()
+
+    def copy(self, source, destination, direction):
+        try:
+            while True:
+                data = source.recv(BUFFER_SIZE)
+                if not data:
+                    break
+                destination.sendall(data)
+                self.tunnel.count(self.forward, direction, len(data))
+        except (OSError, EOFError) as e:
+            logger.debug(f"Relay for {self.forward} ended: {e!r}")
+        finally:
+            try:
+                destination.shutdown(socket.SHUT_WR)
+            except (OSError, EOFError):
+                pass
+            with self.lock:
+                self.running -= 1
+                finished = self.running == 0
+            if finished:
+                self.channel.close()
+                self.connection.close()
+                self.tunnel.relay_closed(self)
+
+
+# Drop-in alternative to SshTunnel that holds the SSH connection in this process with paramiko. The forwards
+# are channels of that connection, so their traffic and the keepalive round trip can be measured directly,
+# and reopening a closed tunnel only asks the server for the forwards again
+class ParamikoTunnel:
+
+    def __init__(self, forwards=None, connect=connect_transport, clock=None):
+        self.host_provider = lambda: None
+        self.forwards = forwards or parse_forwards(DEFAULT_FORWARDS)
+        for forward in self.forwards:
+            if forward.kind == "-D":
+                raise ValueError(f"Dynamic forward {forward} needs the openssh transport")
+        self.connect = connect
+        self.clock = clock or Clock()
+        self.transport = None
+        self.host = None
+        self.forwarding = False
+        self.wanted = False
+        # set when the last connection attempt failed or the connection died
+        self.failed = False
+        self.connecting = None
+        self.forwarder = None
+        self.forwards_changed = lambda forwarding: None
+        # counts dropped connections, so that threads started for an earlier one leave the current one alone
+        self.generation = 0
+        self.last_reply = None
+        self.round_trips = RingBuffer(KEEPALIVE_SAMPLES)
+        self.listeners = []
+        # state of every forward at the last probe, so that showing them does not wait for the network
+        self.health = {}
+        self.relays = set()
+        self.traffic = {str(forward): {"sent": 0, "received": 0} for forward in self.forwards}
+        self.lock = threading.RLock()
+        # paramiko matches replies to global requests by order only, so keepalives and forward requests take turns
+        self.global_requests = threading.Lock()
+
+    def open(self):
+        with self.lock:
+            host = self.host_provider()
+            if not host:
+                return
+            self.wanted = True
+            if self.transport is None:
+                if self.connecting is None:
+                    self.host = host
+                    self.failed = False
+                    self.connecting = threading.Thread(target=self.establish, args=(host, self.generation),
+                                                       name="ssh-connect", daemon=True)
+                    self.connecting.start()
+            elif self.transport.is_active():
+                self.update_forwards()
+
+    def establish(self, host, generation):
+        try:
+            transport = self.connect(host)
+        except Exception as e:
+            logger.warning(f"SSH connection to {host} failed: {e!r}")
+            with self.lock:
+                if generation == self.generation:
+                    self.connecting = None
+                    self.failed = True
+            return
+        with self.lock:
+            if generation != self.generation:
+                transport.close()
+                return
+            self.connecting = None
+            self.transport = transport
+            self.last_reply = self.clock.now()
+            threading.Thread(target=self.keepalive, args=(transport,), name="ssh-keepalive", daemon=True).start()
+            self.update_forwards()
+
+    # Requests to the server block until it answers, so the forwards are added and removed on a thread of their
+    # own, which follows self.wanted until it no longer changes; forwards_changed is called after every change
+    def update_forwards(self):
+        if self.forwarder is None and self.wanted != self.forwarding:
+            self.forwarder = threading.Thread(target=self.run_forwarder, args=(self.generation,),
+                                              name="ssh-forwards", daemon=True)
+            self.forwarder.start()
+
+    def run_forwarder(self, generation):
+        while True:
+            with self.lock:
+                if generation != self.generation or self.transport is None or self.wanted == self.forwarding:
+                    if generation == self.generation:
+                        self.forwarder = None
+                    return
+                transport, wanted = self.transport, self.wanted
+            forwarding = self.add_forwards(transport) if wanted else self.cancel_forwards(transport)
+            with self.lock:
+                if generation != self.generation:
+                    return
+                self.forwarding = forwarding
+                if wanted and not forwarding:
+                    self.failed = True
+                    self.drop()
+            self.forwards_changed(forwarding)
+            if wanted and not forwarding:
+                return
+
+    # Returns whether all forwards are set up
+    def add_forwards(self, transport):
+        if not self.global_requests.acquire(timeout=SERVER_ALIVE_INTERVAL * SERVER_ALIVE_COUNT_MAX):
+            logger.warning("SSH connection does not answer, reconnecting")
+            return False
+        try:
+            for forward in self.forwards:
+                if forward.kind == "-R":
+                    bind, port = forward.listen
+                    transport.request_port_forward(
+                        "" if bind == "*" else bind, int(port),
+                        handler=(lambda channel, origin, server, f=forward: self.accept_remote(f, channel)))
+                else:
+                    self.listeners.append(self.listen(forward))
+            return True
+        except Exception as e:
+            # like ExitOnForwardFailure
+            logger.warning(f"SSH forwards could not be set up: {e!r}")
+            return False
+        finally:
+            self.global_requests.release()
+
+    def listen(self, forward):
+        bind, port = forward.listen
+        server = socket.create_server(("" if bind == "*" else bind or "localhost", int(port)))
+        threading.Thread(target=self.accept_local, args=(forward, server), name="ssh-listener", daemon=True).start()
+        return server
+
+    def accept_local(self, forward, server):
+        while True:
+            try:
+                connection, peer = server.accept()
+            except OSError:
+                return
+            host, port = forward.target
+            try:
+                channel = self.transport.open_channel("direct-tcpip", (host, int(port)), peer)
+            except Exception as e:
+                logger.warning(f"Forward {forward} refused: {e!r}")
+                connection.close()
+                continue
+            Relay(self, forward, channel, connection).start()
+
+    # Called on the transport's thread, which must not wait for the connection
+    def accept_remote(self, forward, channel):
+        threading.Thread(target=self.relay_remote, args=(forward, channel), name="ssh-forward", daemon=True).start()
+
+    def relay_remote(self, forward, channel):
+        host, port = forward.target
+        try:
+            connection = socket.create_connection((host, int(port)), CONNECT_TIMEOUT)
+        except OSError as e:
+            logger.warning(f"Forward {forward} could not reach {host}:{port}: {e!r}")
+            channel.close()
+            return
+        Relay(self, forward, channel, connection).start()
+
+    def keepalive(self, transport):
+        while transport.is_active():
+            with self.global_requests:
+                start = self.clock.now()
+                transport.global_request("keepalive@openssh.com", wait=True)
+            if not transport.is_active():
+                break
+            now = self.clock.now()
+            with self.lock:
+                self.last_reply = now
+                self.round_trips.append(now - start)
+            tunnel_keepalive.set(now - start)
+            self.clock.sleep(SERVER_ALIVE_INTERVAL)
+
+    def relay_opened(self, relay):
+        with self.lock:
+            self.relays.add(relay)
+            tunnel_channels.set(len(self.relays))
+
+    def relay_closed(self, relay):
+        with self.lock:
+            self.relays.discard(relay)
+            tunnel_channels.set(len(self.relays))
+
+    def count(self, forward, direction, size):
+        with self.lock:
+            self.traffic[str(forward)][direction] += size
+        tunnel_bytes.inc(size, forward=str(forward), direction=direction)
+
+    # Returns whether forwards are left, which is never the case
+    def cancel_forwards(self, transport):
+        self.close_listeners()
+        with self.global_requests:
+            for forward in self.forwards:
+                if forward.kind == "-R" and transport.is_active():
+                    bind, port = forward.listen
+                    try:
+                        transport.cancel_port_forward("" if bind == "*" else bind, int(port))
+                    except Exception as e:
+                        logger.warning(f"Forward {forward} could not be cancelled: {e!r}")
+        return False
+
+    def close_listeners(self):
+        listeners, self.listeners = self.listeners, []
+        for listener in listeners:
+            listener.close()
+
+    # Closes the connection without changing whether the tunnel is wanted; its forwards end with it, and threads
+    # still working on it leave the next connection alone
+    def drop(self):
+        self.generation += 1
+        self.forwarder = None
+        self.health = {}
+        self.close_listeners()
+        self.forwarding = False
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+    # Removes the forwards but keeps the connection for the next open
+    def close(self):
+        with self.lock:
+            self.wanted = False
+            if self.transport is not None:
+                self.update_forwards()
+
+    def shutdown(self):
+        with self.lock:
+            self.wanted = False
+            self.connecting = None
+            self.failed = False
+            self.drop()
+
+    def restart(self):
+        with self.lock:
+            if self.wanted and self.connecting is None:
+                self.drop()
+                self.open()
+
+    # Does not take the lock, so that it can end a connection that hangs in a request made under the lock
+    def check(self):
+        transport = self.transport
+        if transport is None:
+            return "error" if self.failed else "closed"
+        if not transport.is_active():
+            return "error"
+        if self.clock.now() - self.last_reply > SERVER_ALIVE_INTERVAL * SERVER_ALIVE_COUNT_MAX:
+            logger.warning("SSH keepalive not answered, closing the connection")
+            transport.close()
+            return "error"
+        return "open" if self.forwarding and self.wanted else "closed"
+
+    # Opens a channel to the listener of every remote forward on the machine, which comes back through the
+    # forward, so the whole path is probed without a new connection to sshd
+    def probe(self):
+        transport = self.transport
+        if transport is None or not self.forwarding or not transport.is_active():
+            return False
+        return probe_forwards_through(self, lambda forward: self.reachable(transport, forward))
+
+    @staticmethod
+    def reachable(transport, forward):
+        if forward.kind != "-R":
+            return forward_reachable(forward.listen_address())
+        try:
+            transport.open_channel("direct-tcpip", forward.listen_address(), ("localhost", 0),
+                                   timeout=PROBE_TIMEOUT).close()
+            return True
+        except Exception as e:
+            logger.info(f"Forward {forward} does not get through: {e!r}")
+            return False
+
+    # The states found by the last probe; forwards that were not probed yet are "unknown"
+    def forward_states(self):
+        return forward_states(self)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "channels": len(self.relays),
+                "traffic": {forward: dict(counts) for forward, counts in self.traffic.items()},
+                "keepalive_rtt": self.round_trips.percentile(50) if len(self.round_trips) else None,
+            }
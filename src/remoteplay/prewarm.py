@@ -0,0 +1,115 @@
+import statistics
+from datetime import datetime, timedelta
+
+from .transition import estimate
+
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+# a session time is learned once the app was started around it on this many days of the same weekday
+MIN_OCCURRENCES = 2
+# only starts of the last four weeks are learned from
+LEARN_DAYS = 28
+# starts closer than this many minutes are one usual session time
+CLUSTER_GAP = 45
+# the machine should be ready this long before the session, in seconds
+READY_MARGIN = 120
+# assumed boot time until past boots have been measured, in seconds
+DEFAULT_BOOT_TIME = 180
+
+
+# Seconds a start usually takes at most, from the measured past starts
+def boot_time(durations):
+    expected = estimate(durations)
+    return expected[0] + expected[1] if expected else DEFAULT_BOOT_TIME
+
+
+def parse_days(text):
+    days = set()
+    for part in text.lower().split(","):
+        if part == "*":
+            return frozenset(range(7))
+        first, _, last = part.partition("-")
+        if first not in DAYS or (last and last not in DAYS):
+            raise ValueError(f"Unknown day {part}, use mon..sun, ranges like mon-fri or *")
+        start = DAYS.index(first)
+        end = DAYS.index(last) if last else start
+        days.update(day % 7 for day in range(start, end + 1 if end >= start else end + 8))
+    return frozenset(days)
+
+
+# Parses "auto; mon-fri 19:00; sat,sun 10:30" into (learn, [(weekdays, minute of day), ...])
+def parse_windows(text):
+    learn = False
+    windows = []
+    for entry in text.split(";"):
+        entry = entry.strip()
+        if not entry:
+            continue
+        if entry.lower() == "auto":
+            learn = True
+            continue
+        try:
+            days, clock_time = entry.split()
+            hours, minutes = (int(value) for value in clock_time.split(":"))
+        except ValueError:
+            raise ValueError(f"Invalid pre-warm window {entry}, use e.g. \"mon-fri 19:00\"")
+        if not (0 <= hours < 24 and 0 <= minutes < 60):
+            raise ValueError(f"Invalid time in pre-warm window {entry}")
+        windows.append((parse_days(days), hours * 60 + minutes))
+    return learn, windows
+
+
+# The usual session times per weekday, from the times the player started the machine
+def learn_windows(starts, now):
+    by_day = {}
+    for start in starts:
+        moment = datetime.fromtimestamp(start)
+        if now - moment <= timedelta(days=LEARN_DAYS):
+            by_day.setdefault(moment.weekday(), []).append((moment.hour * 60 + moment.minute, moment.date()))
+    windows = []
+    for day, entries in by_day.items():
+        cluster = []
+        for minute, date in sorted(entries) + [(None, None)]:
+            if cluster and (minute is None or minute - cluster[-1][0] > CLUSTER_GAP):
+                if len({d for _, d in cluster}) >= MIN_OCCURRENCES:
+                    windows.append((frozenset([day]), int(statistics.median(m for m, _ in cluster))))
+                cluster = []
+            if minute is not None:
+                cluster.append((minute, date))
+    return windows
+
+
+# Decides when to start a machine so that it is ready before the player's next session
+class PrewarmPlanner:
+
+    def __init__(self, windows, learn=False, starts=None):
+        self.windows = windows
+        self.learn = learn
+        # provides the timestamps of past starts by the player
+        self.starts = starts or (lambda: [])
+        self.triggered = set()
+
+    def sessions(self, now):
+        windows = self.windows + (learn_windows(self.starts(), now) if self.learn else [])
+        midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+        sessions = set()
+        for offset in range(2):
+            day = midnight + timedelta(days=offset)
+            for days, minute in windows:
+                if day.weekday() in days:
+                    sessions.add(day + timedelta(minutes=minute))
+        return sorted(sessions)
+
+    # Returns the session to start for, once its lead time has begun; every session is returned only once
+    def due(self, now, boot_time=DEFAULT_BOOT_TIME):
+        lead = timedelta(seconds=boot_time + READY_MARGIN)
+        for session in self.sessions(now):
+            if session - lead <= now < session and session not in self.triggered:
+                self.triggered.add(session)
+                return session
+        return None
+
+    def next_start(self, now, boot_time=DEFAULT_BOOT_TIME):
+        lead = timedelta(seconds=boot_time + READY_MARGIN)
+        upcoming = [session - lead for session in self.sessions(now)
+                    if session > now and session not in self.triggered]
+        return max(min(upcoming), now) if upcoming else None
@@ -0,0 +1,115 @@
+import random
+from time import monotonic, sleep, time
+
+STEADY_STATES = ("ready", "off")
+
+# poll interval in seconds while a machine is starting or stopping
+FAST_INTERVAL = 2
+# first poll interval once a machine has reached a steady state, doubled with every unchanged poll
+STEADY_INTERVAL = 5
+MAX_INTERVAL = 60
+BACKOFF_FACTOR = 2
+# relative amount of random variation of the steady state interval
+JITTER = 0.2
+# poll interval in seconds around the expected end of a transition
+DENSE_INTERVAL = 1
+# smallest time in seconds before and after the expected end of a transition that is polled densely
+MIN_WINDOW = 5
+
+
+class Clock:
+    now = staticmethod(monotonic)
+    time = staticmethod(time)
+    sleep = staticmethod(sleep)
+
+
+class PollScheduler:
+
+    def __init__(self, clock=None, rng=random.random, fast=FAST_INTERVAL, steady=STEADY_INTERVAL,
+                 maximum=MAX_INTERVAL, factor=BACKOFF_FACTOR, jitter=JITTER, dense=DENSE_INTERVAL):
+        self.clock = clock or Clock()
+        self.rng = rng
+        self.fast = fast
+        self.steady = steady
+        self.maximum = maximum
+        self.factor = factor
+        self.jitter = jitter
+        self.dense = dense
+        self.state = None
+        self.target_state = None
+        # expected end of the transition to the target state, and how far off it may be
+        self.eta = None
+        self.window = MIN_WINDOW
+        self.unchanged = 0
+        self.errors = 0
+        self.not_before = None
+
+    def expect(self, target_state, eta=None, window=MIN_WINDOW):
+        self.target_state = target_state
+        self.eta = eta
+        self.window = window
+
+    def reset(self):
+        self.state = None
+        self.unchanged = 0
+
+    def observe(self, state):
+        self.errors = 0
+        if state == self.state:
+            self.unchanged += 1
+        else:
+            self.state = state
+            self.unchanged = 0
+        if state == self.target_state:
+            self.target_state = None
+            self.eta = None
+
+    # failed polls back off from the steady interval, whatever the state, so that an outage is not hammered
+    def observe_error(self):
+        self.errors += 1
+
+    def observe_rate_limit(self, headers):
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        wait = None
+        try:
+            if "retry-after" in headers:
+                wait = float(headers["retry-after"])
+            else:
+                remaining = headers.get("x-ratelimit-remaining", headers.get("ratelimit-remaining"))
+                reset = headers.get("x-ratelimit-reset", headers.get("ratelimit-reset"))
+                if remaining is not None and reset is not None and int(remaining) <= 0:
+                    wait = float(reset)
+                    # some APIs send the reset time as epoch seconds instead of a delay
+                    if wait > 1e9:
+                        wait -= self.clock.time()
+        except ValueError:
+            return
+        if wait is not None and wait > 0:
+            self.not_before = self.clock.now() + wait
+
+    def in_transition(self):
+        return self.target_state is not None or self.state not in STEADY_STATES
+
+    # Until the expected end of a transition is near, the remaining time is halved with every poll;
+    # around it, polls are dense, and after it, a late transition is polled at the usual rate
+    def transition_delay(self):
+        if self.eta is None or self.target_state is None:
+            return self.fast
+        remaining = self.eta - self.clock.now()
+        if remaining > self.window:
+            return max(self.fast, min(remaining - self.window, remaining / 2))
+        if remaining > -self.window:
+            return self.dense
+        return self.fast
+
+    def next_delay(self):
+        if self.in_transition():
+            delay = self.transition_delay()
+        else:
+            delay = min(self.steady * self.factor ** min(self.unchanged, 16), self.maximum)
+            delay *= 1 + self.jitter * (2 * self.rng() - 1)
+        if self.errors:
+            delay = max(delay, min(self.steady * self.factor ** min(self.errors - 1, 16), self.maximum))
+        if self.not_before is not None:
+            delay = max(delay, self.not_before - self.clock.now())
+        return delay
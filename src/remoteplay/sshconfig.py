@@ -0,0 +1,206 @@
+import getpass
+import logging
+import os
+import re
+import subprocess
+import threading
+from fnmatch import fnmatchcase
+from glob import glob
+from platform import system
+
+logger = logging.getLogger(__name__)
+
+USER_CONFIG = os.path.join(os.path.expanduser("~"), ".ssh", "config")
+if system() == 'Windows':
+    SYSTEM_CONFIG = os.path.join(os.getenv('PROGRAMDATA', 'C:\\ProgramData'), "ssh", "ssh_config")
+else:
+    SYSTEM_CONFIG = os.path.join("/", "etc", "ssh", "ssh_config")
+
+# Includes deeper than this are most likely a loop
+MAX_INCLUDE_DEPTH = 16
+SSH_PORT = 22
+SSH_G_TIMEOUT = 10
+
+
+class UnsupportedConfig(Exception):
+    pass
+
+
+def split_arguments(text):
+    return [quoted if quoted else plain for quoted, plain in re.findall(r'"([^"]*)"|(\S+)', text)]
+
+
+def match_patterns(value, patterns, ignore_case=False):
+    # a list of patterns matches if any pattern matches and no negated pattern does; like ssh, "Host" and "Match
+    # user" compare the case, "Match host" does not
+    if ignore_case:
+        value, patterns = value.lower(), [pattern.lower() for pattern in patterns]
+    matched = False
+    for pattern in ",".join(patterns).split(","):
+        if pattern.startswith("!"):
+            if fnmatchcase(value, pattern[1:]):
+                return False
+        elif pattern and fnmatchcase(value, pattern):
+            matched = True
+    return matched
+
+
+# Resolves the HostName and Port that "ssh -G" would report, by reading ssh_config(5) files directly. Configs it
+# cannot evaluate itself are left to ssh -G; both results are kept until one of the files read changes.
+class SshConfigResolver:
+
+    def __init__(self, user_config=USER_CONFIG, system_config=SYSTEM_CONFIG):
+        self.user_config = user_config
+        self.system_config = system_config
+        self.lock = threading.Lock()
+        self.memo = {}
+        self.files = {}
+
+    @staticmethod
+    def mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def hostname(self, host):
+        return self.lookup(host)["hostname"]
+
+    def port(self, host):
+        return self.lookup(host)["port"]
+
+    def user(self, host):
+        return self.lookup(host)["user"]
+
+    def identity_files(self, host):
+        return self.lookup(host)["identity_files"]
+
+    def lookup(self, host):
+        with self.lock:
+            if any(self.mtime(path) != mtime for path, mtime in self.files.items()):
+                self.memo = {}
+            if host not in self.memo:
+                if not self.memo:
+                    self.files = {}
+                try:
+                    self.memo[host] = self.resolve(host)
+                except UnsupportedConfig as e:
+                    logger.info(f"{e}, asking ssh for the settings of {host}")
+                    for path in (self.user_config, self.system_config):
+                        self.files.setdefault(path, self.mtime(path))
+                    result = self.ask_ssh(host)
+                    if result is None:
+                        return {"hostname": None, "port": SSH_PORT, "user": None, "identity_files": []}
+                    self.memo[host] = result
+            return self.memo[host]
+
+    # Returns None when ssh did not answer in time, which is not kept
+    @staticmethod
+    def ask_ssh(host):
+        kwargs = {"creationflags": subprocess.CREATE_NO_WINDOW} if system() == 'Windows' else {}
+        options = {}
+        try:
+            result = subprocess.run(["ssh", "-G", host], capture_output=True, text=True, timeout=SSH_G_TIMEOUT,
+                                    **kwargs)
+        except subprocess.TimeoutExpired as e:
+            logger.warning(f"ssh -G {host} failed: {e!r}")
+            return None
+        except OSError as e:
+            logger.warning(f"ssh -G {host} failed: {e!r}")
+        else:
+            for line in result.stdout.splitlines():
+                keyword, _, value = line.partition(" ")
+                options.setdefault(keyword.lower(), []).append(value.strip())
+        try:
+            port = int(options.get("port", [SSH_PORT])[0])
+        except ValueError:
+            port = SSH_PORT
+        return {"hostname": options.get("hostname", [None])[0], "port": port, "user": options.get("user", [None])[0],
+                "identity_files": [path for path in options.get("identityfile", []) if os.path.exists(path)]}
+
+    def resolve(self, host):
+        original = host
+        options = {}
+        for path, base_dir in ((self.user_config, os.path.dirname(self.user_config)),
+                               (self.system_config, os.path.dirname(self.system_config))):
+            self.read(path, base_dir, original, options, True, 0)
+        hostname = options.get("hostname", [original])[0]
+        try:
+            port = int(options.get("port", [SSH_PORT])[0])
+        except ValueError:
+            raise UnsupportedConfig(f"Unsupported port {options['port'][0]}")
+        # ssh matches the name as given, but connects to the lowercased host name
+        return {"hostname": hostname.replace("%h", original).replace("%%", "%").lower(), "port": port,
+                "user": options.get("user", [None])[0],
+                "identity_files": [os.path.expanduser(path) for path in options.get("identityfile", [])]}
+
+    def read(self, path, base_dir, original, options, active, depth):
+        if depth > MAX_INCLUDE_DEPTH:
+            raise UnsupportedConfig(f"Include nesting too deep in {path}")
+        self.files[path] = self.mtime(path)
+        try:
+            with open(path, encoding="utf-8", errors="replace") as config_file:
+                lines = config_file.readlines()
+        except OSError:
+            return
+        for line in lines:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            parts = re.split(r"\s*=\s*|\s+", line, maxsplit=1)
+            keyword = parts[0].lower()
+            args = split_arguments(parts[1]) if len(parts) > 1 else []
+            if keyword == "host":
+                active = match_patterns(original, args)
+            elif keyword == "match":
+                active = self.match(args, original, options)
+            elif not active:
+                continue
+            elif keyword == "include":
+                for pattern in args:
+                    pattern = os.path.expanduser(pattern)
+                    if not os.path.isabs(pattern):
+                        pattern = os.path.join(base_dir, pattern)
+                    for included in sorted(glob(pattern)):
+                        self.read(included, base_dir, original, options, active, depth + 1)
+            else:
+                options.setdefault(keyword, args)
+
+    @staticmethod
+    def match(args, original, options):
+        if [a.lower() for a in args] == ["all"]:
+            return True
+        result = True
+        i = 0
+        while i < len(args):
+            criterion = args[i].lower()
+            negate = criterion.startswith("!")
+            criterion = criterion.lstrip("!")
+            if criterion == "all":
+                matched = True
+                i += 1
+            elif criterion in ("host", "originalhost", "user", "localuser") and i + 1 < len(args):
+                value = {
+                    "host": options.get("hostname", [original])[0].replace("%h", original),
+                    "originalhost": original,
+                    "user": options.get("user", [getpass.getuser()])[0],
+                    "localuser": getpass.getuser(),
+                }[criterion]
+                matched = match_patterns(value, [args[i + 1]], ignore_case=criterion in ("host", "originalhost"))
+                i += 2
+            else:
+                # exec, canonical, final, localnetwork, tagged: leave these to ssh itself
+                raise UnsupportedConfig(f"Unsupported Match criterion {criterion}")
+            result = result and (matched != negate)
+        return result
+
+
+resolver = SshConfigResolver()
+
+
+def resolve_hostname(host):
+    return resolver.hostname(host)
+
+
+def resolve_address(host):
+    return resolver.hostname(host), resolver.port(host)
@@ -1,41 +1,454 @@
+import hashlib
+import logging
+import os
+import socket
 import subprocess
+import threading
 from platform import system
+from re import compile
+from .common import get_config_dir
+from .connector import ConnectorSelector
+from .metrics import events, tunnel_downtime, tunnel_reconnects, tunnel_up
+from .scheduler import Clock
+from .sshconfig import resolve_address, resolve_hostname
 
 
+# ssh gives up on a dead connection after ServerAliveInterval * ServerAliveCountMax seconds
+SERVER_ALIVE_INTERVAL = 1
+SERVER_ALIVE_COUNT_MAX = 3
+# the supervisor probes an open tunnel this often, in seconds
+PROBE_INTERVAL = 0.5
+PROBE_TIMEOUT = 0.5
+# how long a connection through a forward has to stay open to count as let through
+PROBE_WAIT = 0.2
+# consecutive failed probes after which a running tunnel is considered dead
+PROBE_FAILURES = 2
+# sshd sends its version line right after accepting a connection, e.g. "SSH-2.0-OpenSSH_9.6"
+BANNER_TIMEOUT = 2
+MIN_BACKOFF = 1
+MAX_BACKOFF = 30
 
+logger = logging.getLogger(__name__)
+
+
+# Windows OpenSSH cannot multiplex connections
+MULTIPLEXING = system() != 'Windows'
+# ssh -O requests to a running master are answered locally, so they are quick
+CONTROL_TIMEOUT = 5
+# the VirtualHere USB server port
+DEFAULT_FORWARDS = "-R 7575:localhost:7575"
+
+
+def control_dir():
+    return os.path.join(get_config_dir(), "ssh")
+
+
+# Control sockets are named after the process that owns the master, so the ones left behind by
+# crashed or killed instances can be told apart from live ones
+def control_path(host):
+    digest = hashlib.sha1(host.encode()).hexdigest()[:12]
+    return os.path.join(control_dir(), f"{os.getpid()}-{digest}")
+
+
+def remove_stale_control_sockets():
+    import psutil
+    try:
+        names = os.listdir(control_dir())
+    except OSError:
+        return
+    for name in names:
+        pid = name.split("-", 1)[0]
+        if not pid.isdigit() or (int(pid) != os.getpid() and not psutil.pid_exists(int(pid))):
+            logger.info(f"Removing stale ssh control socket {name}")
+            try:
+                os.remove(os.path.join(control_dir(), name))
+            except OSError as e:
+                logger.warning(f"Could not remove {name}: {e!r}")
+
+
+# One -L, -R or -D forward of the tunnel, written like the ssh option, e.g. "-L 8080:localhost:80"
+class Forward:
+
+    def __init__(self, kind, spec):
+        fields = spec.split(":")
+        if kind == "-D":
+            if len(fields) not in (1, 2):
+                raise ValueError(f"Invalid dynamic forward {spec}")
+            bind, port = fields if len(fields) == 2 else ("", fields[0])
+            self.address = (bind, port)
+        elif kind in ("-L", "-R"):
+            if len(fields) not in (3, 4):
+                raise ValueError(f"Invalid forward {kind} {spec}")
+            bind, port, host, host_port = fields if len(fields) == 4 else [""] + fields
+            self.listen = (bind, port)
+            self.target = (host, host_port)
+            # the address the forwarded connections come from, on this side
+            self.address = (bind, port) if kind == "-L" else (host, host_port)
+        else:
+            raise ValueError(f"Unknown forward type {kind}, use -L, -R or -D")
+        if not self.address[1].isdigit():
+            raise ValueError(f"Invalid port in forward {kind} {spec}")
+        self.kind = kind
+        self.spec = spec
+
+    def arguments(self):
+        return [self.kind, self.spec]
+
+    # where a -L or -D forward is reached locally, or a -R forward on the machine
+    def listen_address(self):
+        bind, port = self.listen if self.kind != "-D" else self.address
+        return ("localhost" if bind in ("", "*", "0.0.0.0") else bind), int(port)
+
+    def __str__(self):
+        return f"{self.kind} {self.spec}"
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+# ssh accepts a connection to a forward before it opens the channel behind it, and closes the connection as soon as
+# the far side refuses the channel; a connection that is still open after a moment was let through
+def forward_reachable(address, timeout=PROBE_TIMEOUT, wait=PROBE_WAIT):
+    try:
+        connection = socket.create_connection(address, timeout)
+    except OSError:
+        return False
+    with connection:
+        connection.settimeout(wait)
+        try:
+            return connection.recv(1) != b""
+        except socket.timeout:
+            return True
+        except OSError:
+            return False
+
+
+def parse_forwards(text):
+    forwards = []
+    for entry in text.replace("\n", ",").split(","):
+        if entry.strip():
+            kind, _, spec = entry.strip().partition(" ")
+            forwards.append(Forward(kind, spec.strip()))
+    if not forwards:
+        raise ValueError("No forwards given")
+    return forwards
+
+
+# Keeps one authenticated ssh master connection per host; the forward is added to and removed from
+# the running master, so reopening a tunnel does not need a new handshake
 class SshTunnel:
-    def __init__(self):
+    def __init__(self, forwards=None):
         self.host_provider = lambda: None
+        self.forwards = forwards or parse_forwards(DEFAULT_FORWARDS)
         self.process = None
+        # the host the running master is connected to
+        self.host = None
+        self.forwarding = False
+        # whether the tunnel should be open, i.e. whether the supervisor should bring it back
+        self.wanted = False
+        # a local forward to the listener of every remote forward on the machine, to probe it through the master
+        self.probe_forwards = {}
+        # state of every forward at the last probe, so that showing them does not wait for the network
+        self.health = {}
+        self.lock = threading.RLock()
+
+    def forward_arguments(self):
+        forwards = self.forwards + list(self.probe_forwards.values())
+        return [argument for forward in forwards for argument in forward.arguments()]
+
+    def create_probe_forwards(self):
+        self.probe_forwards = {}
+        for forward in self.forwards:
+            if forward.kind == "-R":
+                host, port = forward.listen_address()
+                self.probe_forwards[str(forward)] = Forward("-L", f"127.0.0.1:{free_port()}:{host}:{port}")
+
+    def command(self, host):
+        command = [
+            "ssh",
+            "-N",
+            *self.forward_arguments(),
+            "-o",
+            "StrictHostKeyChecking=no",
+            "-o",
+            f"ServerAliveInterval={SERVER_ALIVE_INTERVAL}",
+            "-o",
+            f"ServerAliveCountMax={SERVER_ALIVE_COUNT_MAX}",
+            "-o",
+            "ExitOnForwardFailure=yes",
+        ]
+        if MULTIPLEXING:
+            command += ["-o", "ControlMaster=yes", "-o", f"ControlPath={control_path(host)}"]
+        return command + [host]
+
+    def control(self, host, operation):
+        forwards = self.forward_arguments() if operation in ("forward", "cancel") else []
+        command = ["ssh", "-o", f"ControlPath={control_path(host)}", "-O", operation, *forwards, host]
+        try:
+            result = subprocess.run(command, capture_output=True, text=True, timeout=CONTROL_TIMEOUT)
+        except (OSError, subprocess.TimeoutExpired) as e:
+            logger.warning(f"ssh -O {operation} failed: {e!r}")
+            return False
+        if result.returncode != 0:
+            logger.warning(f"ssh -O {operation} failed: {result.stderr.strip()}")
+        return result.returncode == 0
 
     def open(self):
-        if self.host_provider() is not None and self.process is None:
-            command = [
-                "ssh",
-                "-N",
-                "-R",
-                "7575:localhost:7575",
-                "-o",
-                "StrictHostKeyChecking=no",
-                self.host_provider(),
-            ]
-            if system() == 'Windows':
-                self.process = subprocess.Popen(command, creationflags=subprocess.CREATE_NO_WINDOW)
-            else:
-                self.process = subprocess.Popen(command)
+        with self.lock:
+            host = self.host_provider()
+            if not host:
+                return
+            self.wanted = True
+            if self.process is None:
+                self.host = host
+                self.health = {}
+                self.create_probe_forwards()
+                command = self.command(host)
+                if system() == 'Windows':
+                    self.process = subprocess.Popen(command, creationflags=subprocess.CREATE_NO_WINDOW)
+                else:
+                    remove_stale_control_sockets()
+                    os.makedirs(control_dir(), mode=0o700, exist_ok=True)
+                    self.process = subprocess.Popen(command)
+                self.forwarding = True
+            elif not self.forwarding and self.process.poll() is None:
+                if self.control(host, "forward"):
+                    self.forwarding = True
+                else:
+                    self.restart()
 
+    # Removes the forward but keeps the master connection for the next open
     def close(self):
-        if self.process:
-            self.process.terminate()
-            self.process = None
+        with self.lock:
+            self.wanted = False
+            if self.process is None:
+                return
+            if MULTIPLEXING and self.process.poll() is None:
+                if not self.forwarding or self.control(self.host, "cancel"):
+                    self.forwarding = False
+                    return
+            self.shutdown()
+
+    def shutdown(self):
+        with self.lock:
+            self.wanted = False
+            self.forwarding = False
+            if self.process:
+                self.process.terminate()
+                self.process = None
+
+    # A master that still answers only gets its forwards added again, which takes milliseconds; a master that is
+    # gone, or connected to another host, is replaced with a new handshake
+    def restart(self):
+        with self.lock:
+            if not self.wanted:
+                return
+            if MULTIPLEXING and self.process is not None and self.process.poll() is None \
+                    and self.host == self.host_provider() and self.control(self.host, "check"):
+                self.control(self.host, "cancel")
+                if self.control(self.host, "forward"):
+                    self.forwarding = True
+                    return
+            if self.process:
+                self.process.terminate()
+                self.process = None
+            self.open()
 
     def check(self):
         if not self.process:
             return "closed"
         return_code = self.process.poll()
         if return_code is None:
-            return "open"
+            return "open" if self.forwarding else "closed"
         elif return_code > 0:
             return "error"
         else:
             return "closed"
+
+    # The states found by the last probe; forwards that were not probed yet are "unknown"
+    def forward_states(self):
+        return forward_states(self)
+
+    # Probes the forwarded paths without a new connection to sshd and without a new process: a connection through
+    # every forward has to get to its far end, which fails as soon as the master is gone. A remote forward is
+    # probed through the local forward to its listener on the machine, which covers the whole way back to the
+    # local service.
+    def probe(self):
+        host, probe_forwards = self.host, self.probe_forwards
+        if not host or not self.forwarding:
+            return False
+        return probe_forwards_through(self, lambda forward: forward_reachable(
+            (probe_forwards[str(forward)] if forward.kind == "-R" else forward).listen_address()))
+
+    # the ssh process does not tell about its channels
+    def stats(self):
+        return {}
+
+
+# "openssh" runs the ssh binary, "paramiko" keeps the connection inside this process
+def create_tunnel(forwards=None, transport=None):
+    if transport in (None, "", "openssh"):
+        return SshTunnel(forwards)
+    if transport == "paramiko":
+        from .paramikotunnel import ParamikoTunnel
+        return ParamikoTunnel(forwards)
+    raise ValueError(f"Unknown SSH transport {transport}, use openssh or paramiko")
+
+
+def forward_states(tunnel):
+    if tunnel.check() != "open":
+        return {str(forward): "closed" for forward in tunnel.forwards}
+    return {str(forward): tunnel.health.get(str(forward), "unknown") for forward in tunnel.forwards}
+
+
+# Probes every forward of the tunnel with reachable(forward) and keeps their states in tunnel.health; returns
+# whether the tunnel works. A remote forward to a local service that is not running cannot get through either,
+# but that is no reason to reconnect the tunnel.
+def probe_forwards_through(tunnel, reachable):
+    health = {}
+    working = True
+    for forward in tunnel.forwards:
+        if reachable(forward):
+            health[str(forward)] = "open"
+        else:
+            health[str(forward)] = "down"
+            working = working and forward.kind == "-R" and not target_up(forward)
+    tunnel.health = health
+    return working
+
+
+def target_up(forward, timeout=PROBE_TIMEOUT):
+    host, port = forward.target
+    try:
+        socket.create_connection((host, int(port)), timeout).close()
+        return True
+    except OSError:
+        return False
+
+
+# Unlike an open port, which a load balancer or the hypervisor may already answer for, the version line
+# shows that sshd itself is running
+def ssh_banner_probe(host_provider, timeout=BANNER_TIMEOUT):
+    def probe():
+        host = host_provider()
+        if not host:
+            return False
+        hostname, port = resolve_address(host)
+        try:
+            with socket.create_connection((hostname, port), timeout) as connection:
+                connection.settimeout(timeout)
+                return connection.recv(256).startswith(b"SSH-")
+        except (OSError, TypeError):
+            return False
+    return probe
+
+
+# Watches a tunnel that should be open and restarts it with capped exponential backoff when it dies
+class TunnelSupervisor:
+
+    def __init__(self, tunnel, probe=None, clock=None, interval=PROBE_INTERVAL, max_failures=PROBE_FAILURES,
+                 min_backoff=MIN_BACKOFF, max_backoff=MAX_BACKOFF):
+        self.tunnel = tunnel
+        self.probe = probe or tunnel.probe
+        self.clock = clock or Clock()
+        self.interval = interval
+        self.max_failures = max_failures
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+        self.backoff = min_backoff
+        self.next_attempt = 0
+        self.failures = 0
+        self.reconnects = 0
+        self.downtime = 0.0
+        self.down_since = None
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.run, name="tunnel-supervisor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                self.check()
+            except Exception as e:
+                logger.warning(f"Tunnel check failed: {e!r}")
+
+    def recovered(self, now):
+        if self.down_since is not None:
+            self.downtime += now - self.down_since
+            tunnel_downtime.inc(now - self.down_since)
+            events.emit("tunnel_up", downtime=round(now - self.down_since, 3))
+            self.down_since = None
+        self.failures = 0
+        self.backoff = self.min_backoff
+
+    def check(self):
+        now = self.clock.now()
+        if not self.tunnel.wanted:
+            self.recovered(now)
+            tunnel_up.set(0)
+            return "closed"
+        selector = self.tunnel.host_provider
+        racing = isinstance(selector, ConnectorSelector)
+        if racing and selector.needs_race() and selector.reevaluate():
+            logger.info(f"Moving SSH tunnel to the faster {selector.connect_by}")
+            self.tunnel.restart()
+        running = self.tunnel.check() == "open"
+        if running and self.probe():
+            self.recovered(now)
+            tunnel_up.set(1)
+            return "open"
+        self.failures += 1
+        if running and self.failures < self.max_failures:
+            return "open"
+        if self.down_since is None:
+            logger.info("SSH tunnel is down")
+            tunnel_up.set(0)
+            events.emit("tunnel_down")
+            self.down_since = now
+        if now >= self.next_attempt:
+            if racing:
+                selector.reevaluate()
+            self.reconnects += 1
+            tunnel_reconnects.inc()
+            events.emit("tunnel_reconnect", attempt=self.reconnects)
+            logger.info(f"Reconnecting SSH tunnel (attempt {self.reconnects}), next try in {self.backoff} s")
+            self.tunnel.restart()
+            self.next_attempt = now + self.backoff
+            self.backoff = min(self.backoff * 2, self.max_backoff)
+        return "reconnecting"
+
+    def stats(self):
+        downtime = self.downtime
+        if self.down_since is not None:
+            downtime += self.clock.now() - self.down_since
+        return {"reconnects": self.reconnects, "downtime": downtime}
+
+
+def determine_host_name(machine_name, machine_id, public_ip):
+    connectors = {"machine_name": machine_name, "machine_id": machine_id, "public_ip": public_ip}
+    # resolve the host name like ssh does, so that a "Host" entry in ~/.ssh/config is honored
+    for type, id in connectors.items():
+        if id:
+            hostname = resolve_hostname(id)
+            if hostname:
+                return type, hostname
+    # if not found, return the first argument that looks like an IPv4 or IPv6 address
+    ip = compile("([0-2][0-9][0-9]\\.?){4}|[0-9:]+")
+    for type, id in connectors.items():
+        if id and ip.match(id):
+            return type, id
+    # if none found, return none
+    return None, None
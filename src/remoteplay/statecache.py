@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+import threading
+from hashlib import sha256
+from time import time
+
+from .common import get_config_dir
+
+STATE_VERSION = 2
+STATE_FILE = "state.json"
+# how long a saved machine state is trusted at startup, in seconds
+STATE_MAX_AGE = 300
+# how long a resolved SSH host name is reused before it is resolved again
+CONNECTION_MAX_AGE = 24 * 3600
+# past start/stop durations kept per machine and action
+DURATION_HISTORY = 10
+# how long the fastest connector measured on a network is used there without racing again
+ROUTE_MAX_AGE = 24 * 3600
+# times the player started a machine, kept per machine to learn when sessions usually begin
+SESSION_HISTORY = 100
+
+logger = logging.getLogger(__name__)
+
+
+def account_id(api_key):
+    # the API key itself is kept in config.ini only
+    return sha256((api_key or "").encode()).hexdigest()[:16]
+
+
+# Last known machine inventory and connection data, so that a restart can show them before the API answers.
+# The inventory is kept per account; everything else belongs to a machine id, which is unique across accounts.
+class StateCache:
+
+    def __init__(self, path=None, clock=time):
+        self.path = path or os.path.join(get_config_dir(), STATE_FILE)
+        self.clock = clock
+        self.data = self.empty()
+        # the tunnel supervisor stores routes from its own thread
+        self.lock = threading.RLock()
+
+    @staticmethod
+    def empty():
+        return {"version": STATE_VERSION, "machines": {}, "states": {}, "connections": {}, "routes": {},
+                "durations": {}, "sessions": {}}
+
+    # version 1 kept the inventory of the last account only
+    @staticmethod
+    def upgrade(data):
+        if data.get("version") == 1:
+            account, machines = data.pop("account", None), data.get("machines")
+            data["machines"] = {account: machines} if account and machines else {}
+            data["version"] = 2
+        return data
+
+    def load(self):
+        try:
+            with open(self.path) as state_file:
+                data = self.upgrade(json.load(state_file))
+            if data.get("version") == STATE_VERSION:
+                self.data = data
+            else:
+                logger.info(f"Ignoring state cache of version {data.get('version')}")
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not read state cache {self.path}: {e!r}")
+        return self
+
+    def save(self):
+        with self.lock:
+            try:
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+                temp_path = self.path + ".tmp"
+                with open(temp_path, "w") as state_file:
+                    json.dump(self.data, state_file)
+                os.replace(temp_path, self.path)
+            except OSError as e:
+                logger.warning(f"Could not write state cache {self.path}: {e!r}")
+
+    def is_fresh(self, entry, max_age):
+        return entry is not None and (max_age is None or self.clock() - entry["updated"] < max_age)
+
+    def machines(self, api_key, max_age=None):
+        entry = self.data["machines"].get(account_id(api_key))
+        return entry["items"] if self.is_fresh(entry, max_age) else None
+
+    def set_machines(self, api_key, machines):
+        with self.lock:
+            self.data["machines"][account_id(api_key)] = {"items": machines, "updated": self.clock()}
+            self.save()
+
+    def state(self, machine_id, max_age=STATE_MAX_AGE):
+        entry = self.data["states"].get(machine_id)
+        return entry["state"] if self.is_fresh(entry, max_age) else None
+
+    def set_state(self, machine_id, state):
+        with self.lock:
+            self.data["states"][machine_id] = {"state": state, "updated": self.clock()}
+            self.save()
+
+    def connection(self, machine_id, public_ip, max_age=CONNECTION_MAX_AGE):
+        entry = self.data["connections"].get(machine_id)
+        if self.is_fresh(entry, max_age) and entry["public_ip"] == public_ip:
+            return entry["connect_by"], entry["hostname"]
+        return None
+
+    def set_connection(self, machine_id, public_ip, connect_by, hostname):
+        with self.lock:
+            self.data["connections"][machine_id] = {
+                "public_ip": public_ip,
+                "connect_by": connect_by,
+                "hostname": hostname,
+                "updated": self.clock()
+            }
+            self.save()
+
+    def route(self, machine_id, network, max_age=ROUTE_MAX_AGE):
+        entry = self.data.get("routes", {}).get(f"{machine_id}@{network}")
+        return (entry["connect_by"], entry["hostname"]) if self.is_fresh(entry, max_age) else None
+
+    def set_route(self, machine_id, network, connect_by, hostname):
+        with self.lock:
+            self.data.setdefault("routes", {})[f"{machine_id}@{network}"] = {
+                "connect_by": connect_by,
+                "hostname": hostname,
+                "updated": self.clock()
+            }
+            self.save()
+
+    def durations(self, machine_id, action):
+        return list(self.data.get("durations", {}).get(f"{machine_id}/{action}", []))
+
+    def add_duration(self, machine_id, action, seconds):
+        with self.lock:
+            history = self.data.setdefault("durations", {}).setdefault(f"{machine_id}/{action}", [])
+            history.append(round(seconds, 1))
+            del history[:-DURATION_HISTORY]
+            self.save()
+
+    def sessions(self, machine_id):
+        return list(self.data.get("sessions", {}).get(machine_id, []))
+
+    def add_session(self, machine_id, timestamp=None):
+        with self.lock:
+            history = self.data.setdefault("sessions", {}).setdefault(machine_id, [])
+            history.append(round(self.clock() if timestamp is None else timestamp))
+            del history[:-SESSION_HISTORY]
+            self.save()
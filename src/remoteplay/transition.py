@@ -0,0 +1,131 @@
+import logging
+import statistics
+import threading
+
+from .common import check_state, request_patch, machine_cache, rate_limit_headers
+from .metrics import events, transitions
+from .scheduler import Clock, PollScheduler, MIN_WINDOW
+
+TARGET_STATES = {"start": "ready", "stop": "off"}
+
+logger = logging.getLogger(__name__)
+
+
+# Expected duration and the window around it that is polled densely, from past durations
+def estimate(durations):
+    if not durations:
+        return None
+    expected = statistics.median(durations)
+    return expected, max(MIN_WINDOW, min((max(durations) - min(durations)) / 2, expected / 2))
+
+
+# Orders the start and stop requests per machine: at most one transition per machine sends its PATCH and
+# waits at a time, a second request for the same action joins the running one instead of sending another
+# PATCH, and of the requests waiting behind a running transition only the newest is kept
+class MachineActions:
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.running = {}
+        self.pending = {}
+
+    def begin(self, transition):
+        machine_id = transition.machine_id
+        with self.condition:
+            running = self.running.get(machine_id)
+            if running is not None and running.action == transition.action and machine_id not in self.pending:
+                return "join"
+            replaced = self.pending.get(machine_id)
+            if replaced is not None:
+                replaced.cancelled = True
+            self.pending[machine_id] = transition
+            self.condition.notify_all()
+            while self.running.get(machine_id) is not None and not transition.cancelled:
+                self.condition.wait()
+            if self.pending.get(machine_id) is transition:
+                del self.pending[machine_id]
+            if transition.cancelled:
+                return "cancelled"
+            self.running[machine_id] = transition
+            return "run"
+
+    def end(self, transition):
+        with self.condition:
+            if self.running.get(transition.machine_id) is transition:
+                del self.running[transition.machine_id]
+            self.condition.notify_all()
+
+    # Cancels the start or stop that waits for the running one to finish; returns whether there was one
+    def cancel(self, machine_id):
+        with self.condition:
+            pending = self.pending.pop(machine_id, None)
+            if pending is not None:
+                pending.cancelled = True
+            self.condition.notify_all()
+            return pending is not None
+
+    def busy(self, machine_id):
+        with self.condition:
+            return machine_id in self.running or machine_id in self.pending
+
+
+machine_actions = MachineActions()
+
+
+class MachineTransition:
+
+    def __init__(self, machine_id, api_key, action, clock=None, durations=None, actions=None):
+        self.machine_id = machine_id
+        self.api_key = api_key
+        self.action = action
+        self.target_state = TARGET_STATES.get(action, "off")
+        self.clock = clock or Clock()
+        self.scheduler = PollScheduler(self.clock)
+        self.estimate = estimate(durations)
+        self.eta = None
+        self.actions = actions or machine_actions
+        self.cancelled = False
+        # how long the transition took, if one was requested
+        self.duration = None
+
+    def check_state(self):
+        return check_state(self.machine_id, self.api_key)
+
+    def remaining(self):
+        return None if self.eta is None else self.eta - self.clock.now()
+
+    def wait_for_state(self, target_state, status_callback):
+        self.scheduler.expect(target_state, self.eta, self.estimate[1] if self.estimate else MIN_WINDOW)
+        state = self.check_state()
+        while state != target_state:
+            self.scheduler.observe(state)
+            self.scheduler.observe_rate_limit(rate_limit_headers())
+            self.clock.sleep(self.scheduler.next_delay())
+            state = self.check_state()
+            status_callback(state)
+
+    # Returns False if the transition was cancelled before its request was sent
+    def run(self, status_callback):
+        outcome = self.actions.begin(self)
+        if outcome == "cancelled":
+            logger.info(f"{self.action} of {self.machine_id} cancelled")
+            return False
+        try:
+            if outcome == "join":
+                self.wait_for_state(self.target_state, status_callback)
+            elif self.check_state() != self.target_state:
+                start = self.clock.now()
+                if self.estimate is not None:
+                    self.eta = start + self.estimate[0]
+                request_patch(f"{self.machine_id}/{self.action}", self.api_key)
+                machine_cache.invalidate()
+                self.wait_for_state(self.target_state, status_callback)
+                elapsed = self.duration = self.clock.now() - start
+                self.eta = None
+                transitions.observe(elapsed, action=self.action)
+                events.emit("transition", machine_id=self.machine_id, action=self.action,
+                            seconds=round(elapsed, 3))
+        finally:
+            self.actions.end(self)
+        status_callback(self.target_state)
+        return True
@@ -1,13 +1,17 @@
 from platform import system
 import os
 import subprocess
-import psutil
+
+from .metrics import events, usb_server_starts
 
 
 class UsbServer:
 
     def __init__(self, path):
         self.vhusb_path = path
+        # the server process started by us, and the last vhusb process found on the system
+        self.process = None
+        self.found = None
 
     def start(self):
         if self.get_status() != "active":
@@ -16,19 +20,31 @@ class UsbServer:
                     self.vhusb_path = os.path.join("/", "Applications", "VirtualHereServerUniversal.app", "Contents",
                                                    "MacOS",
                                                    "vhusbdosx")
-                    subprocess.Popen(self.vhusb_path)
+                    self.process = subprocess.Popen(self.vhusb_path)
                 elif system() == 'Windows':
                     from ctypes import windll
                     self.vhusb_path = os.path.join("C:\\", "Program Files", "VirtualHere", "vhusbdwin64.exe")
                     windll.shell32.ShellExecuteW(None, "runas", self.vhusb_path, "", None, 1)
                 else:
-                    subprocess.Popen('vhuit64')
+                    self.process = subprocess.Popen('vhuit64')
             else:
-                subprocess.Popen(self.vhusb_path)
+                self.process = subprocess.Popen(self.vhusb_path)
+            usb_server_starts.inc()
+            events.emit("usb_server_start", path=self.vhusb_path)
+
+    def get_status(self):
+        if self.process is not None and self.process.poll() is None:
+            return "active"
+        # is_running() also compares the creation time, so a reused PID is not mistaken for the server
+        if self.found is not None and self.found.is_running():
+            return "active"
+        self.found = self.find_process()
+        return "active" if self.found is not None else "inactive"
 
     @staticmethod
-    def get_status():
+    def find_process():
+        import psutil
         for proc in psutil.process_iter(['name']):
-            if "vhusb" in proc.info['name']:
-                return "active"
-        return "inactive"
+            if "vhusb" in (proc.info['name'] or ""):
+                return proc
+        return None
@@ -0,0 +1,89 @@
+from PyQt5.QtGui import QColor, QPalette
+
+GRAY = "darkgray"
+GREEN = "green"
+YELLOW = "yellow"
+RED = "red"
+COLORS = (GRAY, GREEN, YELLOW, RED)
+
+MACHINE_COLORS = {"off": GRAY, "ready": GREEN}
+USB_SERVER_COLORS = {"inactive": GRAY, "active": GREEN}
+TUNNEL_COLORS = {"closed": GRAY, "error": RED, "open": GREEN}
+
+
+# Every field of the status panel is (text, color, tooltip); a color or tooltip of None keeps the shown one
+
+def machine_state_field(state):
+    return state, MACHINE_COLORS.get(state, YELLOW), None
+
+
+def usb_server_field(status):
+    return status, USB_SERVER_COLORS.get(status), None
+
+
+def tunnel_field(state, forwards, supervisor_stats, transport_stats):
+    down = [forward for forward, forward_state in forwards.items() if forward_state == "down"]
+    lines = [f"{forward}: {forward_state}" for forward, forward_state in forwards.items()]
+    lines.append(f"Reconnects: {supervisor_stats['reconnects']}, downtime: {supervisor_stats['downtime']:.1f} s")
+    if transport_stats:
+        lines += [f"{forward}: {counts['sent']} B sent, {counts['received']} B received"
+                  for forward, counts in transport_stats["traffic"].items()]
+        rtt = transport_stats["keepalive_rtt"]
+        lines.append(f"Open channels: {transport_stats['channels']}, keepalive: "
+                     f"{'-' if rtt is None else f'{rtt * 1000:.0f} ms'}")
+    if state == "open" and down:
+        return f"{state}, {len(down)} of {len(forwards)} forwards down", YELLOW, "\n".join(lines)
+    return state, TUNNEL_COLORS.get(state), "\n".join(lines)
+
+
+def text_field(text):
+    return text, None, None
+
+
+# The values the status panel shows; diff() tells which of them changed since the last update
+class StatusViewModel:
+
+    def __init__(self):
+        self.fields = {}
+
+    def diff(self, fields):
+        changed = {}
+        for name, (text, color, tooltip) in fields.items():
+            old = self.fields.get(name)
+            if old is not None:
+                color = old[1] if color is None else color
+                tooltip = old[2] if tooltip is None else tooltip
+            new = (text, color, tooltip)
+            if new != old:
+                changed[name] = (old or (None, None, None), new)
+                self.fields[name] = new
+        return changed
+
+
+# Shows a StatusViewModel in read-only line edits, writing only the properties that changed. Background colors
+# are set as pre-built palettes, because a style sheet is parsed and the widget restyled on every set.
+class StatusPanel:
+
+    def __init__(self, widgets):
+        self.widgets = widgets
+        self.model = StatusViewModel()
+        self.palettes = {}
+        for color in COLORS:
+            palette = QPalette()
+            palette.setColor(QPalette.Base, QColor(color))
+            self.palettes[color] = palette
+        # widget properties written so far, to measure the cost of an update
+        self.writes = 0
+
+    def update(self, **fields):
+        for name, ((old_text, old_color, old_tooltip), (text, color, tooltip)) in self.model.diff(fields).items():
+            widget = self.widgets[name]
+            if text != old_text:
+                widget.setText(text)
+                self.writes += 1
+            if color != old_color:
+                widget.setPalette(self.palettes[color])
+                self.writes += 1
+            if tooltip != old_tooltip:
+                widget.setToolTip(tooltip)
+                self.writes += 1
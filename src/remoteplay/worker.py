@@ -1,41 +1,103 @@
+import logging
+from queue import Queue
 from PyQt5.QtCore import QThread, pyqtSignal
-from time import sleep
-from .common import check_state, request_patch
+from .common import check_state, get_machine_pages
+from .sshtunnel import determine_host_name
+from .transition import MachineTransition
+
+logger = logging.getLogger(__name__)
 
-POLLING_DELAY = 5
 
 class ChangeMachineStatus(QThread):
     finished = pyqtSignal()
     status = pyqtSignal(str)
 
-    def __init__(self, machine_id, api_key, action):
+    def __init__(self, machine_id, api_key, action, clock=None, durations=None):
         super().__init__()
         self.machine_id = machine_id
         self.api_key = api_key
-        self.action = "start"
-        self.target_state = "ready"
         self.action = action
-        if action == "start":
-            self.target_state = "ready"
-        else:
-            self.target_state = "off"
+        self.transition = MachineTransition(machine_id, api_key, action, clock, durations)
+        self.target_state = self.transition.target_state
 
     def check_state(self):
-        return check_state(self.machine_id, self.api_key)
+        return self.transition.check_state()
 
     def wait_for_state(self, target_state, status_callback):
-        state = self.check_state()
-        while state != target_state:
-            sleep(POLLING_DELAY)
-            state = self.check_state()
-            status_callback(state)
+        self.transition.wait_for_state(target_state, status_callback)
 
-    def run(self):
-        def callback(state):
-            self.status.emit(state)
+    def remaining(self):
+        return self.transition.remaining()
 
-        if self.check_state() != self.target_state:
-            request_patch(f"{self.machine_id}/{self.action}", self.api_key)
-            self.wait_for_state(self.target_state, callback)
-        self.status.emit(self.target_state)
+    def run(self):
+        self.transition.run(self.status.emit)
         self.finished.emit()
+
+
+# Owns all Paperspace API reads, the process scan for the USB server and the host name lookup, so that the GUI
+# thread never waits for the network, psutil or ssh -G
+class StatusEngine(QThread):
+    # every page of the machine list as it arrives, then the whole list
+    machine_page = pyqtSignal(list)
+    machines = pyqtSignal(list)
+    status = pyqtSignal(str, str)
+    usb_server = pyqtSignal(str)
+    # machine id and (connect_by, hostname)
+    host_name = pyqtSignal(str, object)
+    failed = pyqtSignal(object)
+
+    def __init__(self):
+        super().__init__()
+        self.tasks = Queue()
+
+    def submit(self, task, *args):
+        self.tasks.put((task, args))
+
+    def list_machines(self, api_key):
+        self.submit(self.fetch_machines, api_key)
+
+    def poll(self, machine_id, api_key):
+        self.submit(self.fetch_state, machine_id, api_key)
+
+    def check_usb_server(self, usb_server):
+        self.submit(self.fetch_usb_server, usb_server)
+
+    def resolve_host_name(self, machine_name, machine_id, public_ip):
+        self.submit(self.fetch_host_name, machine_name, machine_id, public_ip)
+
+    def fetch_machines(self, api_key):
+        machines = []
+        for page in get_machine_pages(api_key):
+            machines += page
+            self.machine_page.emit(page)
+        self.machines.emit(machines)
+
+    def fetch_state(self, machine_id, api_key):
+        self.status.emit(machine_id, check_state(machine_id, api_key))
+
+    def fetch_usb_server(self, usb_server):
+        try:
+            status = usb_server.get_status()
+        except Exception as e:
+            # not a failed request, so the polls are left alone
+            logger.warning(f"USB server status unknown: {e!r}")
+            status = "unknown"
+        self.usb_server.emit(status)
+
+    def fetch_host_name(self, machine_name, machine_id, public_ip):
+        self.host_name.emit(machine_id, determine_host_name(machine_name, machine_id, public_ip))
+
+    def stop(self):
+        self.tasks.put(None)
+
+    def run(self):
+        while True:
+            item = self.tasks.get()
+            if item is None:
+                break
+            task, args = item
+            try:
+                task(*args)
+            except Exception as e:
+                logger.warning(f"Background request failed: {e!r}")
+                self.failed.emit(e)
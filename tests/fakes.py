@@ -0,0 +1,33 @@
+from time import sleep
+
+EPOCH = 1700000000
+
+
+# Clock of the tests: time only passes when the code under test sleeps or a test moves it on. Calling the clock
+# gives its monotonic time, for the code that takes a plain time function.
+class FakeClock:
+
+    def __init__(self, interrupt_after=None, pause=0):
+        self.elapsed = 0
+        self.sleeps = 0
+        # ends a loop after this many sleeps
+        self.interrupt_after = interrupt_after
+        # real time per sleep, so that the other threads of a test get to run
+        self.pause = pause
+
+    def now(self):
+        return self.elapsed
+
+    def __call__(self):
+        return self.elapsed
+
+    def time(self):
+        return EPOCH + self.elapsed
+
+    def sleep(self, seconds):
+        self.elapsed += seconds
+        self.sleeps += 1
+        if self.pause:
+            sleep(self.pause)
+        if self.sleeps == self.interrupt_after:
+            raise KeyboardInterrupt()
@@ -0,0 +1,144 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import Mock, patch
+
+from remoteplay import common
+from remoteplay.apitrace import ReplayClient, TraceRecorder, configure_trace, load_trace, redact, REDACTED
+from remoteplay.common import ApiClient, MachineCache, configure_client
+from tests.fakes import FakeClock
+
+
+def machines(state):
+    return {"items": [{"id": "psabc", "name": "Arcturus", "state": state}]}
+
+
+def entry(t, body, method="GET", path="", seconds=0.1, headers=None):
+    return {"t": t, "method": method, "path": path, "seconds": seconds, "status": 200, "headers": headers or {},
+            "body": body}
+
+
+class TestTraceRecorder(unittest.TestCase):
+
+    def setUp(self):
+        self.trace_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.trace_dir.name, "trace.jsonl")
+        self.client = ApiClient(base_url="http://127.0.0.1:1/v1")
+        self.client._session = Mock()
+        self.client.recorder = TraceRecorder(self.path)
+
+    def tearDown(self):
+        self.trace_dir.cleanup()
+
+    def respond(self, body, headers=None):
+        self.client._session.request.return_value = Mock(status_code=200, text=json.dumps(body),
+                                                         headers=headers or {})
+
+    def test_trace_is_compact_and_has_no_secrets(self):
+        self.respond({**machines("off"), "apiToken": "abc"}, {"ETag": '"v1"', "Set-Cookie": "session=1"})
+        self.client.get("", "MOCK_KEY", {"If-None-Match": '"v0"'})
+        self.client.get("", "MOCK_KEY")
+        self.respond({"message": "MOCK_KEY is not allowed"})
+        self.client.patch("psabc/start", "MOCK_KEY")
+
+        with open(self.path) as trace_file:
+            text = trace_file.read()
+        self.assertNotIn("MOCK_KEY", text)
+        self.assertNotIn("Bearer", text)
+        self.assertNotIn("session=1", text)
+        first, second, third = [json.loads(line) for line in text.splitlines()]
+        self.assertEqual(first["headers"], {"etag": '"v1"'})
+        self.assertEqual(first["request_headers"], {"If-None-Match": '"v0"'})
+        self.assertEqual(first["body"]["apiToken"], REDACTED)
+        self.assertTrue(second["unchanged"])
+        self.assertNotIn("body", second)
+        self.assertEqual(third["body"], {"message": f"{REDACTED} is not allowed"})
+
+        entries = load_trace(self.path)
+        self.assertEqual(entries[1]["body"], entries[0]["body"])
+
+    def test_errors_are_recorded(self):
+        self.client._session.request.side_effect = ConnectionError("refused")
+
+        with self.assertRaises(ConnectionError):
+            self.client.get("psabc", "MOCK_KEY")
+
+        self.assertEqual(load_trace(self.path)[0]["error"], "ConnectionError('refused')")
+
+    def test_redact(self):
+        self.assertEqual(redact({"a": [{"password": "x"}], "b": "key=K"}, "K"),
+                         {"a": [{"password": REDACTED}], "b": f"key={REDACTED}"})
+
+
+class TestReplayClient(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.entries = [entry(0, machines("off")), entry(0.5, {}, "PATCH", "psabc/start"),
+                        entry(10, machines("starting")), entry(30, machines("ready"), headers={"etag": '"v3"'})]
+
+    def state(self, client):
+        return client.get("", "KEY").json()["items"][0]["state"]
+
+    def test_states_follow_the_recorded_timeline(self):
+        client = ReplayClient(self.entries, clock=self.clock)
+
+        self.assertEqual(self.state(client), "off")
+        self.assertEqual(self.clock.elapsed, 0.1)
+        self.assertEqual(client.patch("psabc/start", "KEY").status_code, 200)
+        self.clock.sleep(10)
+        self.assertEqual(self.state(client), "starting")
+        self.clock.sleep(20)
+        self.assertEqual(self.state(client), "ready")
+        self.assertEqual(client.get("", "KEY", {"If-None-Match": '"v3"'}).status_code, 304)
+        self.assertEqual(client.requests, 5)
+
+    def test_faster_replay(self):
+        client = ReplayClient(self.entries, speed=10, clock=self.clock)
+
+        self.assertEqual(self.state(client), "off")
+        self.clock.sleep(3)
+        self.assertEqual(self.state(client), "ready")
+
+    def test_machine_cache_on_replay(self):
+        cache = MachineCache(ttl=2, clock=self.clock, api_client=ReplayClient(self.entries, clock=self.clock))
+
+        states = []
+        for _ in range(8):
+            states.append(cache.state("psabc", "KEY"))
+            self.clock.sleep(5)
+        self.assertEqual(states, ["off", "off", "starting", "starting", "starting", "starting", "ready", "ready"])
+
+    def test_unknown_requests_and_errors(self):
+        client = ReplayClient(self.entries + [{"t": 40, "method": "GET", "path": "psabc", "seconds": 5,
+                                               "error": "ConnectionError('refused')"}], clock=self.clock)
+
+        with self.assertRaises(LookupError):
+            client.patch("psabc/stop", "KEY")
+        with self.assertRaises(ConnectionError):
+            client.get("psabc", "KEY")
+
+
+class TestConfigureTrace(unittest.TestCase):
+
+    def test_recording_survives_client_configuration(self):
+        with patch("remoteplay.common.client", ApiClient()), tempfile.TemporaryDirectory() as trace_dir:
+            configure_trace(record_path=os.path.join(trace_dir, "trace.jsonl"))
+            recorder = common.client.recorder
+
+            self.assertIs(configure_client(retries=1).recorder, recorder)
+
+    def test_replay_replaces_the_client(self):
+        with patch("remoteplay.common.client", ApiClient()), tempfile.TemporaryDirectory() as trace_dir:
+            path = os.path.join(trace_dir, "trace.jsonl")
+            with open(path, "w") as trace_file:
+                trace_file.write(json.dumps(entry(0, machines("ready"))) + "\n")
+            configure_trace(replay_path=path, speed=100)
+
+            self.assertIsInstance(configure_client(retries=1), ReplayClient)
+            self.assertEqual(common.get_machines("KEY")[0]["state"], "ready")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+import threading
+import unittest
+from unittest.mock import Mock
+
+from remoteplay.boot import BootPipeline
+from tests.fakes import FakeClock
+
+
+class TestBootPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.tunnel = Mock()
+        self.tunnel.check.return_value = "closed"
+        self.usb_server = Mock()
+        self.answers = []
+
+    def probe(self):
+        self.clock.elapsed += 5
+        return self.answers.pop(0) if self.answers else False
+
+    def pipeline(self):
+        return BootPipeline(self.tunnel, self.usb_server, probe=self.probe, clock=self.clock, interval=0.001)
+
+    def test_tunnel_opens_when_sshd_answers(self):
+        self.answers = [False, False, True]
+        pipeline = self.pipeline()
+
+        pipeline.start()
+        pipeline.thread.join(5)
+
+        self.usb_server.start.assert_called_once()
+        self.tunnel.open.assert_called_once()
+        self.assertEqual(pipeline.reachable_after, 15)
+        self.clock.elapsed += 20
+        self.assertEqual(pipeline.ahead(), 20)
+
+    def test_tunnel_opened_otherwise_ends_the_pipeline(self):
+        self.tunnel.check.return_value = "open"
+        pipeline = self.pipeline()
+
+        pipeline.start()
+        pipeline.thread.join(5)
+
+        self.tunnel.open.assert_not_called()
+        self.assertIsNone(pipeline.ahead())
+
+    def test_stop(self):
+        pipeline = self.pipeline()
+
+        pipeline.start()
+        pipeline.stop()
+
+        self.assertIsNone(pipeline.thread)
+        self.tunnel.open.assert_not_called()
+
+    def test_stop_does_not_wait_for_a_probe(self):
+        answering = threading.Event()
+        answer = threading.Event()
+        pipeline = BootPipeline(self.tunnel, self.usb_server, probe=(lambda: answering.set() or answer.wait(5)),
+                                clock=self.clock, interval=0.001)
+        pipeline.start()
+        thread = pipeline.thread
+        answering.wait(5)
+
+        pipeline.stop(cancel=True)
+        self.assertTrue(thread.is_alive())
+        answer.set()
+        thread.join(5)
+
+        self.tunnel.open.assert_not_called()
+
+    def test_tunnel_opened_during_cancel_is_shut_down(self):
+        pipeline = self.pipeline()
+        started = threading.Event()
+        self.tunnel.open.side_effect = (lambda: started.wait(5) and pipeline.stop(cancel=True))
+        self.answers = [True]
+
+        pipeline.start()
+        thread = pipeline.thread
+        started.set()
+        thread.join(5)
+
+        self.tunnel.shutdown.assert_called_once()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import io
+import json
+import subprocess
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+from unittest.mock import patch
+
+from remoteplay.cli import Session, main
+from remoteplay.statecache import StateCache
+from tests.fakes import FakeClock
+
+MACHINE = {"id": "pskwujgcp", "name": "Arcturus", "state": "off", "publicIp": "74.82.29.115"}
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.states = iter([])
+        self.config_dir = tempfile.TemporaryDirectory()
+        self.patchers = [
+            patch("remoteplay.cli.machine_cache.machine", return_value=MACHINE),
+            patch("remoteplay.cli.determine_host_name", return_value=("machine_name", "arcturus")),
+            patch("remoteplay.cli.check_state", side_effect=(lambda i, k: next(self.states))),
+            patch("remoteplay.transition.check_state", side_effect=(lambda i, k: next(self.states))),
+            patch("remoteplay.transition.request_patch"),
+            patch("psutil.process_iter", return_value=[]),
+            patch("remoteplay.sshtunnel.subprocess.Popen"),
+            patch("remoteplay.cli.TunnelSupervisor"),
+            patch("remoteplay.sshtunnel.get_config_dir", return_value=self.config_dir.name),
+            patch("remoteplay.statecache.get_config_dir", return_value=self.config_dir.name),
+        ]
+        mocks = [p.start() for p in self.patchers]
+        self.mock_request_patch = mocks[4]
+        self.mock_tunnel_popen = mocks[6]
+        self.mock_tunnel_popen.return_value.poll.return_value = None
+        self.mock_supervisor = mocks[7]
+        self.mock_supervisor.return_value.stats.return_value = {"reconnects": 0, "downtime": 0.0}
+        self.out = io.StringIO()
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+        self.config_dir.cleanup()
+
+    def events(self):
+        return [json.loads(line) for line in self.out.getvalue().splitlines()]
+
+    def test_status(self):
+        self.states = iter(["off"])
+        Session("Arcturus", "MOCK_KEY", out=self.out).status()
+
+        event, = self.events()
+        self.assertEqual(event["event"], "status")
+        self.assertEqual(event["machine_id"], "pskwujgcp")
+        self.assertEqual(event["state"], "off")
+        self.assertEqual(event["usb_server"], "inactive")
+        self.assertEqual(event["ssh_tunnel"], "closed")
+
+    def test_start_reports_every_state(self):
+        self.states = iter(["off", "off", "starting", "ready"])
+        Session("Arcturus", "MOCK_KEY", out=self.out, clock=FakeClock()).start()
+
+        self.mock_request_patch.assert_called_with("pskwujgcp/start", "MOCK_KEY")
+        self.assertEqual([e["state"] for e in self.events()], ["starting", "ready", "ready"])
+
+    def test_start_estimates_the_time_left(self):
+        clock = FakeClock()
+        self.states = iter(["off", "off", "starting", "ready"])
+        Session("Arcturus", "MOCK_KEY", out=self.out, clock=clock).start()
+        self.states = iter(["off", "starting", "ready"])
+        self.out = io.StringIO()
+        Session("Arcturus", "MOCK_KEY", out=self.out, clock=clock).start()
+
+        self.assertIn("remaining", self.events()[0])
+        self.assertNotIn("remaining", self.events()[-1])
+
+    def test_watch_opens_tunnel_when_ready_and_closes_on_exit(self):
+        self.states = iter(["starting", "ready", "ready", "ready"])
+        Session("Arcturus", "MOCK_KEY", out=self.out, clock=FakeClock(interrupt_after=4)).watch()
+
+        self.assertEqual([e["state"] for e in self.events()], ["starting", "ready"])
+        self.assertEqual(self.events()[1]["ssh_tunnel"], "open")
+        self.assertEqual(self.events()[1]["reconnects"], 0)
+        self.mock_supervisor.return_value.stop.assert_called_once()
+        self.assertEqual(self.mock_tunnel_popen.call_count, 1)
+        self.mock_tunnel_popen.return_value.terminate.assert_called_once()
+
+    def test_watch_backs_off_after_api_errors(self):
+        states = iter([ConnectionError("down"), ConnectionError("down"), "ready", "ready"])
+
+        def check_state(machine_id, api_key):
+            state = next(states)
+            if isinstance(state, Exception):
+                raise state
+            return state
+
+        clock = FakeClock(interrupt_after=4)
+        with patch("remoteplay.cli.check_state", side_effect=check_state):
+            Session("Arcturus", "MOCK_KEY", out=self.out, clock=clock).watch()
+
+        self.assertEqual([e["event"] for e in self.events()], ["error", "error", "status"])
+        self.assertIn("ConnectionError", self.events()[0]["error"])
+        self.assertEqual(self.events()[-1]["ssh_tunnel"], "open")
+        self.assertGreaterEqual(clock.elapsed, 5 + 10)
+
+    def test_watch_starts_machine_ahead_of_a_session(self):
+        session = datetime.fromtimestamp(FakeClock().time()) + timedelta(minutes=3)
+        self.states = iter(["off", "off", "off", "starting", "ready"] + ["ready"] * 10)
+        Session("Arcturus", "MOCK_KEY", out=self.out, clock=FakeClock(interrupt_after=6),
+                prewarm=f"* {session:%H:%M}").watch()
+
+        self.mock_request_patch.assert_called_once_with("pskwujgcp/start", "MOCK_KEY")
+        self.assertEqual(self.events()[0]["event"], "prewarm")
+        self.assertEqual(self.events()[-1]["ssh_tunnel"], "open")
+        self.assertEqual(StateCache().load().sessions("pskwujgcp"), [])
+
+    def test_started_sessions_are_remembered(self):
+        self.states = iter(["off", "off", "starting", "ready"])
+        Session("Arcturus", "MOCK_KEY", out=self.out, clock=FakeClock()).start()
+
+        self.assertEqual(StateCache().load().sessions("pskwujgcp"), [1700000000])
+
+    def test_missing_api_key_is_rejected(self):
+        with patch("remoteplay.cli.load_config", return_value=None), self.assertRaises(SystemExit):
+            main(["-m", "Arcturus", "status"])
+
+
+class TestCliImports(unittest.TestCase):
+
+    def test_cli_does_not_import_qt(self):
+        result = subprocess.run([sys.executable, "-c", "import sys, remoteplay.cli; print('PyQt5' in sys.modules)"],
+                                capture_output=True, text=True)
+        self.assertEqual(result.stdout.strip(), "False")
+
+
+if __name__ == '__main__':
+    unittest.main()
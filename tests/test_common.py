@@ -1,21 +1,56 @@
 import unittest
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import sleep
 from unittest.mock import patch, Mock
-from remoteplay.common import check_state, request_get, request_patch
+
+import requests
+
+from remoteplay.common import check_state, request_get, request_patch, ApiClient, MachineCache, machine_cache
+from remoteplay.metrics import api_latency, api_requests
+from tests.fakes import FakeClock
+
+
+class StubApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests.append((self.command, self.path, self.client_address, dict(self.headers)))
+        status, body, delay, *headers = self.server.responses.pop(0) if self.server.responses else (
+            200, '{"state": "ready"}', 0)
+        sleep(delay)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        for name, value in (headers[0] if headers else {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body.encode())
+
+    do_PATCH = do_GET
+
+    def log_message(self, format, *args):
+        pass
 
 
 class TestCommon(unittest.TestCase):
 
 
-    @patch('remoteplay.common.requests.get')
+    def setUp(self):
+        machine_cache.invalidate()
+
+    @patch('remoteplay.common.client.session.request')
     def test_check_state(self, mock_get):
         mock_get.return_value.status_code = 200
-        mock_get.return_value.text = '{"state": "running"}'
+        mock_get.return_value.text = '{"items": [{"id": "your_machine_id", "name": "Arcturus", "state": "running"}]}'
         machine_id = "your_machine_id"
         api_key = "your_api_key"
         expected_state = "running"
         self.assertEqual(check_state(machine_id, api_key), expected_state)
+        self.assertEqual(check_state("other_machine_id", api_key), "unknown")
+        self.assertEqual(mock_get.call_count, 1)
 
-    @patch('remoteplay.common.requests.get')
+    @patch('remoteplay.common.client.session.request')
     def test_request_get(self, mock_get):
         mock_get.return_value.status_code = 200
         mock_get.return_value.text = '{"state": "running"}'
@@ -24,7 +59,7 @@ class TestCommon(unittest.TestCase):
         expected_response = {"state": "running"}
         self.assertEqual(request_get(path, api_key), expected_response)
 
-    @patch('remoteplay.common.requests.patch')
+    @patch('remoteplay.common.client.session.request')
     def test_request_patch(self, mock_patch):
         mock_patch.return_value.status_code = 200
         mock_patch.return_value.text = '{"status": "success"}'
@@ -32,6 +67,171 @@ class TestCommon(unittest.TestCase):
         api_key = "your_api_key"
         expected_response = {"status": "success"}
         self.assertEqual(request_patch(path, api_key), expected_response)
+        self.assertEqual(mock_patch.call_args.args[0], "PATCH")
+
+
+class StubServerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StubApiHandler)
+        self.server.requests = []
+        self.server.responses = []
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_port}/v1"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class TestApiClient(StubServerTestCase):
+
+    def test_connection_is_reused(self):
+        client = ApiClient(base_url=self.base_url, backoff_factor=0)
+
+        client.get("psabc", "MOCK_KEY")
+        client.get("psabc", "MOCK_KEY")
+        client.patch("psabc/start", "MOCK_KEY")
+
+        self.assertEqual(len(self.server.requests), 3)
+        self.assertEqual(len({r[2] for r in self.server.requests}), 1)
+        self.assertEqual(self.server.requests[2][:2], ("PATCH", "/v1/machines/psabc/start"))
+        self.assertEqual(self.server.requests[0][3]["authorization"], "Bearer MOCK_KEY")
+
+    def test_requests_are_measured(self):
+        client = ApiClient(base_url=self.base_url, backoff_factor=0)
+        before = api_latency.count(method="PATCH")
+
+        client.patch("psabc/start", "MOCK_KEY")
+
+        self.assertEqual(api_latency.count(method="PATCH"), before + 1)
+        self.assertGreater(api_requests.value(method="PATCH", status=200), 0)
+
+    def test_get_is_retried_on_server_error(self):
+        client = ApiClient(base_url=self.base_url, backoff_factor=0)
+        self.server.responses = [(503, '{}', 0), (502, '{}', 0), (200, '{"state": "off"}', 0)]
+
+        self.assertEqual(client.get("psabc", "MOCK_KEY").json(), {"state": "off"})
+        self.assertEqual(len(self.server.requests), 3)
+
+    def test_patch_is_not_retried_on_server_error(self):
+        client = ApiClient(base_url=self.base_url, backoff_factor=0)
+        self.server.responses = [(503, '{}', 0), (200, '{}', 0)]
+
+        self.assertEqual(client.patch("psabc/stop", "MOCK_KEY").status_code, 503)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_hanging_request_times_out(self):
+        client = ApiClient(base_url=self.base_url, timeout=(1, 0.2), retries=0)
+        self.server.responses = [(200, '{}', 1)]
+
+        with self.assertRaises(requests.exceptions.ConnectionError):
+            client.get("psabc", "MOCK_KEY")
+
+
+class TestMachineCache(StubServerTestCase):
+    LIST = '{"items": [{"id": "psabc", "name": "Arcturus", "state": "off", "publicIp": "74.82.29.115"}]}'
+
+    def setUp(self):
+        super().setUp()
+        self.clock = FakeClock()
+        self.cache = MachineCache(ttl=5, clock=self.clock, api_client=ApiClient(base_url=self.base_url))
+
+    def test_snapshot_is_shared_within_ttl(self):
+        self.server.responses = [(200, self.LIST, 0)]
+
+        self.assertEqual(self.cache.machine("Arcturus", "MOCK_KEY")["id"], "psabc")
+        self.assertEqual(self.cache.state("psabc", "MOCK_KEY"), "off")
+        self.assertEqual(len(self.server.requests), 1)
+
+        self.clock.elapsed = 6
+        self.server.responses = [(200, self.LIST.replace("off", "starting"), 0)]
+        self.assertEqual(self.cache.state("psabc", "MOCK_KEY"), "starting")
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_concurrent_queries_share_one_request(self):
+        self.server.responses = [(200, self.LIST, 0.2)]
+        states = []
+        threads = [threading.Thread(target=(lambda: states.append(self.cache.state("psabc", "MOCK_KEY"))))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(states, ["off"] * 4)
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_unchanged_list_is_revalidated_with_etag(self):
+        self.server.responses = [(200, self.LIST, 0, {"ETag": '"v1"'}), (304, '', 0)]
+
+        first = self.cache.machines("MOCK_KEY")
+        self.clock.elapsed = 6
+        second = self.cache.machines("MOCK_KEY")
+
+        self.assertIs(first, second)
+        self.assertEqual(self.server.requests[1][3]["If-None-Match"], '"v1"')
+
+    def test_all_pages_are_listed(self):
+        first = '{"hasMore": true, "nextPage": "c/1", "items": [{"id": "psabc", "name": "Arcturus", "state": "off"}]}'
+        second = '{"hasMore": false, "items": [{"id": "psdef", "name": "Vega", "state": "ready"}]}'
+        self.server.responses = [(200, first, 0, {"ETag": '"v1"'}), (200, second, 0), (200, first, 0),
+                                 (200, second, 0)]
+
+        pages = list(self.cache.pages("MOCK_KEY"))
+        self.clock.elapsed = 6
+        pages_again = list(self.cache.pages("MOCK_KEY"))
+
+        self.assertEqual([[m["id"] for m in page] for page in pages], [["psabc"], ["psdef"]])
+        self.assertEqual(pages_again, pages)
+        self.assertEqual([r[1] for r in self.server.requests], ["/v1/machines/", "/v1/machines/?after=c%2F1"] * 2)
+        self.assertNotIn("If-None-Match", self.server.requests[2][3])
+
+    def test_machine_stops_at_its_page(self):
+        first = '{"hasMore": true, "nextPage": "c1", "items": [{"id": "psabc", "name": "Arcturus", "state": "off"}]}'
+        self.server.responses = [(200, first, 0)]
+
+        self.assertEqual(self.cache.machine("Arcturus", "MOCK_KEY")["id"], "psabc")
+        self.assertEqual(len(self.server.requests), 1)
+
+    def test_paginated_account_polls_the_one_machine(self):
+        first = '{"hasMore": true, "nextPage": "c1", "items": [{"id": "psabc", "name": "Arcturus", "state": "off"}]}'
+        second = '{"hasMore": false, "items": [{"id": "psdef", "name": "Vega", "state": "ready"}]}'
+        self.server.responses = [(200, first, 0), (200, second, 0)] + [
+            (200, '{"id": "psdef", "name": "Vega", "state": "stopping"}', 0)] * 3
+
+        self.cache.machines("MOCK_KEY")
+        self.assertEqual(self.cache.state("psdef", "MOCK_KEY"), "ready")
+        self.clock.elapsed = 6
+        states = [self.cache.state("psdef", "MOCK_KEY") for _ in range(3)]
+
+        self.assertEqual(states, ["stopping"] * 3)
+        self.assertEqual([r[1] for r in self.server.requests[2:]], ["/v1/machines/psdef"] * 3)
+
+    def test_cache_can_be_used_between_pages(self):
+        first = '{"hasMore": true, "nextPage": "c1", "items": [{"id": "psabc", "name": "Arcturus", "state": "off"}]}'
+        second = '{"hasMore": false, "items": [{"id": "psdef", "name": "Vega", "state": "ready"}]}'
+        self.server.responses = [(200, first, 0), (200, '{"id": "psdef", "name": "Vega", "state": "ready"}', 0),
+                                 (200, second, 0), (200, first, 0)]
+
+        pages = self.cache.pages("MOCK_KEY")
+        next(pages)
+        self.cache.invalidate()
+        self.assertEqual(self.cache.state("psdef", "MOCK_KEY"), "ready")
+        self.assertEqual(next(pages)[0]["id"], "psdef")
+        # an abandoned listing holds nothing
+        next(self.cache.pages("MOCK_KEY", force=True))
+        self.assertTrue(self.cache.lock.acquire(blocking=False))
+        self.cache.lock.release()
+
+    def test_invalidate_forces_refetch(self):
+        self.server.responses = [(200, self.LIST, 0), (200, self.LIST.replace("off", "starting"), 0)]
+
+        self.cache.machines("MOCK_KEY")
+        self.cache.invalidate()
+
+        self.assertEqual(self.cache.state("psabc", "MOCK_KEY"), "starting")
+        self.assertEqual(len(self.server.requests), 2)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,113 @@
+import concurrent.futures
+import os
+import socket
+import tempfile
+import unittest
+from unittest.mock import patch, Mock
+
+from remoteplay.connector import ConnectorSelector, race
+from remoteplay.sshtunnel import SshTunnel, TunnelSupervisor
+from remoteplay.statecache import StateCache
+from tests.fakes import FakeClock
+
+
+def closed_port():
+    listener = socket.create_server(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    return port
+
+
+class TestRace(unittest.TestCase):
+
+    def setUp(self):
+        self.listener = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(self.listener.close)
+        self.addresses = {
+            "Arcturus": ("127.0.0.1", closed_port()),
+            "pskwujgcp": ("127.0.0.1", self.listener.getsockname()[1]),
+            "74.82.29.115": (None, 22),
+        }
+        self.resolve_patch = patch("remoteplay.connector.resolve_address", side_effect=self.addresses.get)
+        self.resolve_patch.start()
+
+    def tearDown(self):
+        self.resolve_patch.stop()
+
+    def test_reachable_candidate_wins(self):
+        connect_by, hostname, rtt = race({"machine_name": "Arcturus", "machine_id": "pskwujgcp",
+                                          "public_ip": "74.82.29.115"})
+
+        self.assertEqual((connect_by, hostname), ("machine_id", "127.0.0.1"))
+        self.assertLess(rtt, 1)
+
+    def test_nothing_reachable(self):
+        self.assertIsNone(race({"machine_name": "Arcturus", "public_ip": "74.82.29.115", "machine_id": None}))
+
+
+    def test_slow_candidates_time_out(self):
+        # Python 3.10 raises the TimeoutError of concurrent.futures, which is not the builtin one
+        with patch("remoteplay.connector.as_completed", side_effect=concurrent.futures.TimeoutError()):
+            self.assertIsNone(race({"machine_id": "pskwujgcp"}))
+
+
+class TestConnectorSelector(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.state_cache = StateCache(os.path.join(self.state_dir.name, "state.json"))
+        self.network = "192.168.1.10"
+        self.winner = ("public_ip", "74.82.29.115", 0.02)
+        self.mock_race = Mock(side_effect=(lambda candidates: self.winner))
+        self.clock = FakeClock()
+        self.connectors = {"machine_name": (lambda: "Arcturus"), "public_ip": (lambda: "74.82.29.115")}
+
+    def tearDown(self):
+        self.state_dir.cleanup()
+
+    def selector(self):
+        return ConnectorSelector(self.connectors, "machine_name", "arcturus.example.com", "pskwujgcp",
+                                 self.state_cache, network=(lambda: self.network), race=self.mock_race,
+                                 clock=self.clock)
+
+    def test_winner_is_remembered_per_network(self):
+        selector = self.selector()
+        self.assertEqual(selector(), "Arcturus")
+        self.assertTrue(selector.needs_race())
+
+        self.assertTrue(selector.reevaluate())
+        self.assertEqual(selector(), "74.82.29.115")
+        self.assertFalse(selector.needs_race())
+        self.mock_race.assert_called_once_with({"machine_name": "Arcturus", "public_ip": "74.82.29.115"})
+
+        self.assertEqual(self.selector()(), "74.82.29.115")
+        self.network = "10.0.0.5"
+        self.assertEqual(self.selector()(), "Arcturus")
+
+    def test_failed_race_is_retried_later(self):
+        self.winner = None
+        selector = self.selector()
+
+        self.assertFalse(selector.reevaluate())
+        self.assertEqual(selector(), "Arcturus")
+        self.assertFalse(selector.needs_race())
+        self.clock.elapsed = 10
+        self.assertTrue(selector.needs_race())
+
+    def test_supervisor_moves_tunnel_to_winner(self):
+        tunnel = SshTunnel()
+        tunnel.host_provider = self.selector()
+        tunnel.restart = Mock()
+        tunnel.wanted = True
+        tunnel.check = Mock(return_value="open")
+        supervisor = TunnelSupervisor(tunnel, probe=(lambda: True), clock=self.clock)
+
+        self.assertEqual(supervisor.check(), "open")
+        tunnel.restart.assert_called_once()
+        self.assertEqual(supervisor.check(), "open")
+        self.assertEqual(self.mock_race.call_count, 1)
+        self.assertEqual(supervisor.stats()["reconnects"], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import unittest
+from unittest.mock import patch, Mock
+
+from PyQt5.QtWidgets import QApplication
+
+from remoteplay.dashboard import MachineTableModel, DashboardWindow
+from remoteplay.worker import StatusEngine
+
+app = QApplication.instance() or QApplication([])
+
+
+def fleet(count, **states):
+    return [{
+        "id": f"ps{n:04}",
+        "name": f"Machine {n}",
+        "state": states.get(f"ps{n:04}", "off"),
+        "publicIp": f"74.82.29.{n}"
+    } for n in range(count)]
+
+
+class SingleThreadStatusEngine(StatusEngine):
+    def start(self, priority=None):
+        pass
+
+    def submit(self, task, *args):
+        task(*args)
+
+
+class TestMachineTableModel(unittest.TestCase):
+
+    def setUp(self):
+        self.model = MachineTableModel()
+        self.changes = []
+        self.model.dataChanged.connect(lambda first, last: self.changes.append((first.row(), first.column(),
+                                                                                last.column())))
+
+    def test_only_changed_rows_are_reported(self):
+        self.assertEqual(self.model.update_machines(fleet(60), {}), 60)
+        self.assertEqual(self.model.rowCount(), 60)
+
+        self.assertEqual(self.model.update_machines(fleet(60), {}), 0)
+        self.assertEqual(self.changes, [])
+
+        self.assertEqual(self.model.update_machines(fleet(60, ps0007="starting"), {"ps0042": "open"}), 2)
+        self.assertEqual(self.changes, [(7, 2, 2), (42, 4, 4)])
+
+    def test_removed_and_added_machines(self):
+        self.model.update_machines(fleet(3), {})
+
+        machines = fleet(3)[1:] + [{"id": "psnew", "name": "New", "state": "off", "publicIp": None}]
+        self.assertEqual(self.model.update_machines(machines, {}), 2)
+        self.assertEqual([self.model.machine_id(row) for row in range(3)], ["ps0001", "ps0002", "psnew"])
+
+
+class TestDashboardWindow(unittest.TestCase):
+
+    def setUp(self):
+        self.machines = fleet(5)
+        self.patchers = [
+            patch("remoteplay.dashboard.StatusEngine", SingleThreadStatusEngine),
+            patch("remoteplay.dashboard.load_config", return_value={"api_key": "MOCK_KEY"}),
+            patch("remoteplay.worker.get_machine_pages", side_effect=(lambda api_key: [self.machines])),
+            patch("remoteplay.dashboard.ChangeMachineStatus"),
+            patch("psutil.process_iter", return_value=[]),
+            patch("remoteplay.usbserver.subprocess.Popen"),
+        ]
+        mocks = [p.start() for p in self.patchers]
+        self.mock_get_machines = mocks[2]
+        self.mock_change_status = mocks[3]
+        self.window = DashboardWindow()
+
+    def tearDown(self):
+        self.window.close()
+        for p in self.patchers:
+            p.stop()
+
+    def test_all_machines_come_from_one_list_request(self):
+        self.assertEqual(self.window.model.rowCount(), 5)
+        self.assertEqual(self.mock_get_machines.call_count, 1)
+
+        self.machines = fleet(5, ps0003="starting")
+        self.window.handle_timer()
+
+        self.assertEqual(self.window.model.rows[3][2], "starting")
+        self.assertEqual(self.mock_get_machines.call_count, 2)
+        self.assertTrue(self.window.scheduler.in_transition())
+
+    def test_start_selected_machine(self):
+        self.window.table.selectRow(2)
+
+        self.window.start_stop_machine("start")
+        self.window.start_stop_machine("start")
+
+        self.mock_change_status.assert_called_once_with("ps0002", "MOCK_KEY", "start")
+        self.assertIn("ps0002", self.window.transitions)
+
+    def test_opposite_action_is_queued(self):
+        self.window.table.selectRow(2)
+
+        self.window.start_stop_machine("start")
+        self.window.start_stop_machine("stop")
+        self.window.start_stop_machine("stop")
+
+        self.assertEqual([c.args[2] for c in self.mock_change_status.call_args_list], ["start", "stop"])
+        self.assertEqual([action for action, thread in self.window.transitions["ps0002"]], ["start", "stop"])
+
+    def test_usb_server_is_scanned_by_the_worker(self):
+        self.assertEqual(self.window.usb_server_label.text(), "USB Server: inactive")
+        with patch("remoteplay.dashboard.StatusEngine.check_usb_server") as check_usb_server:
+            self.window.handle_timer()
+            self.window.handle_timer()
+
+        self.assertEqual(check_usb_server.call_count, 1)
+
+    def test_tunnel_opens_once_the_host_name_is_resolved(self):
+        self.machines = fleet(5, ps0002="ready")
+        self.window.handle_timer()
+        self.window.table.selectRow(2)
+        tunnel = Mock()
+        with patch("remoteplay.dashboard.StatusEngine.resolve_host_name") as resolve_host_name, \
+                patch("remoteplay.dashboard.create_tunnel", return_value=tunnel), \
+                patch("remoteplay.dashboard.TunnelSupervisor"):
+            self.window.toggle_tunnel()
+            resolve_host_name.assert_called_once_with("Machine 2", "ps0002", "74.82.29.2")
+            tunnel.open.assert_not_called()
+
+            self.window.host_name_resolved("ps0002", ("public_ip", "74.82.29.2"))
+
+        tunnel.open.assert_called_once()
+        self.assertEqual(tunnel.host_provider.hostname, "74.82.29.2")
+
+
+if __name__ == '__main__':
+    unittest.main()
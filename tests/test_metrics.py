@@ -0,0 +1,75 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from urllib.request import urlopen
+
+from remoteplay.metrics import EventLog, Registry, serve, transitions
+from remoteplay.transition import MachineTransition
+from tests.fakes import FakeClock
+
+
+class TestRegistry(unittest.TestCase):
+
+    def test_render(self):
+        registry = Registry()
+        polls = registry.counter("polls_total", "Polls")
+        latency = registry.histogram("latency_seconds", "Latency", (0.1, 1))
+        polls.inc(kind="state")
+        polls.inc(kind="state")
+        latency.observe(0.5, method="GET")
+
+        self.assertEqual(registry.render().splitlines(), [
+            "# HELP polls_total Polls",
+            "# TYPE polls_total counter",
+            'polls_total{kind="state"} 2',
+            "# HELP latency_seconds Latency",
+            "# TYPE latency_seconds histogram",
+            'latency_seconds_bucket{method="GET",le="0.1"} 0',
+            'latency_seconds_bucket{method="GET",le="1"} 1',
+            'latency_seconds_bucket{method="GET",le="+Inf"} 1',
+            'latency_seconds_sum{method="GET"} 0.5',
+            'latency_seconds_count{method="GET"} 1',
+        ])
+
+    def test_endpoint(self):
+        server = serve(0)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        with urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            self.assertIn("# TYPE remoteplay_api_request_seconds histogram", response.read().decode())
+
+
+class TestEventLog(unittest.TestCase):
+
+    def test_events_are_json_lines(self):
+        with tempfile.TemporaryDirectory() as log_dir:
+            path = os.path.join(log_dir, "events.jsonl")
+            EventLog().emit("ignored")
+            log = EventLog(path)
+            log.emit("tunnel_down")
+            log.emit("transition", action="start", seconds=42.0)
+
+            with open(path) as log_file:
+                records = [json.loads(line) for line in log_file]
+        self.assertEqual([r["event"] for r in records], ["tunnel_down", "transition"])
+        self.assertEqual(records[1]["seconds"], 42.0)
+
+
+class TestInstrumentation(unittest.TestCase):
+
+    def test_transition_duration_is_recorded(self):
+        states = iter(["off", "starting", "ready"])
+        clock = FakeClock()
+        before = transitions.count(action="start")
+        with patch("remoteplay.transition.check_state", side_effect=(lambda i, k: next(states))), \
+                patch("remoteplay.transition.request_patch"):
+            MachineTransition("pskwujgcp", "MOCK_KEY", "start", clock).run(lambda state: None)
+
+        self.assertEqual(transitions.count(action="start"), before + 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
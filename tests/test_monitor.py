@@ -0,0 +1,103 @@
+import socketserver
+import threading
+import unittest
+from unittest.mock import Mock
+
+from remoteplay.monitor import LinkMonitor, RingBuffer, THROUGHPUT_EVERY, parse_address
+
+
+class EchoHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        while data := self.request.recv(65536):
+            self.request.sendall(data)
+
+
+class EchoServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class TestRingBuffer(unittest.TestCase):
+
+    def test_keeps_last_values(self):
+        buffer = RingBuffer(3)
+        self.assertIsNone(buffer.percentile(50))
+        for value in range(5):
+            buffer.append(value)
+        self.assertEqual(buffer.values(), [2, 3, 4])
+        self.assertEqual(len(buffer), 3)
+
+    def test_percentiles(self):
+        buffer = RingBuffer(100)
+        for value in range(100, 0, -1):
+            buffer.append(value)
+        self.assertEqual([buffer.percentile(p) for p in (50, 95, 99, 100)], [50, 95, 99, 100])
+
+
+class TestLinkMonitor(unittest.TestCase):
+
+    def setUp(self):
+        self.server = EchoServer(("127.0.0.1", 0), EchoHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.tunnel = Mock()
+        self.tunnel.check.return_value = "open"
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_round_trip_and_throughput_through_echo(self):
+        monitor = LinkMonitor(self.tunnel, echo=self.server.server_address)
+        for _ in range(THROUGHPUT_EVERY + 1):
+            self.assertTrue(monitor.measure())
+
+        stats = monitor.stats()
+        self.assertEqual(stats["samples"], THROUGHPUT_EVERY + 1)
+        self.assertEqual(len(monitor.throughput), 2)
+        self.assertLess(stats["rtt"]["p99"], 1)
+        self.assertGreater(stats["throughput"], 0)
+        self.assertIn("Mbit/s", monitor.summary())
+
+    def test_connect_time_without_echo(self):
+        self.tunnel.host_provider.return_value = "arcturus"
+        monitor = LinkMonitor(self.tunnel)
+        monitor.target = (lambda: self.server.server_address)
+
+        self.assertTrue(monitor.measure())
+        self.assertEqual(len(monitor.throughput), 0)
+        self.assertTrue(monitor.summary().endswith("ms"))
+        self.assertEqual(monitor.stats()["measured"], "ssh connect")
+        self.assertEqual(monitor.label(), "SSH connect")
+
+    def test_failed_measurement_does_not_end_the_monitor(self):
+        monitor = LinkMonitor(self.tunnel, echo=self.server.server_address, interval=0.01)
+        measured = threading.Event()
+        failures = iter([ValueError("bug"), OSError("unreachable")])
+
+        def measure():
+            failure = next(failures, None)
+            if failure is not None:
+                raise failure
+            measured.set()
+
+        monitor.measure = measure
+        with self.assertLogs("remoteplay.monitor", "INFO"):
+            monitor.start()
+            self.assertTrue(measured.wait(5))
+            monitor.stop()
+
+    def test_closed_tunnel_is_not_measured(self):
+        self.tunnel.check.return_value = "closed"
+        monitor = LinkMonitor(self.tunnel, echo=self.server.server_address)
+
+        self.assertFalse(monitor.measure())
+        self.assertEqual(monitor.summary(), "no samples")
+
+    def test_parse_address(self):
+        self.assertEqual(parse_address("localhost:7576"), ("localhost", 7576))
+        with self.assertRaises(ValueError):
+            parse_address("localhost")
+
+
+if __name__ == '__main__':
+    unittest.main()
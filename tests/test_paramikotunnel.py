@@ -0,0 +1,307 @@
+import socket
+import threading
+import time
+import unittest
+
+import paramiko
+
+from remoteplay.paramikotunnel import ParamikoTunnel
+from remoteplay.sshtunnel import create_tunnel, parse_forwards, SshTunnel
+
+HOST_KEY = paramiko.RSAKey.generate(2048)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("localhost", 0))
+        return s.getsockname()[1]
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("Condition not reached")
+        time.sleep(0.01)
+
+
+def pipe(source, destination):
+    try:
+        while data := source.recv(4096):
+            destination.sendall(data)
+    except (OSError, EOFError):
+        pass
+    finally:
+        source.close()
+        destination.close()
+
+
+def relay(channel, connection):
+    threading.Thread(target=pipe, args=(channel, connection), daemon=True).start()
+    threading.Thread(target=pipe, args=(connection, channel), daemon=True).start()
+
+
+# A local TCP service that sends back what it gets
+class EchoServer:
+
+    def __init__(self):
+        self.server = socket.create_server(("localhost", 0))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(target=pipe, args=(connection, connection), daemon=True).start()
+
+    def close(self):
+        self.server.close()
+
+
+# An SSH server in this process that accepts any client and supports remote and local forwards
+class SshServer(paramiko.ServerInterface):
+
+    def __init__(self):
+        self.server = socket.create_server(("localhost", 0))
+        self.port = self.server.getsockname()[1]
+        self.transports = []
+        self.listeners = {}
+        self.destinations = {}
+        self.connected = []
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def run(self):
+        while True:
+            try:
+                connection, _ = self.server.accept()
+            except OSError:
+                return
+            transport = paramiko.Transport(connection)
+            transport.add_server_key(HOST_KEY)
+            self.transports.append(transport)
+            transport.start_server(server=self)
+            threading.Thread(target=self.accept_channels, args=(transport,), daemon=True).start()
+
+    def accept_channels(self, transport):
+        while transport.is_active():
+            channel = transport.accept(0.1)
+            if channel is not None:
+                relay(channel, self.destinations.pop(channel.get_id()))
+
+    def connect(self, host):
+        transport = paramiko.Transport(("localhost", self.port))
+        transport.start_client()
+        transport.auth_none("player")
+        return transport
+
+    def close(self):
+        self.server.close()
+        for listener in self.listeners.values():
+            listener.close()
+        for transport in self.transports:
+            transport.close()
+
+    def get_allowed_auths(self, username):
+        return "none"
+
+    def check_auth_none(self, username):
+        return paramiko.AUTH_SUCCESSFUL
+
+    def check_channel_request(self, kind, chanid):
+        return paramiko.OPEN_SUCCEEDED
+
+    # like sshd, connects to the destination before the channel is confirmed
+    def check_channel_direct_tcpip_request(self, chanid, origin, destination):
+        self.connected.append(destination)
+        try:
+            self.destinations[chanid] = socket.create_connection(destination)
+        except OSError:
+            return paramiko.OPEN_FAILED_CONNECT_FAILED
+        return paramiko.OPEN_SUCCEEDED
+
+    def check_port_forward_request(self, address, port):
+        listener = socket.create_server(("localhost", port))
+        self.listeners[port] = listener
+        transport = self.transports[-1]
+
+        def accept():
+            while True:
+                try:
+                    connection, peer = listener.accept()
+                except OSError:
+                    return
+                try:
+                    channel = transport.open_forwarded_tcpip_channel(peer, (address, port))
+                except (paramiko.SSHException, EOFError):
+                    # refused by the client, or the connection is gone
+                    connection.close()
+                    continue
+                relay(channel, connection)
+        threading.Thread(target=accept, daemon=True).start()
+        return port
+
+    def cancel_port_forward_request(self, address, port):
+        self.stop_listening(port)
+
+    # shut down first, as a close alone does not end an accept() waiting in another thread
+    def stop_listening(self, port):
+        listener = self.listeners.pop(port, None)
+        if listener is not None:
+            try:
+                listener.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            listener.close()
+
+
+class TestParamikoTunnel(unittest.TestCase):
+
+    def setUp(self):
+        self.server = SshServer()
+        self.echo = EchoServer()
+        self.connects = 0
+        self.tunnels = []
+
+    def tearDown(self):
+        for tunnel in self.tunnels:
+            tunnel.shutdown()
+        self.server.close()
+        self.echo.close()
+
+    def tunnel(self, forwards):
+        def connect(host):
+            self.connects += 1
+            return self.server.connect(host)
+        tunnel = ParamikoTunnel(parse_forwards(forwards), connect)
+        tunnel.host_provider = lambda: "arcturus"
+        self.tunnels.append(tunnel)
+        return tunnel
+
+    def round_trip(self, port, data=b"hello"):
+        with socket.create_connection(("localhost", port), 2) as connection:
+            connection.sendall(data)
+            received = b""
+            while len(received) < len(data):
+                received += connection.recv(4096)
+        return received
+
+    def test_remote_forward(self):
+        port = free_port()
+        tunnel = self.tunnel(f"-R {port}:localhost:{self.echo.port}")
+
+        tunnel.open()
+        wait_until(lambda: tunnel.check() == "open")
+
+        self.assertEqual(self.round_trip(port), b"hello")
+        forward = f"-R {port}:localhost:{self.echo.port}"
+        wait_until(lambda: tunnel.stats()["traffic"][forward]["sent"] == 5)
+        self.assertEqual(tunnel.stats()["traffic"][forward]["received"], 5)
+        self.assertEqual(tunnel.forward_states(), {forward: "unknown"})
+        self.assertTrue(tunnel.probe())
+        self.assertEqual(tunnel.forward_states(), {forward: "open"})
+
+    def test_probe_goes_through_the_remote_forward(self):
+        port = free_port()
+        tunnel = self.tunnel(f"-R {port}:localhost:{self.echo.port}")
+        tunnel.open()
+        wait_until(lambda: tunnel.check() == "open")
+
+        self.assertTrue(tunnel.probe())
+
+        self.server.stop_listening(port)
+        self.assertFalse(tunnel.probe())
+        self.assertEqual(tunnel.check(), "open")
+
+    def test_local_forward_counts_open_channels(self):
+        port = free_port()
+        tunnel = self.tunnel(f"-L {port}:localhost:{self.echo.port}")
+
+        tunnel.open()
+        wait_until(lambda: tunnel.check() == "open")
+
+        with socket.create_connection(("localhost", port), 2) as connection:
+            connection.sendall(b"ping")
+            self.assertEqual(connection.recv(4096), b"ping")
+            self.assertEqual(tunnel.stats()["channels"], 1)
+        wait_until(lambda: tunnel.stats()["channels"] == 0)
+        self.assertEqual(self.server.connected, [("localhost", self.echo.port)])
+
+    def test_reopen_reuses_the_connection(self):
+        port = free_port()
+        tunnel = self.tunnel(f"-R {port}:localhost:{self.echo.port}")
+        tunnel.open()
+        wait_until(lambda: tunnel.check() == "open")
+
+        tunnel.close()
+        self.assertEqual(tunnel.check(), "closed")
+        wait_until(lambda: port not in self.server.listeners)
+        with self.assertRaises(OSError):
+            self.round_trip(port)
+
+        tunnel.open()
+        wait_until(lambda: tunnel.check() == "open")
+        self.assertEqual(self.round_trip(port), b"hello")
+        self.assertEqual(self.connects, 1)
+
+    def test_open_does_not_wait_for_the_server(self):
+        port = free_port()
+        tunnel = self.tunnel(f"-R {port}:localhost:{self.echo.port}")
+        changes = []
+        tunnel.forwards_changed = changes.append
+        tunnel.open()
+        wait_until(lambda: changes == [True])
+        tunnel.close()
+        wait_until(lambda: changes == [True, False])
+
+        # a keepalive that is not answered
+        with tunnel.global_requests:
+            started = time.monotonic()
+            tunnel.open()
+            self.assertLess(time.monotonic() - started, 0.5)
+            self.assertEqual(tunnel.check(), "closed")
+        wait_until(lambda: tunnel.check() == "open")
+        self.assertEqual(changes, [True, False, True])
+
+    def test_keepalive(self):
+        tunnel = self.tunnel(f"-R {free_port()}:localhost:{self.echo.port}")
+        tunnel.open()
+        wait_until(lambda: tunnel.stats()["keepalive_rtt"] is not None)
+
+        tunnel.last_reply -= 10
+        self.assertEqual(tunnel.check(), "error")
+
+    def test_failed_connection_is_retried(self):
+        tunnel = self.tunnel(f"-R {free_port()}:localhost:{self.echo.port}")
+        tunnel.connect = lambda host: socket.create_connection(("localhost", free_port()))
+
+        tunnel.open()
+        wait_until(lambda: tunnel.check() == "error")
+
+        tunnel.connect = self.server.connect
+        tunnel.restart()
+        wait_until(lambda: tunnel.check() == "open")
+
+    def test_shutdown_while_connecting(self):
+        tunnel = self.tunnel(f"-R {free_port()}:localhost:{self.echo.port}")
+
+        tunnel.open()
+        tunnel.shutdown()
+
+        time.sleep(0.2)
+        self.assertEqual(tunnel.check(), "closed")
+        self.assertIsNone(tunnel.transport)
+
+    def test_transport_selection(self):
+        self.assertIsInstance(create_tunnel(), SshTunnel)
+        self.assertIsInstance(create_tunnel(transport="paramiko"), ParamikoTunnel)
+        with self.assertRaises(ValueError):
+            create_tunnel(transport="telnet")
+        with self.assertRaises(ValueError):
+            ParamikoTunnel(parse_forwards("-D 1080"))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+from datetime import datetime, timedelta
+
+from remoteplay.prewarm import PrewarmPlanner, boot_time, learn_windows, parse_windows, DEFAULT_BOOT_TIME, \
+    READY_MARGIN
+
+# a Monday
+MONDAY = datetime(2026, 10, 12)
+
+
+def at(day, hour, minute):
+    return (MONDAY + timedelta(days=day, hours=hour, minutes=minute)).timestamp()
+
+
+class TestWindows(unittest.TestCase):
+
+    def test_parse(self):
+        learn, windows = parse_windows("auto; mon-fri 19:00; sat,sun 10:30; fri-mon 23:15")
+        self.assertTrue(learn)
+        self.assertEqual(windows, [(frozenset(range(5)), 19 * 60), (frozenset([5, 6]), 10 * 60 + 30),
+                                   (frozenset([4, 5, 6, 0]), 23 * 60 + 15)])
+        self.assertEqual(parse_windows("* 8:05"), (False, [(frozenset(range(7)), 8 * 60 + 5)]))
+
+    def test_invalid_windows_are_rejected(self):
+        for text in ("monday 19:00", "mon-fri", "mon 25:00", "mon 19h"):
+            with self.assertRaises(ValueError):
+                parse_windows(text)
+
+    def test_learn_usual_session_times(self):
+        starts = [at(0, 19, 5), at(7, 18, 50), at(14, 19, 20), at(1, 12, 0), at(2, 20, 0), at(2, 20, 10),
+                  at(-35, 8, 0), at(-28 - 7, 8, 0)]
+        now = MONDAY + timedelta(days=15)
+
+        self.assertEqual(learn_windows(starts, now), [(frozenset([0]), 19 * 60 + 5)])
+
+    def test_boot_time(self):
+        self.assertEqual(boot_time([]), DEFAULT_BOOT_TIME)
+        self.assertEqual(boot_time([100, 120, 140]), 140)
+
+
+class TestPrewarmPlanner(unittest.TestCase):
+
+    def test_due_once_within_the_lead_time(self):
+        planner = PrewarmPlanner(parse_windows("mon-fri 19:00")[1])
+        session = MONDAY + timedelta(hours=19)
+        lead = timedelta(seconds=180 + READY_MARGIN)
+
+        self.assertIsNone(planner.due(session - lead - timedelta(minutes=1), 180))
+        self.assertEqual(planner.next_start(session - timedelta(hours=1), 180), session - lead)
+        self.assertEqual(planner.due(session - lead, 180), session)
+        self.assertIsNone(planner.due(session - lead + timedelta(minutes=1), 180))
+        self.assertIsNone(planner.due(session + timedelta(minutes=1), 180))
+        self.assertEqual(planner.next_start(session, 180), session + timedelta(days=1) - lead)
+
+    def test_sessions_after_midnight(self):
+        planner = PrewarmPlanner(parse_windows("sat 00:02")[1])
+        friday_night = MONDAY + timedelta(days=4, hours=23, minutes=59)
+
+        self.assertEqual(planner.due(friday_night), MONDAY + timedelta(days=5, minutes=2))
+
+    def test_learned_sessions(self):
+        starts = [at(-7, 21, 0), at(-14, 21, 0)]
+        planner = PrewarmPlanner([], learn=True, starts=lambda: starts)
+
+        self.assertEqual(planner.due(MONDAY + timedelta(hours=20, minutes=56)), MONDAY + timedelta(hours=21))
+        self.assertIsNone(PrewarmPlanner([], starts=lambda: starts).due(MONDAY + timedelta(hours=20, minutes=56)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,13 +1,24 @@
+from configparser import ConfigParser
 import unittest
 from unittest.mock import patch, Mock, MagicMock, call
 import faulthandler
+import os
 import platform
+import tempfile
+from datetime import datetime, timedelta
 
+from PyQt5.QtGui import QPalette
 from PyQt5.QtWidgets import QApplication
 
 from remoteplay.__main__ import MainWindow
-from remoteplay.worker import ChangeMachineStatus
+from remoteplay.boot import BootPipeline
+from remoteplay.worker import ChangeMachineStatus, StatusEngine
+from remoteplay.prewarm import PrewarmPlanner, parse_windows
+from remoteplay.statecache import StateCache
+from remoteplay.sshconfig import SshConfigResolver
+from remoteplay.sshtunnel import SshTunnel
 import remoteplay.worker
+from tests.fakes import FakeClock
 
 API_KEY = 'MOCK_KEY'
 app = None
@@ -25,13 +36,45 @@ class TestMainWindow(MainWindow):
 
 
 class SingleThreadStatusChanger(ChangeMachineStatus):
-    def __init__(self, machine_id, api_key, action):
-        super().__init__(machine_id, api_key, action)
+    def __init__(self, machine_id, api_key, action, durations=None):
+        super().__init__(machine_id, api_key, action, FakeClock(), durations)
 
     def start(self, priority=None):
         self.run()
 
 
+class SingleThreadBootPipeline(BootPipeline):
+    reachable = False
+
+    def __init__(self, tunnel, usb_server):
+        super().__init__(tunnel, usb_server, probe=(lambda: SingleThreadBootPipeline.reachable), clock=FakeClock())
+
+    def start(self, priority=None):
+        self.started = self.clock.now()
+        self.usb_server.start()
+        self.step()
+
+
+class SingleThreadStatusEngine(StatusEngine):
+    def start(self, priority=None):
+        pass
+
+    def submit(self, task, *args):
+        task(*args)
+
+
+class DeferredStatusEngine(StatusEngine):
+    def start(self, priority=None):
+        pass
+
+    def submit(self, task, *args):
+        self.tasks.put((task, args))
+
+    def run_tasks(self):
+        self.stop()
+        self.run()
+
+
 class RemotePlayTest(unittest.TestCase):
 
     def _mock_usb_active(self, param):
@@ -40,9 +83,8 @@ class RemotePlayTest(unittest.TestCase):
         else:
             return []
 
-    def _mock_request_get(self, path, api_key):
-        if path == "":
-            return self.sample_api_response()
+    def _mock_get_machine_pages(self, api_key):
+        return [self.sample_api_response()["items"]]
 
     def _mock_request_patch(self, path, api_key):
         if "start" in path:
@@ -65,16 +107,23 @@ class RemotePlayTest(unittest.TestCase):
 
     def _mock_main_popen(self):
         print("Mocking subprocess to simulate start of external commands")
-        self.popen_main_patcher = patch("remoteplay.__main__.subprocess.Popen")
+        self.popen_main_patcher = patch("remoteplay.sshtunnel.subprocess.Popen")
         self.mock_main_popen = self.popen_main_patcher.start()
         mock_process = Mock()
-        mock_process.stdout = ["hostname: remoteplay.example.com"]
         mock_process.poll = (lambda: 0)
         self.mock_main_popen.return_value = mock_process
+        print("Mocking the tunnel supervisor so tunnels are only opened by the window")
+        self.supervisor_patch = patch("remoteplay.__main__.TunnelSupervisor")
+        self.supervisor_patch.start().return_value.stats.return_value = {"reconnects": 0, "downtime": 0.0}
+        self.link_monitor_patch = patch("remoteplay.__main__.LinkMonitor")
+        link_monitor = self.link_monitor_patch.start().return_value
+        link_monitor.summary.return_value = "no samples"
+        link_monitor.label.return_value = "SSH connect"
+        link_monitor.description.return_value = "Time to connect to the SSH port of the machine"
 
     def _mock_usbserver(self):
         print("Mocking psutil to simulate presence of USB server")
-        self.psutil_patcher = patch("remoteplay.usbserver.psutil.process_iter")
+        self.psutil_patcher = patch("psutil.process_iter")
         self.mock_process_iter = self.psutil_patcher.start()
         self.mock_process_iter.side_effect = self._mock_usb_active
         self.mock_usbserver_patcher = patch("remoteplay.usbserver.subprocess.Popen")
@@ -82,30 +131,55 @@ class RemotePlayTest(unittest.TestCase):
 
     def _mock_common(self):
         print("Mocking the request_get and request_patch methods in the common module")
-        self.request_get_patch = patch('remoteplay.__main__.request_get', autospec=True)
+        self.request_get_patch = patch('remoteplay.worker.get_machine_pages', autospec=True)
         self.mock_request_get = self.request_get_patch.start()
-        self.mock_request_get.side_effect = self._mock_request_get
-        self.request_patch_patch = patch('remoteplay.worker.request_patch', autospec=True)
+        self.mock_request_get.side_effect = self._mock_get_machine_pages
+        self.request_patch_patch = patch('remoteplay.transition.request_patch', autospec=True)
         self.mock_request_patch = self.request_patch_patch.start()
         self.mock_request_patch.side_effect = self._mock_request_patch
-        self.check_state_patch = patch('remoteplay.__main__.check_state', autospec=True)
-        self.mock_check_state = self.check_state_patch.start()
-        self.mock_check_state.side_effect = self._mock_check_state
         self.check_state_patch2 = patch('remoteplay.worker.check_state', autospec=True)
         self.mock_check_state2 = self.check_state_patch2.start()
         self.mock_check_state2.side_effect = self._mock_check_state
+        self.check_state_patch3 = patch('remoteplay.transition.check_state', autospec=True)
+        self.mock_check_state3 = self.check_state_patch3.start()
+        self.mock_check_state3.side_effect = self._mock_check_state
 
     def _mock_platform(self):
         self.platform_patch = patch("remoteplay.usbserver.system")
         self.mock_platform = self.platform_patch.start()
         self.mock_platform.return_value = 'Darwin'
 
+    def _mock_state_cache(self):
+        print("Mocking the state cache directory")
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.state_cache_patch = patch("remoteplay.statecache.get_config_dir", return_value=self.state_dir.name)
+        self.state_cache_patch.start()
+        print("Mocking the ssh configuration")
+        self.ssh_config_patch = patch("remoteplay.sshconfig.resolver", SshConfigResolver(
+            os.path.join(self.state_dir.name, "ssh_config"), os.path.join(self.state_dir.name, "ssh_config")))
+        self.ssh_config_patch.start()
+        self.control_dir_patch = patch("remoteplay.sshtunnel.get_config_dir", return_value=self.state_dir.name)
+        self.control_dir_patch.start()
+        self.free_port_patch = patch("remoteplay.sshtunnel.free_port", return_value=47575)
+        self.free_port_patch.start()
+        tunnel = SshTunnel()
+        tunnel.create_probe_forwards()
+        self.ssh_command = tunnel.command('Arcturus')
+
+    def _mock_status_engine(self):
+        print("Mocking the status engine to run requests synchronously")
+        self.status_engine_patch = patch("remoteplay.__main__.StatusEngine", SingleThreadStatusEngine)
+        self.status_engine_patch.start()
+        SingleThreadBootPipeline.reachable = False
+        self.boot_pipeline_patch = patch("remoteplay.__main__.BootPipeline", SingleThreadBootPipeline)
+        self.boot_pipeline_patch.start()
+
     def _mock_status_change(self):
         print("Mocking the machine status change")
         self.change_status_patch = patch("remoteplay.__main__.ChangeMachineStatus")
         self.change_status_mock = self.change_status_patch.start()
         self.change_status_mock.side_effect = (
-            lambda i, k, a: SingleThreadStatusChanger(i, k, a))
+            lambda i, k, a, durations=None: SingleThreadStatusChanger(i, k, a, durations))
 
         print("Mocking the machine status change signals")
         self.change_status_emit_patch = patch("remoteplay.__main__.ChangeMachineStatus.status.emit")
@@ -120,7 +194,7 @@ class RemotePlayTest(unittest.TestCase):
     def setUpClass(cls):
         global app
         print("Creating the test application")
-        app = QApplication([])
+        app = QApplication.instance() or QApplication([])
 
     @classmethod
     def tearDownClass(cls):
@@ -133,14 +207,13 @@ class RemotePlayTest(unittest.TestCase):
         TestMainWindow.mock_name = 'Arcturus'
         TestMainWindow.mock_api_key = 'MOCK_KEY'
 
-        remoteplay.worker.POLLING_DELAY = 1
         self.usb_active = False
         self.sample_api_response = (lambda: {
             "hasMore": False,
             "items": [{
                 "id": "pskwujgcp",
                 "name": "Arcturus",
-                "state": self.mock_state,
+                "state": "off",
                 "publicIp": "74.82.29.115"
             }]
         })
@@ -150,6 +223,8 @@ class RemotePlayTest(unittest.TestCase):
         self._mock_write()
         self._mock_main_popen()
         self._mock_status_change()
+        self._mock_status_engine()
+        self._mock_state_cache()
         self._mock_common()
 
         self.dumpfile = open("../test_remoteplay.dump", "a")
@@ -159,13 +234,22 @@ class RemotePlayTest(unittest.TestCase):
         print("Cleaning up")
         self.config_write_patcher.stop()
         self.popen_main_patcher.stop()
+        self.supervisor_patch.stop()
+        self.link_monitor_patch.stop()
         self.psutil_patcher.stop()
         self.mock_usbserver_patcher.stop()
         self.request_get_patch.stop()
         self.request_patch_patch.stop()
-        self.check_state_patch.stop()
         self.check_state_patch2.stop()
+        self.check_state_patch3.stop()
         self.change_status_patch.stop()
+        self.status_engine_patch.stop()
+        self.boot_pipeline_patch.stop()
+        self.state_cache_patch.stop()
+        self.ssh_config_patch.stop()
+        self.control_dir_patch.stop()
+        self.free_port_patch.stop()
+        self.state_dir.cleanup()
         self.change_status_emit_patch.stop()
         self.change_finished_emit_patch.stop()
         self.platform_patch.stop()
@@ -175,7 +259,7 @@ class RemotePlayTest(unittest.TestCase):
         self.mock_main_window = TestMainWindow()
 
         print("Checking if get_machines was called")
-        self.mock_request_get.assert_called_with("", API_KEY)
+        self.mock_request_get.assert_called_with(API_KEY)
         self.assertEqual(self.mock_main_window.button.text(), 'Start remote')
 
         self.mock_main_window.start_stop_machine("start")
@@ -184,11 +268,11 @@ class RemotePlayTest(unittest.TestCase):
         if platform.system() == 'Darwin':
             self.mock_main_popen.assert_has_calls([
                 call('/Applications/VirtualHereServerUniversal.app/Contents/MacOS/vhusbdosx'),
-                call(['ssh', '-N', '-R', '7575:localhost:7575', '-o', 'StrictHostKeyChecking=no', 'Arcturus'])])
+                call(self.ssh_command)])
         elif platform.system() == 'Windows':
             self.mock_main_popen.assert_has_calls([
                 call('/Applications\\VirtualHereServerUniversal.app\\Contents\\MacOS\\vhusbdosx'),
-                call(['ssh', '-N', '-R', '7575:localhost:7575', '-o', 'StrictHostKeyChecking=no', 'Arcturus'])])
+                call(self.ssh_command)])
         self.assertEqual(self.mock_main_window.machine_state_bar.text(), 'ready')
         self.assertEqual(self.mock_main_window.button.text(), 'Stop remote')
 
@@ -197,19 +281,17 @@ class RemotePlayTest(unittest.TestCase):
 
         self.mock_main_window = TestMainWindow()
 
-        self.mock_request_get.assert_called_with("", API_KEY)
+        self.mock_request_get.assert_called_with(API_KEY)
         self.assertEqual(self.mock_main_window.button.text(), 'Stop remote')
 
         self.mock_main_popen.assert_called_with(
-            ['ssh', '-N', '-R', '7575:localhost:7575', '-o', 'StrictHostKeyChecking=no', 'Arcturus'])
+            self.ssh_command)
 
         self.mock_main_window.start_stop_machine("stop")
 
         self.mock_request_patch.assert_called_with("pskwujgcp/stop", API_KEY)
         self.mock_main_popen.assert_has_calls([
-            # called to find the host name
-            call(['ssh', '-G', 'Arcturus'], stdout=-1, stderr=-1, text=True),
-            call(['ssh', '-N', '-R', '7575:localhost:7575', '-o', 'StrictHostKeyChecking=no', 'Arcturus']),
+            call(self.ssh_command),
             call().terminate()
         ])
 
@@ -231,9 +313,7 @@ class RemotePlayTest(unittest.TestCase):
         self.mock_main_window.handle_timer()
 
         self.mock_main_popen.assert_has_calls([
-            # called to find the host name
-            call(['ssh', '-G', 'Arcturus'], stdout=-1, stderr=-1, text=True),
-            call(['ssh', '-N', '-R', '7575:localhost:7575', '-o', 'StrictHostKeyChecking=no', 'Arcturus']),
+            call(self.ssh_command),
             call().terminate()
         ])
 
@@ -257,9 +337,7 @@ class RemotePlayTest(unittest.TestCase):
         self.mock_main_window.handle_timer()
 
         self.mock_main_popen.assert_has_calls([
-            # called to find the host name
-            call(['ssh', '-G', 'Arcturus'], stdout=-1, stderr=-1, text=True),
-            call(['ssh', '-N', '-R', '7575:localhost:7575', '-o', 'StrictHostKeyChecking=no', 'Arcturus'])
+            call(self.ssh_command)
         ])
 
         self.assertEqual(self.mock_main_window.machine_state_bar.text(), 'ready')
@@ -275,11 +353,76 @@ class RemotePlayTest(unittest.TestCase):
 
         self.mock_main_window.init_paperspace_values()
 
-        self.mock_request_get.assert_called_with("", "MOCK_KEY")
+        self.mock_request_get.assert_called_with("MOCK_KEY")
         self.assertEqual(self.mock_main_window.machine_name_text.currentText(), 'Arcturus')
         self.assertEqual(self.mock_main_window.machine_state_bar.text(), 'off')
         self.assertEqual(self.mock_main_window.button.text(), 'Start remote')
 
+    def test_machine_list_is_requested_again_after_a_failure(self):
+        self.mock_request_get.side_effect = ConnectionError("offline")
+        with patch("remoteplay.__main__.StatusEngine", DeferredStatusEngine):
+            self.mock_main_window = TestMainWindow()
+            self.mock_main_window.engine.run_tasks()
+            self.assertEqual(self.mock_main_window.machine_name_text.count(), 0)
+
+            self.mock_request_get.side_effect = self._mock_get_machine_pages
+            self.mock_main_window.handle_timer()
+            self.mock_main_window.handle_timer()
+            self.mock_main_window.engine.run_tasks()
+
+        self.assertEqual(self.mock_request_get.call_count, 2)
+        self.assertEqual(self.mock_main_window.machine_name_text.currentText(), 'Arcturus')
+        self.assertEqual(self.mock_main_window.machine_id, 'pskwujgcp')
+
+    def test_failed_polls_back_off(self):
+        with patch("remoteplay.__main__.StatusEngine", DeferredStatusEngine):
+            self.mock_main_window = TestMainWindow()
+            self.mock_main_window.engine.run_tasks()
+            self.mock_check_state2.side_effect = ConnectionError("API down")
+            delays = []
+            for _ in range(3):
+                self.mock_main_window.handle_timer()
+                self.mock_main_window.engine.run_tasks()
+                delays.append(self.mock_main_window.timer.interval())
+
+        self.assertEqual(delays, sorted(delays))
+        self.assertGreater(delays[-1], delays[0])
+        self.assertGreaterEqual(delays[-1], 20000)
+
+    def test_machine_list_is_shown_page_by_page(self):
+        TestMainWindow.mock_api_key = None
+        other = [{"id": f"ps{n:04}", "name": f"Machine {n}", "state": "off", "publicIp": None} for n in range(3)]
+        seen = []
+
+        def pages(api_key):
+            yield other
+            seen.append((self.mock_main_window.machine_name_text.count(), self.mock_main_window.machine_id))
+            yield self.sample_api_response()["items"]
+            seen.append((self.mock_main_window.machine_name_text.count(), self.mock_main_window.machine_id))
+        self.mock_request_get.side_effect = pages
+        self.mock_main_window = TestMainWindow()
+        self.mock_main_window.paperspace_key_text.setText("MOCK_KEY")
+
+        self.mock_main_window.init_paperspace_values()
+
+        self.assertEqual(seen, [(3, None), (4, "pskwujgcp")])
+        self.assertEqual(self.mock_main_window.machine_name_text.currentText(), 'Arcturus')
+        self.assertEqual(len(StateCache().load().machines("MOCK_KEY")), 4)
+        completer = self.mock_main_window.machine_name_text.completer()
+        completer.setCompletionPrefix("chine 2")
+        self.assertEqual((completer.completionCount(), completer.currentCompletion()), (1, "Machine 2"))
+
+    def test_polls_keep_the_search_text(self):
+        self.mock_main_window = TestMainWindow()
+        self.mock_main_window.machine_name_text.setEditText("Veg")
+
+        self.mock_main_window.update_data()
+        self.assertEqual(self.mock_main_window.machine_name_text.currentText(), "Veg")
+
+        self.mock_main_window.machine_name = "Vega"
+        self.mock_main_window.update_data()
+        self.assertEqual(self.mock_main_window.machine_name_text.currentText(), "Vega")
+
     def test_change_name(self):
         self.sample_api_response = (lambda: {
             "hasMore": False,
@@ -300,7 +443,7 @@ class RemotePlayTest(unittest.TestCase):
 
         self.mock_main_window.init_paperspace_values()
 
-        self.mock_request_get.assert_called_with("", "MOCK_KEY")
+        self.mock_request_get.assert_called_with("MOCK_KEY")
 
         self.mock_main_window.machine_name_text.setCurrentText("OtherServer")
 
@@ -313,5 +456,130 @@ class RemotePlayTest(unittest.TestCase):
         self.assertEqual(self.mock_main_window.machine_state_bar.text(), 'off')
         self.assertEqual(self.mock_main_window.button.text(), 'Start remote')
 
+    def test_poll_result_for_other_machine_is_ignored(self):
+        self.mock_main_window = TestMainWindow()
+
+        self.mock_main_window.state_polled("skwujgcpp", "ready")
+
+        self.assertEqual(self.mock_main_window.machine_state, 'off')
+        self.assertEqual(self.mock_main_window.button.text(), 'Start remote')
+
+    def test_warm_start_uses_saved_state(self):
+        state_cache = StateCache()
+        state_cache.set_machines(API_KEY, self.sample_api_response()["items"])
+        state_cache.set_connection("pskwujgcp", "74.82.29.115", "machine_name", "arcturus.example.com")
+        state_cache.set_state("pskwujgcp", "ready")
+        self.mock_state = (lambda: "ready")
+        self.mock_request_get.side_effect = None
+        self.mock_request_get.return_value = [[]]
+
+        self.mock_main_window = TestMainWindow()
+
+        self.assertEqual(self.mock_main_window.hostname, "arcturus.example.com")
+        self.assertEqual(self.mock_main_window.machine_state_bar.text(), 'ready')
+        self.assertEqual(self.mock_main_window.button.text(), 'Stop remote')
+        self.mock_main_popen.assert_called_once_with(
+            self.ssh_command)
+
+    def test_window_opens_before_process_scan_and_host_name_lookup(self):
+        StateCache().set_machines(API_KEY, self.sample_api_response()["items"])
+        self.usb_active = True
+        with patch("remoteplay.__main__.StatusEngine", DeferredStatusEngine), \
+                patch("remoteplay.worker.determine_host_name", return_value=("machine_name", "arcturus")) as lookup:
+            self.mock_main_window = TestMainWindow()
+            self.mock_process_iter.assert_not_called()
+            lookup.assert_not_called()
+            self.assertEqual(self.mock_main_window.usb_server_bar.text(), "unknown")
+
+            self.mock_main_window.engine.run_tasks()
+
+        self.assertEqual(self.mock_main_window.usb_server_bar.text(), "active")
+        self.assertEqual(self.mock_main_window.host_name_text.text(), "arcturus")
+        self.assertEqual(StateCache().load().connection("pskwujgcp", "74.82.29.115"), ("machine_name", "arcturus"))
+
+    def save_config(self, settings):
+        config_file_path = os.path.join(self.state_dir.name, "config.ini")
+        with open(config_file_path, "w") as config_file:
+            config_file.write("[REMOTE_PLAY]\nmachine_name = Arcturus\napi_key = MOCK_KEY\n")
+            config_file.writelines(f"{key} = {value}\n" for key, value in settings.items())
+        self.mock_main_window = TestMainWindow()
+        self.mock_main_window.machine_name = "Vega"
+
+        with patch("remoteplay.__main__.get_config_dir", return_value=self.state_dir.name), \
+                patch("remoteplay.__main__.configparser.ConfigParser", ConfigParser):
+            self.mock_main_window.save_config()
+
+        config = ConfigParser()
+        config.read(config_file_path)
+        return dict(config["REMOTE_PLAY"])
+
+    def test_saving_keeps_the_api_client_settings(self):
+        settings = {"api_timeout": "20", "api_retries": "5"}
+        self.assertEqual(self.save_config(settings), {"machine_name": "Vega", "api_key": "MOCK_KEY", **settings})
+
+    def test_saving_keeps_the_metrics_settings(self):
+        settings = {"metrics_port": "9100", "event_log": "events.jsonl"}
+        self.assertEqual(self.save_config(settings), {"machine_name": "Vega", "api_key": "MOCK_KEY", **settings})
+
+    def test_saving_keeps_the_api_trace_settings(self):
+        settings = {"api_record": "trace.jsonl", "api_replay": "replay.jsonl", "api_replay_speed": "10"}
+        self.assertEqual(self.save_config(settings), {"machine_name": "Vega", "api_key": "MOCK_KEY", **settings})
+
+    def test_prewarm_starts_machine_before_a_session(self):
+        self.mock_main_window = TestMainWindow()
+        session = datetime.now() + timedelta(minutes=3)
+        self.mock_main_window.prewarm_planner = PrewarmPlanner(parse_windows(f"* {session:%H:%M}")[1])
+
+        self.mock_main_window.check_prewarm()
+        self.mock_main_window.check_prewarm()
+
+        self.mock_request_patch.assert_called_once_with("pskwujgcp/start", API_KEY)
+        self.assertEqual(self.mock_main_window.machine_state_bar.text(), 'ready')
+        self.mock_main_popen.assert_called_with(self.ssh_command)
+        self.assertEqual(StateCache().load().sessions("pskwujgcp"), [])
+
+        self.mock_main_window.start_stop_machine("stop")
+        self.mock_main_window.start_stop_machine("start")
+        self.assertEqual(len(StateCache().load().sessions("pskwujgcp")), 1)
+
+    def test_tunnel_opens_when_sshd_answers_before_ready(self):
+        SingleThreadBootPipeline.reachable = True
+        self.mock_main_window = TestMainWindow()
+        tunnel_open_at_request = []
+        self.mock_request_patch.side_effect = (lambda path, api_key: (
+            tunnel_open_at_request.append(call(self.ssh_command) in self.mock_main_popen.call_args_list),
+            self._mock_request_patch(path, api_key)))
+
+        self.mock_main_window.start_stop_machine("start")
+
+        self.assertEqual(tunnel_open_at_request, [True])
+        self.assertEqual(self.mock_main_popen.call_args_list.count(call(self.ssh_command)), 1)
+        self.assertEqual(self.mock_main_window.machine_state_bar.text(), 'ready')
+        self.assertIsNone(self.mock_main_window.boot_pipeline)
+
+    def test_unchanged_status_writes_no_widgets(self):
+        self.mock_state = (lambda: "ready")
+        self.mock_main_window = TestMainWindow()
+        writes = self.mock_main_window.status_panel.writes
+
+        self.mock_main_window.update_data()
+        self.mock_main_window.handle_timer()
+
+        self.assertEqual(self.mock_main_window.status_panel.writes, writes)
+        self.assertEqual(self.mock_main_window.machine_state_bar.palette().color(QPalette.Base).name(), "#008000")
+
+    def test_status_engine_reports_failures(self):
+        engine = StatusEngine()
+        failures = []
+        engine.failed.connect(failures.append)
+        self.mock_request_get.side_effect = ConnectionError("API down")
+
+        engine.list_machines(API_KEY)
+        engine.stop()
+        engine.run()
+
+        self.assertEqual(len(failures), 1)
+        self.assertIsInstance(failures[0], ConnectionError)
+
     if __name__ == '__main__':
         unittest.main()
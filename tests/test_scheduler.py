@@ -0,0 +1,97 @@
+import unittest
+
+from remoteplay.scheduler import PollScheduler, FAST_INTERVAL, STEADY_INTERVAL, MAX_INTERVAL, DENSE_INTERVAL
+from remoteplay.transition import estimate
+from tests.fakes import FakeClock
+
+
+class TestPollScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = PollScheduler(self.clock, rng=(lambda: 0.5))
+
+    def test_transition_states_are_polled_fast(self):
+        self.scheduler.observe("starting")
+        self.assertEqual(self.scheduler.next_delay(), FAST_INTERVAL)
+        self.scheduler.observe("starting")
+        self.assertEqual(self.scheduler.next_delay(), FAST_INTERVAL)
+
+    def test_expected_target_state_keeps_polling_fast(self):
+        self.scheduler.expect("ready")
+        self.scheduler.observe("off")
+        self.assertEqual(self.scheduler.next_delay(), FAST_INTERVAL)
+        self.scheduler.observe("ready")
+        self.assertEqual(self.scheduler.next_delay(), STEADY_INTERVAL)
+
+    def test_steady_states_back_off_exponentially(self):
+        delays = []
+        for _ in range(6):
+            self.scheduler.observe("ready")
+            delays.append(self.scheduler.next_delay())
+        self.assertEqual(delays, [STEADY_INTERVAL, 10, 20, 40, MAX_INTERVAL, MAX_INTERVAL])
+
+        self.scheduler.observe("stopping")
+        self.assertEqual(self.scheduler.next_delay(), FAST_INTERVAL)
+        self.scheduler.observe("off")
+        self.assertEqual(self.scheduler.next_delay(), STEADY_INTERVAL)
+
+    def test_errors_back_off_until_a_state_is_seen(self):
+        self.scheduler.observe("starting")
+        delays = []
+        for _ in range(6):
+            self.scheduler.observe_error()
+            delays.append(self.scheduler.next_delay())
+        self.assertEqual(delays, [STEADY_INTERVAL, 10, 20, 40, MAX_INTERVAL, MAX_INTERVAL])
+
+        self.scheduler.observe("starting")
+        self.assertEqual(self.scheduler.next_delay(), FAST_INTERVAL)
+
+    def test_steady_delay_is_jittered(self):
+        low = PollScheduler(self.clock, rng=(lambda: 0.0))
+        high = PollScheduler(self.clock, rng=(lambda: 1.0))
+        low.observe("off")
+        high.observe("off")
+        self.assertLess(low.next_delay(), STEADY_INTERVAL)
+        self.assertGreater(high.next_delay(), STEADY_INTERVAL)
+
+    def test_retry_after_is_respected(self):
+        self.scheduler.observe("starting")
+        self.scheduler.observe_rate_limit({"Retry-After": "30"})
+        self.assertEqual(self.scheduler.next_delay(), 30)
+        self.clock.sleep(25)
+        self.assertEqual(self.scheduler.next_delay(), 5)
+        self.clock.sleep(10)
+        self.assertEqual(self.scheduler.next_delay(), FAST_INTERVAL)
+
+    def test_exhausted_rate_limit_waits_for_reset(self):
+        self.scheduler.observe("starting")
+        self.scheduler.observe_rate_limit({"X-RateLimit-Remaining": "0", "X-RateLimit-Reset": "1700000012"})
+        self.assertEqual(self.scheduler.next_delay(), 12)
+
+        self.scheduler = PollScheduler(self.clock)
+        self.scheduler.observe("starting")
+        self.scheduler.observe_rate_limit({"X-RateLimit-Remaining": "10", "X-RateLimit-Reset": "12"})
+        self.assertEqual(self.scheduler.next_delay(), FAST_INTERVAL)
+
+
+    def test_polls_are_dense_around_expected_end(self):
+        self.scheduler.expect("ready", eta=120, window=10)
+        polls = []
+        self.scheduler.observe("starting")
+        while self.clock.elapsed < 140:
+            self.clock.sleep(self.scheduler.next_delay())
+            polls.append(self.clock.elapsed)
+
+        self.assertEqual(polls[:4], [60, 90, 105, 110])
+        self.assertEqual(polls[4] - polls[3], DENSE_INTERVAL)
+        self.assertEqual(polls[-1] - polls[-2], FAST_INTERVAL)
+        self.assertLess(len(polls), 140 / FAST_INTERVAL)
+
+    def test_estimate(self):
+        self.assertIsNone(estimate([]))
+        self.assertEqual(estimate([100, 120, 90]), (100, 15))
+        self.assertEqual(estimate([100]), (100, 5))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,117 @@
+import os
+import subprocess
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from remoteplay.sshconfig import SshConfigResolver, resolve_address, resolve_hostname
+from remoteplay.sshtunnel import determine_host_name
+
+
+class TestSshConfigResolver(unittest.TestCase):
+
+    def setUp(self):
+        self.ssh_dir = tempfile.TemporaryDirectory()
+        self.config = os.path.join(self.ssh_dir.name, "config")
+        self.resolver = SshConfigResolver(self.config, os.path.join(self.ssh_dir.name, "ssh_config"))
+
+    def tearDown(self):
+        self.ssh_dir.cleanup()
+
+    def write(self, name, text):
+        with open(os.path.join(self.ssh_dir.name, name), "w") as config_file:
+            config_file.write(text)
+
+    def test_alias_without_entry_resolves_to_itself(self):
+        self.assertEqual(self.resolver.hostname("Arcturus"), "arcturus")
+
+    def test_first_matching_host_wins(self):
+        self.write("config", "Host arcturus\n"
+                             "   HostName 10.11.12.13\n"
+                             "   User remoteuser\n"
+                             "Host arc* !arcade\n"
+                             "   HostName wildcard.example.com\n"
+                             "Host *\n"
+                             "   HostName=%h.example.com\n")
+
+        self.assertEqual(self.resolver.hostname("arcturus"), "10.11.12.13")
+        self.assertEqual(self.resolver.hostname("arcanum"), "wildcard.example.com")
+        self.assertEqual(self.resolver.hostname("arcade"), "arcade.example.com")
+        self.assertEqual(self.resolver.user("arcturus"), "remoteuser")
+        self.assertIsNone(self.resolver.user("arcade"))
+
+    def test_host_patterns_match_the_case_like_ssh(self):
+        self.write("config", "Host arcturus\n"
+                             "   HostName 10.11.12.13\n"
+                             "Host Vega\n"
+                             "   HostName Vega.Example\n"
+                             "Match host VEGA.example\n"
+                             "   Port 2222\n")
+
+        # ssh -G Arcturus skips "Host arcturus" and reports the lowercased name as given
+        self.assertEqual(self.resolver.hostname("Arcturus"), "arcturus")
+        self.assertEqual(self.resolver.hostname("vega"), "vega")
+        self.assertEqual(self.resolver.hostname("Vega"), "vega.example")
+        self.assertEqual(self.resolver.port("Vega"), 2222)
+
+    def test_identity_files(self):
+        self.write("config", "Host arcturus\n"
+                             "   IdentityFile ~/.ssh/id_remotegaming\n")
+
+        self.assertEqual(self.resolver.identity_files("arcturus"),
+                         [os.path.join(os.path.expanduser("~"), ".ssh", "id_remotegaming")])
+        self.assertEqual(self.resolver.identity_files("arcade"), [])
+
+    def test_include_and_match(self):
+        os.mkdir(os.path.join(self.ssh_dir.name, "config.d"))
+        self.write("config", "Include config.d/*\n"
+                             "Match originalhost psabc host psabc\n"
+                             "   HostName 74.82.29.115\n")
+        self.write("config.d/gaming", 'Host "arcturus"\n'
+                                      "   HostName arcturus.example.com\n")
+
+        self.assertEqual(self.resolver.hostname("arcturus"), "arcturus.example.com")
+        self.assertEqual(self.resolver.hostname("psabc"), "74.82.29.115")
+
+    def test_changed_file_is_read_again(self):
+        self.write("config", "Host arcturus\n   HostName 10.11.12.13\n")
+        self.assertEqual(self.resolver.hostname("arcturus"), "10.11.12.13")
+
+        self.write("config", "Host arcturus\n   HostName 10.11.12.14\n")
+        os.utime(self.config, ns=(0, 1))
+        self.assertEqual(self.resolver.hostname("arcturus"), "10.11.12.14")
+
+    @patch("remoteplay.sshconfig.subprocess.run")
+    def test_unsupported_match_falls_back_to_ssh(self, mock_run):
+        self.write("config", "Match exec \"true\"\n   HostName 10.11.12.13\n")
+        mock_run.return_value.stdout = "user me\nhostname 10.11.12.13\nport 2222\n"
+
+        with patch("remoteplay.sshconfig.resolver", self.resolver):
+            self.assertEqual(resolve_hostname("arcturus"), "10.11.12.13")
+            self.assertEqual(resolve_address("arcturus"), ("10.11.12.13", 2222))
+        self.assertEqual(self.resolver.user("arcturus"), "me")
+        self.assertEqual(mock_run.call_args.args[0], ["ssh", "-G", "arcturus"])
+        self.assertEqual(mock_run.call_count, 1)
+
+        self.write("config", "Match exec \"false\"\n   HostName 10.11.12.14\n")
+        os.utime(self.config, ns=(0, 1))
+        mock_run.return_value.stdout = "hostname 10.11.12.14\n"
+        self.assertEqual(self.resolver.hostname("arcturus"), "10.11.12.14")
+        self.assertEqual(mock_run.call_count, 2)
+
+    @patch("remoteplay.sshconfig.subprocess.run", side_effect=subprocess.TimeoutExpired("ssh", 10))
+    def test_ssh_timeout_is_not_kept(self, mock_run):
+        self.write("config", "Match exec \"true\"\n   HostName 10.11.12.13\n")
+
+        self.assertIsNone(self.resolver.hostname("arcturus"))
+        self.assertIsNone(self.resolver.hostname("arcturus"))
+        self.assertEqual(mock_run.call_count, 2)
+
+    @patch("remoteplay.sshtunnel.resolve_hostname", return_value=None)
+    def test_ip_fallback_returns_connector(self, mock_resolve):
+        self.assertEqual(determine_host_name("Arcturus", "psabc", "74.82.29.115"), ("public_ip", "74.82.29.115"))
+        self.assertEqual(determine_host_name("Arcturus", "psabc", None), (None, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
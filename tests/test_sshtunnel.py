@@ -0,0 +1,275 @@
+import os
+import socket
+import tempfile
+import threading
+import unittest
+from unittest.mock import Mock, patch
+
+from remoteplay.sshtunnel import SshTunnel, TunnelSupervisor, MULTIPLEXING, control_path, forward_reachable, \
+    free_port, parse_forwards, probe_forwards_through, remove_stale_control_sockets, ssh_banner_probe
+from tests.fakes import FakeClock
+
+
+class TestForwards(unittest.TestCase):
+
+    def test_parse(self):
+        forwards = parse_forwards("-R 7575:localhost:7575, -L 127.0.0.1:8080:localhost:80\n-D 1080")
+        self.assertEqual([str(f) for f in forwards], ["-R 7575:localhost:7575", "-L 127.0.0.1:8080:localhost:80",
+                                                      "-D 1080"])
+        self.assertEqual([f.address for f in forwards], [("localhost", "7575"), ("127.0.0.1", "8080"), ("", "1080")])
+
+    def test_invalid_forwards_are_rejected(self):
+        for text in ("", "-X 1:a:2", "-L 8080", "-R a:localhost:b", "-D 1:2:3"):
+            with self.assertRaises(ValueError):
+                parse_forwards(text)
+
+    def test_health(self):
+        listener = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(listener.close)
+        tunnel = Mock(forwards=parse_forwards(f"-R 9000:127.0.0.1:{listener.getsockname()[1]}, "
+                                              f"-L 127.0.0.1:{free_port()}:localhost:80"))
+
+        self.assertTrue(probe_forwards_through(tunnel, lambda forward: True))
+        self.assertEqual(set(tunnel.health.values()), {"open"})
+        self.assertFalse(probe_forwards_through(tunnel, lambda forward: forward.kind == "-L"))
+        self.assertEqual(list(tunnel.health.values()), ["down", "open"])
+        self.assertFalse(probe_forwards_through(tunnel, lambda forward: forward.kind == "-R"))
+
+    def test_remote_forward_to_a_stopped_service_is_no_reason_to_reconnect(self):
+        tunnel = Mock(forwards=parse_forwards(f"-R 9000:127.0.0.1:{free_port()}"))
+
+        self.assertTrue(probe_forwards_through(tunnel, lambda forward: False))
+        self.assertEqual(tunnel.health, {f"{tunnel.forwards[0]}": "down"})
+
+
+class TestForwardReachable(unittest.TestCase):
+
+    def listen(self, keep_open):
+        listener = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(listener.close)
+        connections = []
+
+        def accept():
+            connection, _ = listener.accept()
+            connections.append(connection)
+            if not keep_open:
+                connection.close()
+        threading.Thread(target=accept, daemon=True).start()
+        self.addCleanup(lambda: [c.close() for c in connections])
+        return listener.getsockname()
+
+    def test_refused_channel_closes_the_connection(self):
+        self.assertTrue(forward_reachable(self.listen(keep_open=True)))
+        self.assertFalse(forward_reachable(self.listen(keep_open=False)))
+        self.assertFalse(forward_reachable(("127.0.0.1", free_port())))
+
+
+class TestBannerProbe(unittest.TestCase):
+
+    def answer(self, greeting):
+        listener = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(listener.close)
+
+        def accept():
+            connection, _ = listener.accept()
+            connection.sendall(greeting)
+            connection.close()
+        threading.Thread(target=accept, daemon=True).start()
+        with patch("remoteplay.sshtunnel.resolve_address", return_value=listener.getsockname()):
+            return ssh_banner_probe(lambda: "arcturus", timeout=1)()
+
+    def test_sshd_is_recognized_by_its_banner(self):
+        self.assertTrue(self.answer(b"SSH-2.0-OpenSSH_9.6\r\n"))
+        self.assertFalse(self.answer(b"HTTP/1.1 400 Bad Request\r\n"))
+
+    def test_no_host(self):
+        self.assertFalse(ssh_banner_probe(lambda: None)())
+
+
+class TunnelTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.config_dir = tempfile.TemporaryDirectory()
+        self.patchers = [
+            patch("remoteplay.sshtunnel.get_config_dir", return_value=self.config_dir.name),
+            patch("remoteplay.sshtunnel.subprocess.Popen"),
+            patch("remoteplay.sshtunnel.subprocess.run"),
+        ]
+        mocks = [p.start() for p in self.patchers]
+        self.mock_popen = mocks[1]
+        self.mock_run = mocks[2]
+        self.mock_run.return_value.returncode = 0
+        self.return_code = None
+        self.mock_popen.return_value.poll.side_effect = (lambda: self.return_code)
+        self.healthy = True
+        self.clock = FakeClock()
+        self.tunnel = SshTunnel()
+        self.tunnel.host_provider = (lambda: "arcturus")
+
+    def tearDown(self):
+        for p in self.patchers:
+            p.stop()
+        self.config_dir.cleanup()
+
+
+@unittest.skipUnless(MULTIPLEXING, "ssh connection multiplexing is not available")
+class TestSshTunnel(TunnelTestCase):
+
+    def test_reopen_reuses_master(self):
+        self.tunnel.open()
+        self.assertEqual(self.tunnel.check(), "open")
+        self.assertIn(f"ControlPath={control_path('arcturus')}", self.mock_popen.call_args.args[0])
+
+        self.tunnel.close()
+        self.assertEqual(self.tunnel.check(), "closed")
+        self.tunnel.open()
+        self.assertEqual(self.tunnel.check(), "open")
+
+        self.assertEqual(self.mock_popen.call_count, 1)
+        self.assertEqual([c.args[0][4] for c in self.mock_run.call_args_list], ["cancel", "forward"])
+        self.mock_popen.return_value.terminate.assert_not_called()
+
+    def test_failed_forward_restarts_master(self):
+        self.tunnel.open()
+        self.tunnel.close()
+        self.mock_run.return_value.returncode = 255
+        self.tunnel.open()
+
+        self.assertEqual(self.mock_popen.call_count, 2)
+        self.assertEqual(self.tunnel.check(), "open")
+
+    def test_all_forwards_share_one_connection(self):
+        self.tunnel = SshTunnel(parse_forwards("-R 7575:localhost:7575, -L 8080:localhost:80"))
+        self.tunnel.host_provider = (lambda: "arcturus")
+        self.tunnel.open()
+        self.tunnel.close()
+
+        command = self.mock_popen.call_args.args[0]
+        self.assertEqual(command[2:6], ["-R", "7575:localhost:7575", "-L", "8080:localhost:80"])
+        self.assertEqual(self.mock_run.call_args.args[0][5:9], ["-R", "7575:localhost:7575", "-L", "8080:localhost:80"])
+        self.assertEqual(self.tunnel.forward_states(), {"-R 7575:localhost:7575": "closed",
+                                                        "-L 8080:localhost:80": "closed"})
+
+    def test_remote_forward_is_probed_through_the_master(self):
+        self.tunnel.open()
+        probe_forward = self.tunnel.probe_forwards["-R 7575:localhost:7575"]
+        self.assertEqual(self.mock_popen.call_args.args[0][4:6], ["-L", probe_forward.spec])
+        self.assertTrue(probe_forward.spec.endswith(":localhost:7575"))
+
+        self.assertEqual(self.tunnel.forward_states(), {"-R 7575:localhost:7575": "unknown"})
+        with patch("remoteplay.sshtunnel.forward_reachable", return_value=True) as reachable:
+            self.assertTrue(self.tunnel.probe())
+        reachable.assert_called_once_with(probe_forward.listen_address())
+        self.assertEqual(self.tunnel.forward_states(), {"-R 7575:localhost:7575": "open"})
+
+        with patch("remoteplay.sshtunnel.forward_reachable", return_value=False):
+            with patch("remoteplay.sshtunnel.target_up", return_value=True):
+                self.assertFalse(self.tunnel.probe())
+            self.assertEqual(self.tunnel.forward_states(), {"-R 7575:localhost:7575": "down"})
+            # the USB server is not running, which a reconnect does not help
+            with patch("remoteplay.sshtunnel.target_up", return_value=False):
+                self.assertTrue(self.tunnel.probe())
+        # probes start no ssh -O processes
+        self.mock_run.assert_not_called()
+
+    def test_shutdown_ends_master(self):
+        self.tunnel.open()
+        self.tunnel.shutdown()
+
+        self.mock_popen.return_value.terminate.assert_called_once()
+        self.assertEqual(self.tunnel.check(), "closed")
+        self.mock_run.assert_not_called()
+
+    def test_stale_control_sockets_are_removed(self):
+        os.makedirs(os.path.dirname(control_path("arcturus")))
+        live = control_path("arcturus")
+        stale = os.path.join(os.path.dirname(live), "99999999-0123456789ab")
+        for path in (live, stale):
+            open(path, "w").close()
+
+        with patch("psutil.pid_exists", return_value=False):
+            remove_stale_control_sockets()
+
+        self.assertTrue(os.path.exists(live))
+        self.assertFalse(os.path.exists(stale))
+
+
+class TestTunnelSupervisor(TunnelTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.supervisor = TunnelSupervisor(self.tunnel, probe=(lambda: self.healthy), clock=self.clock,
+                                           min_backoff=1, max_backoff=4)
+
+    def test_closed_tunnel_is_left_alone(self):
+        self.assertEqual(self.supervisor.check(), "closed")
+        self.mock_popen.assert_not_called()
+
+    def test_dead_tunnel_is_restarted(self):
+        self.tunnel.open()
+        self.assertEqual(self.supervisor.check(), "open")
+
+        self.return_code = 255
+        self.clock.elapsed = 10
+        self.assertEqual(self.supervisor.check(), "reconnecting")
+        self.assertEqual(self.mock_popen.call_count, 2)
+
+        self.return_code = None
+        self.clock.elapsed = 11.5
+        self.assertEqual(self.supervisor.check(), "open")
+        self.assertEqual(self.supervisor.stats(), {"reconnects": 1, "downtime": 1.5})
+
+    def test_one_failed_probe_is_tolerated(self):
+        self.tunnel.open()
+        self.healthy = False
+        self.assertEqual(self.supervisor.check(), "open")
+        self.mock_run.return_value.returncode = 255
+        self.assertEqual(self.supervisor.check(), "reconnecting")
+        self.assertEqual(self.mock_popen.call_count, 2)
+        self.mock_popen.return_value.terminate.assert_called_once()
+
+    @unittest.skipUnless(MULTIPLEXING, "ssh connection multiplexing is not available")
+    def test_answering_master_only_gets_its_forwards_again(self):
+        self.tunnel.open()
+        self.healthy = False
+        self.supervisor.check()
+        self.assertEqual(self.supervisor.check(), "reconnecting")
+
+        self.assertEqual([c.args[0][4] for c in self.mock_run.call_args_list], ["check", "cancel", "forward"])
+        self.assertEqual(self.mock_popen.call_count, 1)
+        self.mock_popen.return_value.terminate.assert_not_called()
+        self.assertEqual(self.tunnel.check(), "open")
+
+    @unittest.skipUnless(MULTIPLEXING, "ssh connection multiplexing is not available")
+    def test_master_of_another_host_is_replaced(self):
+        self.tunnel.open()
+        self.tunnel.host_provider = (lambda: "74.82.29.115")
+        self.tunnel.restart()
+
+        self.mock_run.assert_not_called()
+        self.assertEqual(self.mock_popen.call_count, 2)
+        self.assertEqual(self.mock_popen.call_args.args[0][-1], "74.82.29.115")
+
+    def test_reconnects_back_off(self):
+        self.tunnel.open()
+        self.return_code = 255
+        attempts = []
+        for step in range(16):
+            self.clock.elapsed = step * 0.5
+            before = self.mock_popen.call_count
+            self.supervisor.check()
+            if self.mock_popen.call_count > before:
+                attempts.append(self.clock.elapsed)
+        self.assertEqual(attempts, [0, 1, 3, 7])
+
+    def test_closing_stops_reconnects(self):
+        self.tunnel.open()
+        self.return_code = 255
+        self.tunnel.close()
+        self.assertEqual(self.supervisor.check(), "closed")
+        self.tunnel.restart()
+        self.assertEqual(self.mock_popen.call_count, 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
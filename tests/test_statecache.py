@@ -0,0 +1,106 @@
+import json
+import os
+import tempfile
+import unittest
+
+from remoteplay.statecache import StateCache, STATE_MAX_AGE
+from tests.fakes import FakeClock
+
+MACHINES = [{"id": "pskwujgcp", "name": "Arcturus", "state": "off", "publicIp": "74.82.29.115"}]
+
+
+class TestStateCache(unittest.TestCase):
+
+    def setUp(self):
+        self.state_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.state_dir.name, "state.json")
+        self.clock = FakeClock()
+
+    def tearDown(self):
+        self.state_dir.cleanup()
+
+    def test_round_trip(self):
+        cache = StateCache(self.path, self.clock.time)
+        cache.set_machines("MOCK_KEY", MACHINES)
+        cache.set_connection("pskwujgcp", "74.82.29.115", "machine_name", "arcturus.example.com")
+        cache.set_state("pskwujgcp", "ready")
+
+        loaded = StateCache(self.path, self.clock.time).load()
+        self.assertEqual(loaded.machines("MOCK_KEY"), MACHINES)
+        self.assertEqual(loaded.connection("pskwujgcp", "74.82.29.115"), ("machine_name", "arcturus.example.com"))
+        self.assertEqual(loaded.state("pskwujgcp"), "ready")
+        self.assertNotIn("MOCK_KEY", open(self.path).read())
+
+    def test_other_account_is_not_shown(self):
+        cache = StateCache(self.path, self.clock.time)
+        cache.set_machines("MOCK_KEY", MACHINES)
+
+        self.assertIsNone(cache.machines("OTHER_KEY"))
+
+    def test_switching_accounts_keeps_the_history(self):
+        cache = StateCache(self.path, self.clock.time)
+        cache.set_machines("MOCK_KEY", MACHINES)
+        cache.add_duration("pskwujgcp", "start", 100)
+        cache.add_session("pskwujgcp")
+        cache.set_machines("OTHER_KEY", [])
+        cache.set_machines("MOCK_KEY", MACHINES)
+
+        loaded = StateCache(self.path, self.clock.time).load()
+        self.assertEqual(loaded.machines("MOCK_KEY"), MACHINES)
+        self.assertEqual(loaded.machines("OTHER_KEY"), [])
+        self.assertEqual(loaded.durations("pskwujgcp", "start"), [100])
+        self.assertEqual(loaded.sessions("pskwujgcp"), [1700000000])
+
+    def test_version_1_files_are_upgraded(self):
+        cache = StateCache(self.path, self.clock.time)
+        cache.set_machines("MOCK_KEY", MACHINES)
+        account, = cache.data["machines"]
+        with open(self.path, "w") as state_file:
+            json.dump({"version": 1, "account": account, "machines": cache.data["machines"][account], "states": {},
+                       "connections": {}, "routes": {}, "durations": {"pskwujgcp/start": [100]}, "sessions": {}},
+                      state_file)
+
+        loaded = StateCache(self.path, self.clock.time).load()
+        self.assertEqual(loaded.machines("MOCK_KEY"), MACHINES)
+        self.assertEqual(loaded.durations("pskwujgcp", "start"), [100])
+
+    def test_stale_entries_are_ignored(self):
+        cache = StateCache(self.path, self.clock.time)
+        cache.set_state("pskwujgcp", "ready")
+        cache.set_connection("pskwujgcp", "74.82.29.115", "machine_name", "arcturus.example.com")
+
+        self.clock.elapsed += STATE_MAX_AGE + 1
+        self.assertIsNone(cache.state("pskwujgcp"))
+        self.assertIsNone(cache.connection("pskwujgcp", "74.82.29.116"))
+        self.assertIsNotNone(cache.connection("pskwujgcp", "74.82.29.115"))
+
+    def test_durations_keep_recent_history(self):
+        cache = StateCache(self.path, self.clock.time)
+        for seconds in range(12):
+            cache.add_duration("pskwujgcp", "start", 100 + seconds)
+
+        durations = StateCache(self.path, self.clock.time).load().durations("pskwujgcp", "start")
+        self.assertEqual(durations, list(range(102, 112)))
+        self.assertEqual(cache.durations("pskwujgcp", "stop"), [])
+
+    def test_sessions_are_kept_per_machine(self):
+        cache = StateCache(self.path, self.clock.time)
+        cache.add_session("pskwujgcp")
+        cache.add_session("pskwujgcp", 1700003600.4)
+
+        loaded = StateCache(self.path, self.clock.time).load()
+        self.assertEqual(loaded.sessions("pskwujgcp"), [1700000000, 1700003600])
+        self.assertEqual(loaded.sessions("other"), [])
+
+    def test_unreadable_or_old_files_are_ignored(self):
+        with open(self.path, "w") as state_file:
+            state_file.write("{not json")
+        self.assertIsNone(StateCache(self.path, self.clock.time).load().machines("MOCK_KEY"))
+
+        with open(self.path, "w") as state_file:
+            json.dump({"version": 0, "machines": MACHINES}, state_file)
+        self.assertIsNone(StateCache(self.path, self.clock.time).load().machines("MOCK_KEY"))
+
+
+if __name__ == '__main__':
+    unittest.main()
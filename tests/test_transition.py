@@ -0,0 +1,92 @@
+import threading
+import unittest
+from time import sleep
+from unittest.mock import patch
+
+from remoteplay.transition import MachineActions, MachineTransition
+from tests.fakes import FakeClock
+
+
+class TestMachineActions(unittest.TestCase):
+
+    def setUp(self):
+        self.state = "off"
+        self.booted = threading.Event()
+        self.patches = []
+        self.patchers = [
+            patch("remoteplay.transition.check_state", side_effect=self.check_state),
+            patch("remoteplay.transition.request_patch", side_effect=(lambda path, key: self.patches.append(path))),
+        ]
+        for p in self.patchers:
+            p.start()
+        self.actions = MachineActions()
+        self.results = {}
+
+    def tearDown(self):
+        self.booted.set()
+        for p in self.patchers:
+            p.stop()
+
+    def check_state(self, machine_id, api_key):
+        if self.patches and self.booted.is_set():
+            self.state = {"start": "ready", "stop": "off"}[self.patches[-1].split("/")[1]]
+        elif self.patches:
+            self.state = "starting" if self.patches[-1].endswith("start") else "stopping"
+        return self.state
+
+    def run_transition(self, name, action):
+        transition = MachineTransition("pskwujgcp", "MOCK_KEY", action, FakeClock(pause=0.01), actions=self.actions)
+        thread = threading.Thread(target=(lambda: self.results.setdefault(name, transition.run(lambda s: None))))
+        thread.start()
+        return transition, thread
+
+    def wait_for(self, condition):
+        for _ in range(500):
+            if condition():
+                return
+            sleep(0.01)
+        self.fail("Timed out")
+
+    def test_identical_actions_send_one_patch(self):
+        first, first_thread = self.run_transition("first", "start")
+        self.wait_for(lambda: self.patches)
+        second, second_thread = self.run_transition("second", "start")
+        self.booted.set()
+        first_thread.join()
+        second_thread.join()
+
+        self.assertEqual(self.patches, ["pskwujgcp/start"])
+        self.assertEqual(self.results, {"first": True, "second": True})
+
+    def test_newest_queued_action_replaces_older_one(self):
+        first, first_thread = self.run_transition("first", "start")
+        self.wait_for(lambda: self.patches)
+        stop, stop_thread = self.run_transition("stop", "stop")
+        self.wait_for(lambda: self.actions.pending.get("pskwujgcp") is stop)
+        start, start_thread = self.run_transition("start", "start")
+        stop_thread.join()
+        self.booted.set()
+        first_thread.join()
+        start_thread.join()
+
+        self.assertEqual(self.results, {"first": True, "stop": False, "start": True})
+        self.assertEqual(self.patches, ["pskwujgcp/start"])
+
+    def test_queued_action_can_be_cancelled(self):
+        first, first_thread = self.run_transition("first", "start")
+        self.wait_for(lambda: self.patches)
+        stop, stop_thread = self.run_transition("stop", "stop")
+        self.wait_for(lambda: self.actions.busy("pskwujgcp") and "pskwujgcp" in self.actions.pending)
+
+        self.assertTrue(self.actions.cancel("pskwujgcp"))
+        stop_thread.join()
+        self.assertFalse(self.actions.cancel("pskwujgcp"))
+        self.booted.set()
+        first_thread.join()
+
+        self.assertEqual(self.results, {"first": True, "stop": False})
+        self.assertFalse(self.actions.busy("pskwujgcp"))
+
+
+if __name__ == '__main__':
+    unittest.main()
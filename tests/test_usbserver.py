@@ -0,0 +1,57 @@
+import unittest
+from unittest.mock import patch, Mock
+
+from remoteplay.usbserver import UsbServer
+
+
+class TestUsbServer(unittest.TestCase):
+
+    def setUp(self):
+        self.psutil_patcher = patch("psutil.process_iter")
+        self.mock_process_iter = self.psutil_patcher.start()
+        self.popen_patcher = patch("remoteplay.usbserver.subprocess.Popen")
+        self.mock_popen = self.popen_patcher.start()
+        self.usb_server = UsbServer("/opt/vhusbd")
+
+    def tearDown(self):
+        self.psutil_patcher.stop()
+        self.popen_patcher.stop()
+
+    def test_started_process_is_checked_without_scan(self):
+        self.mock_process_iter.return_value = []
+        self.mock_popen.return_value.poll.return_value = None
+
+        self.usb_server.start()
+        self.mock_process_iter.reset_mock()
+
+        self.assertEqual(self.usb_server.get_status(), "active")
+        self.assertEqual(self.usb_server.get_status(), "active")
+        self.mock_process_iter.assert_not_called()
+        self.mock_popen.assert_called_once_with("/opt/vhusbd")
+
+    def test_external_process_is_cached(self):
+        server = Mock(info={"name": "vhusbdx86_64"})
+        server.is_running.return_value = True
+        self.mock_process_iter.return_value = [Mock(info={"name": None}), Mock(info={"name": "bash"}), server]
+
+        self.assertEqual(self.usb_server.get_status(), "active")
+        self.assertEqual(self.usb_server.get_status(), "active")
+        self.assertEqual(self.mock_process_iter.call_count, 1)
+
+        server.is_running.return_value = False
+        self.mock_process_iter.return_value = []
+        self.assertEqual(self.usb_server.get_status(), "inactive")
+        self.assertEqual(self.mock_process_iter.call_count, 2)
+
+    def test_exited_process_falls_back_to_scan(self):
+        self.mock_process_iter.return_value = []
+        self.mock_popen.return_value.poll.return_value = 1
+
+        self.usb_server.start()
+
+        self.assertEqual(self.usb_server.get_status(), "inactive")
+        self.assertEqual(self.mock_process_iter.call_count, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+from PyQt5.QtGui import QPalette
+from PyQt5.QtWidgets import QApplication, QLineEdit
+
+from remoteplay.viewmodel import StatusPanel, StatusViewModel, machine_state_field, text_field, tunnel_field, \
+    usb_server_field, GRAY, GREEN, RED, YELLOW
+
+app = QApplication.instance() or QApplication([])
+
+STATS = {"reconnects": 2, "downtime": 1.5}
+
+
+class TestFields(unittest.TestCase):
+
+    def test_colors(self):
+        self.assertEqual(machine_state_field("ready"), ("ready", GREEN, None))
+        self.assertEqual(machine_state_field("starting")[1], YELLOW)
+        self.assertEqual(usb_server_field("inactive")[1], GRAY)
+        self.assertIsNone(usb_server_field("unknown")[1])
+        self.assertEqual(tunnel_field("error", {}, STATS, {})[1], RED)
+
+    def test_tunnel(self):
+        forwards = {"-R 7575:localhost:7575": "open", "-L 8080:localhost:80": "down"}
+        transport = {"channels": 1, "traffic": {"-R 7575:localhost:7575": {"sent": 10, "received": 20}},
+                     "keepalive_rtt": 0.012}
+
+        text, color, tooltip = tunnel_field("open", forwards, STATS, transport)
+
+        self.assertEqual((text, color), ("open, 1 of 2 forwards down", YELLOW))
+        self.assertEqual(tooltip.splitlines(), ["-R 7575:localhost:7575: open", "-L 8080:localhost:80: down",
+                                                "Reconnects: 2, downtime: 1.5 s",
+                                                "-R 7575:localhost:7575: 10 B sent, 20 B received",
+                                                "Open channels: 1, keepalive: 12 ms"])
+
+
+class TestStatusViewModel(unittest.TestCase):
+
+    def test_diff(self):
+        model = StatusViewModel()
+
+        self.assertEqual(model.diff({"state": ("off", GRAY, None)}), {"state": ((None, None, None),
+                                                                                ("off", GRAY, None))})
+        self.assertEqual(model.diff({"state": ("off", GRAY, None)}), {})
+        self.assertEqual(model.diff({"state": ("unknown", None, None)}), {"state": (("off", GRAY, None),
+                                                                                    ("unknown", GRAY, None))})
+
+
+class TestStatusPanel(unittest.TestCase):
+
+    def setUp(self):
+        self.state_bar = QLineEdit()
+        self.id_text = QLineEdit()
+        self.panel = StatusPanel({"machine_state": self.state_bar, "machine_id": self.id_text})
+
+    def test_only_changed_properties_are_written(self):
+        self.panel.update(machine_state=machine_state_field("off"), machine_id=text_field("pskwujgcp"))
+        self.assertEqual(self.panel.writes, 3)
+        self.assertEqual(self.state_bar.palette().color(QPalette.Base).name(), "#a9a9a9")
+
+        self.panel.update(machine_state=machine_state_field("off"), machine_id=text_field("pskwujgcp"))
+        self.assertEqual(self.panel.writes, 3)
+
+        self.panel.update(machine_state=machine_state_field("starting"), machine_id=text_field("pskwujgcp"))
+        self.assertEqual(self.panel.writes, 5)
+        self.assertEqual(self.state_bar.text(), "starting")
+        self.assertEqual(self.state_bar.palette().color(QPalette.Base).name(), "#ffff00")
+
+        self.panel.update(machine_state=machine_state_field("stopping"))
+        self.assertEqual(self.panel.writes, 6)
+
+
+if __name__ == '__main__':
+    unittest.main()